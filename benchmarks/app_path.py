@@ -0,0 +1,6 @@
+"""Puts fx_trader on sys.path, so benchmarks import the app's modules as utils.*, as the app
+does. Import it before any of them."""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fx_trader"))
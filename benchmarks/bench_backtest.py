@@ -0,0 +1,64 @@
+"""Measures replaying an order script over a long rate tape with the backtester.
+
+Writes a random walk tape as JSON lines, then times reading it alone and replaying a script
+of orders over it, with and without writing the equity curve.
+
+Usage:
+    python benchmarks/bench_backtest.py [--ticks N] [--orders N] [--chunk-size N]
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils.backtest import run_backtest
+from utils.currency import FX_CURRENCY_NAMES
+from utils.rate_sources import RandomWalkRateSource, read_snapshots
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=1_000_000, help="Snapshots in the tape")
+    parser.add_argument("--orders", type=int, default=1_000, help="Orders in the script")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Snapshots valued at a time")
+    args = parser.parse_args()
+
+    source = RandomWalkRateSource(seed=0)
+    start_timestamp = source.timestamp + 1
+    script = "".join(
+        json.dumps({"timestamp": start_timestamp + i * args.ticks // args.orders, "side": "buy" if i % 2 else "sell",
+                    "ccy": FX_CURRENCY_NAMES[i % len(FX_CURRENCY_NAMES)], "quantity": "10"}) + "\n"
+        for i in range(args.orders))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tape.jsonl")
+        with open(path, "w") as file:
+            for _ in range(args.ticks):
+                timestamp, rates = source.fetch()
+                file.write(json.dumps({"timestamp": timestamp, "rates": rates}) + "\n")
+
+        start = time.perf_counter()
+        for _ in read_snapshots(path):
+            pass
+        read = time.perf_counter() - start
+
+        timings = {}
+        for name, equity in (("replay", None), ("replay + equity", io.StringIO())):
+            start = time.perf_counter()
+            summary = run_backtest(read_snapshots(path), io.StringIO(script), io.StringIO(),
+                                   equity=equity, chunk_size=args.chunk_size)
+            timings[name] = time.perf_counter() - start
+
+    print(f"read tape:        {read:8.2f} s, {args.ticks / read:10.0f} ticks/s")
+    for name, elapsed in timings.items():
+        print(f"{name + ":":<18}{elapsed:8.2f} s, {args.ticks / elapsed:10.0f} ticks/s, "
+              f"{(elapsed - read) / args.ticks * 1e6:6.2f} us per tick beyond reading")
+    print(f"orders:           {summary["orders"]}, end value {summary["end_value"]}")
+
+
+if __name__ == "__main__":
+    main()
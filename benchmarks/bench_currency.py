@@ -0,0 +1,118 @@
+"""Micro-benchmarks quantity validation, parsing and Currency construction in utils.currency.
+
+Compares CCY.parse_quantity, which validates and parses in one pass, with the previous
+regular expression validation followed by Currency.from_string. Compares the slotted
+Currency with the previous __dict__ based class for construction time and memory.
+
+Usage:
+    python benchmarks/bench_currency.py [--number N]
+"""
+import argparse
+import re
+import timeit
+import tracemalloc
+from decimal import Decimal, ROUND_DOWN
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils.currency import CCY, BASE_CURRENCY, Currency
+
+QUANTITIES = ["1", "123.45", "0.00", "01.110", "12.345", "abc", "10000", "7."]
+
+
+def regex_valid_quantity(ccy: CCY, quantity: str) -> bool:
+    """CCY.valid_quantity as it was implemented with regular expressions."""
+    if re.search(r"^0+(\.0*)?$", quantity) is not None:
+        return False
+    if ccy.dps == 0:
+        return re.search(r"^0*[0-9]+(\.0*)?$", quantity) is not None
+    if re.search(f"^\\d+(\\.\\d{{0,{ccy.dps}}}0*)?$", quantity) is None:
+        return False
+    return True
+
+
+class DictCurrency:
+    """Currency as it was implemented before __slots__, with a validating setter."""
+    def __init__(self, ccy: CCY, quantity: Decimal):
+        self._ccy = ccy
+        self._name = ccy.name
+        self._quantity = None
+        self.quantity = quantity
+
+    @property
+    def quantity(self):
+        return self._quantity
+
+    @quantity.setter
+    def quantity(self, value: Decimal):
+        if -value.as_tuple().exponent != self._ccy.dps:
+            raise ValueError("Quantity doesn't match decimal places of currency")
+        self._quantity = value
+
+    def to_fx(self, ccy: CCY, fx_rate: Decimal):
+        return DictCurrency(ccy, (self._quantity * fx_rate).quantize(ccy.q, ROUND_DOWN))
+
+
+def allocated_bytes(factory, count: int = 10_000) -> float:
+    """Returns the mean bytes allocated per object created by factory."""
+    tracemalloc.start()
+    objects = [factory() for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size / count
+
+
+def regex_then_decimal():
+    for quantity in QUANTITIES:
+        if regex_valid_quantity(CCY.USD, quantity):
+            Currency.from_string(CCY.USD, quantity)
+
+
+def single_pass():
+    for quantity in QUANTITIES:
+        if (minor := CCY.USD.parse_quantity(quantity)) is not None:
+            Currency.from_minor(CCY.USD, minor)
+
+
+def validate_only():
+    for quantity in QUANTITIES:
+        CCY.USD.valid_quantity(quantity)
+
+
+def regex_validate_only():
+    for quantity in QUANTITIES:
+        regex_valid_quantity(CCY.USD, quantity)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100_000, help="Calls per timing")
+    args = parser.parse_args()
+
+    for name, func in (("regex valid_quantity", regex_validate_only),
+                       ("valid_quantity", validate_only),
+                       ("regex + Currency.from_string", regex_then_decimal),
+                       ("parse_quantity + from_minor", single_pass)):
+        best = min(timeit.repeat(func, number=args.number, repeat=5))
+        print(f"{name:<30} {best / args.number / len(QUANTITIES) * 1e9:8.0f} ns/quantity")
+
+    quantity = Decimal("123.45")
+    rate = Decimal("0.912345")
+    dict_base = DictCurrency(BASE_CURRENCY, quantity)
+    base = Currency(BASE_CURRENCY, quantity)
+    for name, func in (("dict Currency()", lambda: DictCurrency(BASE_CURRENCY, quantity)),
+                       ("slotted Currency()", lambda: Currency(BASE_CURRENCY, quantity)),
+                       ("slotted Currency._trusted()", lambda: Currency._trusted(BASE_CURRENCY, quantity)),
+                       ("dict to_fx", lambda: dict_base.to_fx(CCY.EUR, rate)),
+                       ("slotted to_fx", lambda: base.to_fx(CCY.EUR, rate))):
+        best = min(timeit.repeat(func, number=args.number, repeat=5))
+        print(f"{name:<30} {best / args.number * 1e9:8.0f} ns/call")
+
+    # The Decimal is shared, so this is the size of the Currency object itself
+    print(f"{"dict Currency":<30} {allocated_bytes(lambda: DictCurrency(BASE_CURRENCY, quantity)):8.0f} bytes")
+    print(f"{"slotted Currency":<30} {allocated_bytes(lambda: Currency(BASE_CURRENCY, quantity)):8.0f} bytes")
+
+
+if __name__ == "__main__":
+    main()
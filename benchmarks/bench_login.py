@@ -0,0 +1,87 @@
+"""Measures login throughput of db.check_password under a storm of concurrent logins.
+
+Compares bcrypt on the logging-in threads with the process pool of a PasswordHasher, then
+repeats the logins to show the verification cache, and logs in users hashed at an old work
+factor to show the cost of rehashing on login.
+
+Usage:
+    python benchmarks/bench_login.py [--users N] [--threads N] [--rounds N] [--workers N]
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import time
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils import db, security
+from utils.security import PasswordHasher, hash_password, hash_rounds
+
+PASSWORD = "bench-password"
+
+
+def populate(users: int, rounds: int):
+    """Inserts users sharing one password hash at rounds, without portfolios."""
+    hashed = hash_password(PASSWORD, rounds)
+    with db.connections.transaction() as connection:
+        connection.execute("DELETE FROM users")
+        connection.executemany("INSERT INTO users (id, username, hash) VALUES (?, ?, ?)",
+                               ((uid, f"user{uid}", hashed) for uid in range(1, users + 1)))
+
+
+def run(hasher: PasswordHasher, users: int, threads: int) -> float:
+    """Logs every user in from threads concurrent threads, returning logins per second."""
+    db.password_hasher = hasher
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        assert all(pool.map(lambda uid: db.check_password(f"user{uid}", PASSWORD), range(1, users + 1)))
+    return users / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="Users logged in per run")
+    parser.add_argument("--threads", type=int, default=16, help="Concurrent logins")
+    parser.add_argument("--rounds", type=int, default=security.BCRYPT_ROUNDS, help="bcrypt work factor")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Hashing processes")
+    args = parser.parse_args()
+
+    security.BCRYPT_ROUNDS = args.rounds
+    pending = max(args.threads, 4 * args.workers)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.connections.configure(os.path.join(tmp, "login.db"))
+        db.initialise_db()
+        populate(args.users, args.rounds)
+
+        threaded = run(PasswordHasher(workers=0, max_pending=pending, cache_size=0), args.users, args.threads)
+
+        # Every user has the same hash, so the cache would hit from the second login on
+        pool = PasswordHasher(workers=args.workers, max_pending=pending, cache_size=0)
+        # Starts the processes outside the measured runs
+        pool.verify(PASSWORD, hash_password(PASSWORD, 4))
+        pooled = run(pool, args.users, args.threads)
+        pool.close()
+
+        # Repeat logins, after a first round fills the cache
+        pool = PasswordHasher(workers=args.workers, max_pending=pending, cache_size=args.users)
+        run(pool, args.users, args.threads)
+        cached = run(pool, args.users, args.threads)
+
+        # Users hashed one factor lower are rehashed at --rounds by their first login
+        populate(args.users, args.rounds - 1)
+        rehashing = run(pool, args.users, args.threads)
+        rehashed = sum(hash_rounds(hashed) == args.rounds
+                       for hashed, in db.connections.get().execute("SELECT hash FROM users"))
+        pool.close()
+        db.connections.close()
+
+    print(f"{args.users} logins, {args.threads} threads, {args.rounds} rounds, {args.workers} workers")
+    print(f"threads:      {threaded:8.1f} logins/s")
+    print(f"process pool: {pooled:8.1f} logins/s")
+    print(f"cached:       {cached:8.1f} logins/s")
+    print(f"rehashing:    {rehashing:8.1f} logins/s ({rehashed} of {args.users} rehashed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Measures matching resting limit and stop orders against a stream of rate snapshots.
+
+Loads the resting orders from the database into an OrderMatcher, then feeds it random walk
+snapshots, timing the match pass of each tick on its own and the whole tick including
+filling the triggered orders. Compares the match pass with scanning every resting order.
+
+Usage:
+    python benchmarks/bench_orders.py [--orders N] [--ticks N] [--users N]
+"""
+import argparse
+from datetime import datetime, timedelta
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils import db
+from utils.currency import BASE_CURRENCY, FX_CURRENCIES
+from utils.fx import RateCache
+from utils.matcher import OrderMatcher
+from utils.rate_snapshot import RateSnapshot
+from utils.rate_sources import RandomWalkRateSource
+
+# Standard deviation of the log distance of triggers from the starting rates
+TRIGGER_SPREAD = 0.01
+
+
+def populate(users: int, orders: int, snapshot: RateSnapshot):
+    """Inserts users and orders selling the base currency, directly and without password
+    hashing. Limits rest above the current rate and stops below it."""
+    rng = random.Random(0)
+    created_at = datetime.now().isoformat()
+    with db.connections.transaction() as connection:
+        connection.executemany("INSERT INTO users (id, username, hash) VALUES (?, ?, '')",
+                               ((uid, f"user{uid}") for uid in range(1, users + 1)))
+        connection.executemany("INSERT INTO portfolio (user_id, currency, quantity) VALUES (?, ?, ?)",
+                               ((uid, currency, minor) for uid in range(1, users + 1)
+                                for currency, minor in db.INITIAL_BALANCES))
+        rows = []
+        for _ in range(orders):
+            ccy = rng.choice(FX_CURRENCIES)
+            kind = rng.choice(("limit", "stop"))
+            distance = abs(rng.gauss(0, TRIGGER_SPREAD)) * (1 if kind == "limit" else -1)
+            trigger = float(snapshot.cross(BASE_CURRENCY, ccy)) * math.exp(distance)
+            rows.append((rng.randint(1, users), kind, BASE_CURRENCY.name, rng.randint(1, 10_000),
+                         ccy.name, f"{trigger:.6g}", created_at))
+        connection.executemany("""INSERT INTO orders (user_id, kind, sold_currency, sold_quantity,
+            bought_currency, trigger_rate, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=100_000, help="Resting orders")
+    parser.add_argument("--ticks", type=int, default=1_000, help="Rate snapshots matched")
+    parser.add_argument("--users", type=int, default=1_000, help="Users the orders belong to")
+    args = parser.parse_args()
+
+    source = RandomWalkRateSource(seed=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.connections.configure(os.path.join(tmp, "orders.db"))
+        db.initialise_db()
+        populate(args.users, args.orders, RateSnapshot(*source.fetch()))
+
+        matcher = OrderMatcher(RateCache(source, timedelta(0)))
+        start = time.perf_counter()
+        matcher.sync()
+        load = time.perf_counter() - start
+        resting = list(matcher.book._orders.values())
+
+        match_times = []
+        match = matcher.book.match
+
+        def timed_match(snapshot: RateSnapshot):
+            start = time.perf_counter()
+            crossed = match(snapshot)
+            match_times.append(time.perf_counter() - start)
+            return crossed
+
+        matcher.book.match = timed_match
+        snapshots = [RateSnapshot(*source.fetch()) for _ in range(args.ticks)]
+
+        # Every resting order checked against the first snapshots, for comparison
+        scan_ticks = min(10, args.ticks)
+        start = time.perf_counter()
+        for snapshot in snapshots[:scan_ticks]:
+            sum(order.triggered(snapshot.cross(*order.pair)) for order in resting)
+        scan = (time.perf_counter() - start) / scan_ticks
+
+        fills = 0
+        start = time.perf_counter()
+        for snapshot in snapshots:
+            fills += len(matcher.tick(snapshot))
+        ticks = time.perf_counter() - start
+        still_resting = len(matcher.book)
+        db.connections.close()
+
+    match_times.sort()
+    print(f"load:        {load:8.3f} s for {len(resting)} orders")
+    print(f"match pass:  p50 {statistics.median(match_times) * 1e6:8.1f} us, "
+          f"p99 {match_times[int(len(match_times) * 0.99)] * 1e6:8.1f} us, "
+          f"max {match_times[-1] * 1e6:8.1f} us")
+    print(f"full scan:   {scan * 1e6:8.1f} us per tick")
+    print(f"tick:        {ticks / args.ticks * 1e3:8.3f} ms mean, including fills")
+    print(f"filled:      {fills} over {args.ticks} ticks, {still_resting} still resting")
+
+
+if __name__ == "__main__":
+    main()
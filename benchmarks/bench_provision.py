@@ -0,0 +1,49 @@
+"""Measures creating users one at a time with db.create_user against db.provision_users.
+
+Passwords are hashed once up front and shared, so only database work is timed.
+
+Usage:
+    python benchmarks/bench_provision.py [--users N] [--loop-users N] [--chunk-size N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils import db
+from utils.security import hash_password
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000, help="Users provisioned in bulk")
+    parser.add_argument("--loop-users", type=int, default=5_000,
+                        help="Users created one at a time, extrapolated to --users")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="Users per bulk transaction")
+    args = parser.parse_args()
+
+    hashed = hash_password("bench-password", 4)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.connections.configure(os.path.join(tmp, "loop.db"))
+        db.initialise_db()
+        loop_users = min(args.loop_users, args.users)
+        start = time.perf_counter()
+        for i in range(loop_users):
+            db.create_user(f"user{i}", hashed)
+        loop = (time.perf_counter() - start) * args.users / loop_users
+
+        db.connections.configure(os.path.join(tmp, "bulk.db"))
+        db.initialise_db()
+        start = time.perf_counter()
+        created, _ = db.provision_users(((f"user{i}", hashed) for i in range(args.users)), args.chunk_size)
+        bulk = time.perf_counter() - start
+        db.connections.close()
+
+    print(f"create_user:     {loop:8.2f} s for {args.users} users (extrapolated from {loop_users})")
+    print(f"provision_users: {bulk:8.2f} s for {created} users")
+
+
+if __name__ == "__main__":
+    main()
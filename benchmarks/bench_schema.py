@@ -0,0 +1,76 @@
+"""Measures portfolio lookup and trade latency as the number of users grows.
+
+Runs each population size against the schema before the (user_id, currency) primary key
+was added and against the latest schema. Lookups on the latest schema should stay flat
+(O(log n)) while the old schema grows linearly with a full table scan.
+
+Usage:
+    python benchmarks/bench_schema.py [--users 1000,10000,100000] [--lookups N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils import db
+from utils.currency import CCY, BASE_CURRENCY, Currency
+from utils.user import User
+
+# Schema version before portfolio was keyed on (user_id, currency)
+UNINDEXED_VERSION = 2
+
+
+def populate(users: int):
+    """Inserts users with a full portfolio each, directly and without password hashing."""
+    with db.connections.transaction() as connection:
+        connection.executemany("INSERT INTO users (id, username, hash) VALUES (?, ?, '')",
+                               ((uid, f"user{uid}") for uid in range(1, users + 1)))
+        connection.executemany("INSERT INTO portfolio (user_id, currency, quantity) VALUES (?, ?, ?)",
+                               ((uid, ccy.name, 1_000_000) for uid in range(1, users + 1) for ccy in CCY))
+
+
+def run(path: str, users: int, version: int, lookups: int) -> tuple[float, float]:
+    """Returns mean microseconds per balance lookup and per trade."""
+    db.connections.configure(path)
+    db.migrate(db.connections.get(), version)
+    populate(users)
+
+    uids = [random.randint(1, users) for _ in range(lookups)]
+    traders = [User(uid, f"user{uid}") for uid in uids]
+    start = time.perf_counter()
+    for trader in traders:
+        db.get_currency_owned(CCY.EUR, trader)
+    lookup = (time.perf_counter() - start) / lookups * 1e6
+
+    sold = Currency(BASE_CURRENCY, Decimal("1.00"))
+    bought = Currency(CCY.EUR, Decimal("0.90"))
+    start = time.perf_counter()
+    for uid in uids:
+        db.execute_trade(uid, bought, sold)
+    trade = (time.perf_counter() - start) / lookups * 1e6
+
+    db.connections.close()
+    return lookup, trade
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="1000,10000,100000", help="Comma separated population sizes")
+    parser.add_argument("--lookups", type=int, default=200, help="Lookups and trades per run")
+    args = parser.parse_args()
+
+    print(f"{"users":>10} {"schema":>10} {"lookup us":>12} {"trade us":>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for users in (int(n) for n in args.users.split(",")):
+            for name, version in (("unindexed", UNINDEXED_VERSION), ("latest", len(db.MIGRATIONS))):
+                path = os.path.join(tmp, f"{name}_{users}.db")
+                lookup, trade = run(path, users, version, args.lookups)
+                print(f"{users:>10} {name:>10} {lookup:>12.1f} {trade:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measures the startup cost of the CLI: wall time and peak RSS of importing main.py,
+plus the slowest imports reported by python -X importtime.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--top N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FX_TRADER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fx_trader")
+
+# Imports main without starting the menu and reports the process's peak RSS in KiB
+PROBE = "import main, resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def run_once() -> tuple[float, int]:
+    """Returns wall seconds and peak RSS (KiB) of one interpreter importing main."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=FX_TRADER_DIR,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, int(result.stdout.split()[-1])
+
+
+def slowest_imports(top: int) -> list[tuple[int, str]]:
+    """Returns the top modules by cumulative import time in microseconds."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=FX_TRADER_DIR, capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Interpreter launches to time")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    times = [wall for wall, _ in runs]
+    print(f"startup: median {statistics.median(times) * 1000:.1f} ms, "
+          f"min {min(times) * 1000:.1f} ms over {args.runs} runs")
+    print(f"peak RSS: {max(rss for _, rss in runs) / 1024:.1f} MiB")
+    print("slowest imports (cumulative):")
+    for cumulative, name in slowest_imports(args.top):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Runs the currency, database and trade hot path benchmarks and writes the results as JSON.
+
+Currency benchmarks run once. Database and trade benchmarks run against a synthetic database
+of each population size, with a stub rate source so trades don't touch the network. Each
+benchmark reports operations per second and the mean, p50 and p99 time per operation.
+
+With --baseline, results are compared with a previous run's JSON by median time per operation,
+which is steadier than the mean, and the script exits with status 1 if any is slower by more
+than --tolerance.
+
+Usage:
+    python benchmarks/bench_suite.py [--users 1000,100000,1000000] [--iterations N]
+                                     [-o results.json] [--baseline old.json] [--tolerance 0.2]
+"""
+import argparse
+from datetime import datetime, timezone
+from decimal import Decimal
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils import db
+from utils.currency import CCY, BASE_CURRENCY, Currency
+from utils.fx import rate_cache, set_rate_source
+from utils.rate_sources import RateSource
+from utils.transaction import Transaction
+from utils.user import User
+
+# Calls per timed batch of the currency benchmarks, too fast to time one by one
+MICRO_BATCH = 1_000
+
+QUANTITIES = ["1", "123.45", "0.00", "01.110", "12.345", "abc", "10000", "7."]
+
+
+class StubRateSource(RateSource):
+    """Serves the same rates every fetch, without the network."""
+    def fetch(self):
+        return 1_700_000_000, {"AUD": "1.5", "CAD": "1.36", "CHF": "0.88", "EUR": "0.92",
+                               "GBP": "0.79", "JPY": "150"}
+
+
+def measure(name: str, users: int, func: Callable[[int], None], iterations: int, batch: int = 1) -> dict:
+    """Times iterations calls of func(i), in batches of batch calls, and returns their statistics."""
+    # Warms up caches and prepared statements, with i not reused by the timed calls
+    for i in range(1, min(iterations, 100) + 1):
+        func(-i)
+
+    times = []
+    total = 0.0
+    for i in range(0, iterations, batch):
+        calls = range(i, min(i + batch, iterations))
+        start = time.perf_counter()
+        for j in calls:
+            func(j)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        times.append(elapsed / len(calls))
+    times.sort()
+    return {
+        "name": name,
+        "users": users,
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / total, 1),
+        "mean_us": round(total / iterations * 1e6, 3),
+        "p50_us": round(times[len(times) // 2] * 1e6, 3),
+        "p99_us": round(times[min(len(times) - 1, int(len(times) * 0.99))] * 1e6, 3),
+    }
+
+
+def currency_benchmarks(iterations: int) -> list[dict]:
+    eur = CCY.EUR
+    base = Currency(BASE_CURRENCY, Decimal("1234.56"))
+    fx = Currency(eur, Decimal("1135.80"))
+    rate = Decimal("0.92")
+    benchmarks = {
+        "ccy_valid_quantity": lambda i: eur.valid_quantity(QUANTITIES[i % len(QUANTITIES)]),
+        "currency_from_string": lambda i: Currency.from_string(eur, "1234.56"),
+        "currency_to_fx": lambda i: base.to_fx(eur, rate),
+        "currency_to_base": lambda i: fx.to_base(rate),
+    }
+    return [measure(name, None, func, iterations * MICRO_BATCH // 10, MICRO_BATCH)
+            for name, func in benchmarks.items()]
+
+
+def populate(users: int):
+    """Inserts users with the initial balances, directly and without password hashing."""
+    with db.connections.transaction() as connection:
+        connection.executemany("INSERT INTO users (id, username, hash) VALUES (?, ?, '')",
+                               ((uid, f"user{uid}") for uid in range(1, users + 1)))
+        connection.executemany("INSERT INTO portfolio (user_id, currency, quantity) VALUES (?, ?, ?)",
+                               ((uid, currency, minor) for uid in range(1, users + 1)
+                                for currency, minor in db.INITIAL_BALANCES))
+
+
+def database_benchmarks(path: str, users: int, iterations: int) -> list[dict]:
+    db.connections.configure(path)
+    db.initialise_db()
+    start = time.perf_counter()
+    populate(users)
+    print(f"populated {users} users in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    rng = random.Random(users)
+    # Enough distinct traders that no one runs out of base currency
+    traders = [User(uid, f"user{uid}") for uid in rng.sample(range(1, users + 1), min(users, iterations))]
+
+    def trader(i: int) -> User:
+        return traders[i % len(traders)]
+
+    sold = Currency(BASE_CURRENCY, Decimal("1.00"))
+
+    def execute_trade(i: int):
+        # End to end: cached snapshot, pricing, then the trade and its ledger row
+        fx_rate = rate_cache.snapshot().rate(CCY.EUR)
+        Transaction(sold.to_fx(CCY.EUR, fx_rate), sold, fx_rate).execute(trader(i))
+
+    results = [
+        measure("get_currency_owned", users, lambda i: db.get_currency_owned(CCY.EUR, trader(i)), iterations),
+        measure("update_currencies", users,
+                lambda i: db.update_currencies(CCY.EUR, "1.00", BASE_CURRENCY, "10000.00", trader(i)), iterations),
+        measure("create_user", users, lambda i: db.create_user(f"new{users}_{i}", b""), iterations),
+        measure("transaction_execute", users, execute_trade, iterations),
+    ]
+    db.connections.close()
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """Returns a line for each result slower than its baseline by more than tolerance."""
+    previous = {(result["name"], result["users"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        if (old := previous.get((result["name"], result["users"]))) is None:
+            continue
+        if result["p50_us"] > old["p50_us"] * (1 + tolerance):
+            regressions.append(f"{result["name"]} users={result["users"]}: "
+                               f"p50 {old["p50_us"]} us -> {result["p50_us"]} us")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="1000,100000,1000000", help="Comma separated population sizes")
+    parser.add_argument("--iterations", type=int, default=2_000, help="Operations timed per database benchmark")
+    parser.add_argument("-o", "--output", default="-", help="Results JSON file (default stdout)")
+    parser.add_argument("--baseline", help="Results JSON of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Slowdown of the median allowed before a result counts as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    set_rate_source(StubRateSource())
+    rate_cache.history = False
+
+    results = currency_benchmarks(args.iterations)
+    with tempfile.TemporaryDirectory() as tmp:
+        for users in (int(n) for n in args.users.split(",")):
+            results += database_benchmarks(os.path.join(tmp, f"suite_{users}.db"), users, args.iterations)
+
+    report = {
+        "meta": {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+    print(f"{"benchmark":<22} {"users":>9} {"ops/s":>12} {"mean us":>10} {"p50 us":>10} {"p99 us":>10}", file=sys.stderr)
+    for result in results:
+        print(f"{result["name"]:<22} {result["users"] or "-":>9} {result["ops_per_sec"]:>12.0f} "
+              f"{result["mean_us"]:>10.2f} {result["p50_us"]:>10.2f} {result["p99_us"]:>10.2f}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measures trades per second through Transaction.execute against a scratch database.
+
+Compares the pooled connection layer in utils.db with the previous behaviour of opening
+a fresh connection for every query.
+
+Usage:
+    python benchmarks/bench_trades.py [--trades N]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from decimal import Decimal
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils import db
+from utils.currency import CCY, BASE_CURRENCY, Currency
+from utils.transaction import Transaction
+from utils.user import User
+
+
+class PerCallConnections(db.ConnectionPool):
+    """Opens a new, untuned connection on every get(), as utils.db did before pooling."""
+    def get(self) -> sqlite3.Connection:
+        previous = getattr(self._local, "connection", None)
+        if previous is not None:
+            previous.close()
+        connection = sqlite3.connect(self.db_name, isolation_level=None)
+        self._local.connection = connection
+        return connection
+
+
+def run(pool: db.ConnectionPool, trades: int) -> float:
+    """Returns trades per second for the given connection pool."""
+    db.connections = pool
+    db.initialise_db()
+    username = f"bench{time.monotonic_ns()}"
+    db.create_user(username, "not-a-real-hash")
+    trader = User(db.get_user_id(username), username)
+
+    base_sold = Currency(BASE_CURRENCY, Decimal("1.00"))
+    fx_bought = Currency(CCY.EUR, Decimal("0.90"))
+
+    start = time.perf_counter()
+    for _ in range(trades):
+        Transaction(fx_bought, base_sold).execute(trader)
+    elapsed = time.perf_counter() - start
+
+    pool.close()
+    return trades / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=2000, help="Trades executed per run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = run(PerCallConnections(os.path.join(tmp, "per_call.db")), args.trades)
+        after = run(db.ConnectionPool(os.path.join(tmp, "pooled.db")), args.trades)
+
+    print(f"per-call connections: {before:10.0f} trades/s")
+    print(f"pooled connections:   {after:10.0f} trades/s")
+    print(f"speed-up:             {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
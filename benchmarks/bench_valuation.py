@@ -0,0 +1,67 @@
+"""Measures valuing every portfolio in the base currency at one rate snapshot.
+
+Compares utils.valuation.value_portfolios, which reads all balances in one query and
+converts them with NumPy, with a per-user loop over get_portfolio and Portfolio.value,
+and checks that both give the same values.
+
+Usage:
+    python benchmarks/bench_valuation.py [--users N] [--loop-users N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import app_path  # noqa: F401, puts the app's utils on sys.path
+
+from utils import db
+from utils.currency import CCY
+from utils.rate_snapshot import RateSnapshot
+from utils.rate_sources import RandomWalkRateSource
+from utils.valuation import value_portfolios
+
+
+def populate(users: int):
+    """Inserts users with random balances, directly and without password hashing."""
+    rng = random.Random(0)
+    with db.connections.transaction() as connection:
+        connection.executemany("INSERT INTO users (id, username, hash) VALUES (?, ?, '')",
+                               ((uid, f"user{uid}") for uid in range(1, users + 1)))
+        connection.executemany("INSERT INTO portfolio (user_id, currency, quantity) VALUES (?, ?, ?)",
+                               ((uid, ccy.name, rng.randrange(10 ** rng.randint(0, 12)))
+                                for uid in range(1, users + 1) for ccy in CCY))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000, help="Portfolios valued")
+    parser.add_argument("--loop-users", type=int, default=5_000,
+                        help="Portfolios valued by the per-user loop, extrapolated to --users")
+    args = parser.parse_args()
+
+    rates = RateSnapshot(*RandomWalkRateSource(seed=0).fetch()).rates
+    with tempfile.TemporaryDirectory() as tmp:
+        db.connections.configure(os.path.join(tmp, "valuation.db"))
+        db.initialise_db()
+        populate(args.users)
+
+        start = time.perf_counter()
+        valuation = value_portfolios(rates)
+        vectorized = time.perf_counter() - start
+
+        loop_users = min(args.loop_users, args.users)
+        start = time.perf_counter()
+        looped = {uid: db.get_portfolio(f"user{uid}").value(rates) for uid in range(1, loop_users + 1)}
+        loop = (time.perf_counter() - start) * args.users / loop_users
+
+        mismatches = sum(valuation.get(uid) != value for uid, value in looped.items())
+        db.connections.close()
+
+    print(f"vectorized: {vectorized:8.2f} s for {args.users} portfolios")
+    print(f"per-user:   {loop:8.2f} s (extrapolated from {loop_users})")
+    print(f"mismatches: {mismatches} of {loop_users} checked")
+
+
+if __name__ == "__main__":
+    main()
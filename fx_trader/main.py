@@ -1,27 +1,280 @@
+import argparse
+import atexit
+import csv
+from contextlib import nullcontext
 from logging import getLogger
+import json
 import os
-from utils import menu
-from utils.logger import setup_logging
-from utils.db import initialise_db
+import signal
+import sys
+from typing import TextIO
+from utils import batch, export, menu
+from utils.logger import setup_logging, stop_logging
+from utils.db import DatabaseError, initialise_db, release_expired_holds
+from utils.fx import set_rate_source
+from utils.metrics import metrics
+from utils.rate_sources import rate_source_from_config
 
-setup_logging()
 logger = getLogger(__name__)
 
+def print_log_exit(message: str):
+    print(message)
+    logger.error(message)
+    stop_logging()
+    os._exit(1)
+
 def setup():
     """Set up the environment for the application."""
-    def print_log_exit(message: str):
-        print(message)
-        logger.error(message)
-        os._exit(1)
-
-    if os.getenv("OER_API_KEY") is None:
-        print_log_exit("No API key.")
+    try:
+        set_rate_source(rate_source_from_config(os.getenv("FX_RATE_SOURCE", "oer")))
+    except ValueError as e:
+        print_log_exit(str(e))
+    setup_database()
 
+def setup_database():
+    """Set up the database and metrics, for commands that don't need live rates."""
     if not initialise_db():
         print_log_exit("Failed to initialise database.")
+    try:
+        # Funds held by quotes of sessions that ended without confirming or releasing them
+        release_expired_holds()
+    except DatabaseError:
+        logger.warning("Couldn't release expired holds.", exc_info=True)
+
+    setup_metrics()
+
+def setup_metrics():
+    """Exports metrics to FX_METRICS_FILE if set, and dumps them to stderr on SIGUSR1."""
+    if path := os.getenv("FX_METRICS_FILE"):
+        metrics.start_exporter(path, float(os.getenv("FX_METRICS_INTERVAL", "15")))
+        atexit.register(metrics.stop_exporter)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: sys.stderr.write(metrics.to_prometheus()))
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="fx-trader",
+        description="Trade FX from the command line. Starts the interactive menu if no command is given.")
+    commands = parser.add_subparsers(dest="command")
+
+    batch_parser = commands.add_parser("batch", help="Execute orders from a file or stdin without the menu")
+    batch_parser.add_argument("orders", nargs="?", default="-",
+                              help="Orders file with fields user, side, ccy, quantity, or - for stdin (default)")
+    batch_parser.add_argument("-o", "--output", default="-",
+                              help="Results file, or - for stdout (default)")
+    batch_parser.add_argument("--format", choices=batch.FORMATS,
+                              help="Format of orders and results. Defaults to csv for .csv files, otherwise jsonl")
+    batch_parser.add_argument("--chunk-size", type=int, default=500,
+                              help="Orders executed per database transaction (default 500)")
+
+    value_parser = commands.add_parser("value", help="Value portfolios in the base currency at the current rates")
+    value_parser.add_argument("users", nargs="*", type=int,
+                              help="User ids to value. Defaults to all users")
+    value_parser.add_argument("-o", "--output", default="-",
+                              help="CSV file of user_id and value, or - for stdout (default)")
+
+    export_parser = commands.add_parser("export", help="Stream the portfolio or trades table to a file")
+    export_parser.add_argument("table", choices=tuple(export.TABLES), help="Table to export")
+    export_parser.add_argument("users", nargs="*", type=int,
+                               help="User ids to export. Defaults to all users")
+    export_parser.add_argument("-o", "--output", default="-",
+                               help="Output file, or - for stdout (default)")
+    export_parser.add_argument("--format", choices=export.FORMATS,
+                               help="Output format. Defaults to the output file's extension, otherwise csv")
+    export_parser.add_argument("--chunk-size", type=int, default=100_000,
+                               help="Rows read and written at a time (default 100000)")
+
+    backtest_parser = commands.add_parser(
+        "backtest", help="Replay orders over a recorded rate tape, without the database or a rate source")
+    backtest_parser.add_argument("tape", help="Rate snapshots as JSON lines, or CSV if the file ends in .csv")
+    backtest_parser.add_argument("orders", nargs="?", default="-",
+                                 help="Orders file with fields timestamp, side, ccy, quantity, or - for stdin (default)")
+    backtest_parser.add_argument("-o", "--output", default="-",
+                                 help="Results file, or - for stdout (default)")
+    backtest_parser.add_argument("--format", choices=batch.FORMATS,
+                                 help="Format of orders and results. Defaults to csv for .csv files, otherwise jsonl")
+    backtest_parser.add_argument("--equity", help="CSV file of the portfolio value after each snapshot")
+    backtest_parser.add_argument("--initial", help="Starting balance of the base currency (default a new user's)")
+    backtest_parser.add_argument("--chunk-size", type=int, default=100_000,
+                                 help="Snapshots read and valued at a time (default 100000)")
+
+    provision_parser = commands.add_parser("provision", help="Create users in bulk from a file or stdin")
+    provision_parser.add_argument("accounts", nargs="?", default="-",
+                                  help="Accounts file with fields username, password, or - for stdin (default)")
+    provision_parser.add_argument("--format", choices=batch.FORMATS,
+                                  help="Format of accounts. Defaults to csv for .csv files, otherwise jsonl")
+    provision_parser.add_argument("--chunk-size", type=int, default=10_000,
+                                  help="Accounts hashed and inserted per database transaction (default 10000)")
+    provision_parser.add_argument("--rounds", type=int,
+                                  help="bcrypt work factor. Raised to FX_BCRYPT_ROUNDS on each user's first login")
+
+    match_parser = commands.add_parser("match", help="Fill resting limit and stop orders as the rates tick")
+    match_parser.add_argument("--poll", type=float,
+                              help="Seconds between rate fetches (default FX_RATE_TTL)")
+
+    serve_parser = commands.add_parser("serve", help="Serve the trade engine to clients over line-delimited JSON")
+    loadgen_parser = commands.add_parser("loadgen", help="Run concurrent traders against a running server")
+    for command_parser in (serve_parser, loadgen_parser):
+        command_parser.add_argument("--host", default="127.0.0.1", help="TCP host (default 127.0.0.1)")
+        command_parser.add_argument("--port", type=int, default=8765, help="TCP port (default 8765)")
+        command_parser.add_argument("--unix", help="Unix socket path, used instead of --host and --port")
+    serve_parser.add_argument("--workers", type=int, default=8,
+                              help="Threads for database and password work (default 8)")
+    loadgen_parser.add_argument("--clients", type=int, default=100, help="Concurrent traders (default 100)")
+    loadgen_parser.add_argument("--trades", type=int, default=20, help="Trades per trader (default 20)")
+
+    return parser.parse_args(argv)
+
+def open_text(path: str, mode: str) -> TextIO:
+    """Opens a text file for reading or writing, with - meaning stdin or stdout."""
+    if path == "-":
+        return nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, newline="")
+
+def run_batch(args: argparse.Namespace):
+    fmt = args.format or ("csv" if args.orders.lower().endswith(".csv") else "jsonl")
+    with open_text(args.orders, "r") as orders, open_text(args.output, "w") as results:
+        counts = batch.run_batch(orders, results, fmt, chunk_size=args.chunk_size)
+    print(", ".join(f"{status}: {count}" for status, count in counts.items()), file=sys.stderr)
+
+def run_backtest(args: argparse.Namespace):
+    from utils.backtest import run_backtest
+    from utils.currency import BASE_CURRENCY
+    from utils.rate_sources import read_snapshots
+
+    initial = None
+    if args.initial is not None and (initial := BASE_CURRENCY.parse_quantity(args.initial.strip())) is None:
+        print(f"Invalid initial balance: {args.initial}", file=sys.stderr)
+        sys.exit(1)
+    if not os.path.isfile(args.tape):
+        print(f"No such rates file: {args.tape}", file=sys.stderr)
+        sys.exit(1)
+    fmt = args.format or ("csv" if args.orders.lower().endswith(".csv") else "jsonl")
+    equity = open_text(args.equity, "w") if args.equity else nullcontext()
+    try:
+        with open_text(args.orders, "r") as orders, open_text(args.output, "w") as results, equity as equity_file:
+            summary = run_backtest(read_snapshots(args.tape), orders, results, fmt, equity=equity_file,
+                                   initial=initial, chunk_size=args.chunk_size)
+    except (KeyError, ValueError) as e:
+        print(f"Backtest failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+def run_provision(args: argparse.Namespace):
+    from utils.provision import run_provision
+
+    fmt = args.format or ("csv" if args.accounts.lower().endswith(".csv") else "jsonl")
+    with open_text(args.accounts, "r") as accounts:
+        counts = run_provision(accounts, fmt, args.chunk_size, args.rounds)
+    print(", ".join(f"{status}: {count}" for status, count in counts.items()), file=sys.stderr)
+
+def run_export(args: argparse.Namespace):
+    extension = os.path.splitext(args.output)[1].lstrip(".").lower()
+    fmt = args.format or (extension if extension in export.FORMATS else "csv")
+    if fmt in export.BINARY_FORMATS:
+        output = nullcontext(sys.stdout.buffer) if args.output == "-" else open(args.output, "wb")
+    else:
+        output = open_text(args.output, "w")
+    try:
+        with output as file:
+            rows = export.export_table(args.table, file, fmt, args.users or None, args.chunk_size)
+    except ImportError:
+        print(f"The {fmt} format needs pyarrow: pip install pyarrow", file=sys.stderr)
+        sys.exit(1)
+    print(f"Exported {rows} {args.table} rows as {fmt}", file=sys.stderr)
+
+def run_value(args: argparse.Namespace):
+    from utils.fx import rate_cache
+    from utils.valuation import value_portfolios
+
+    snapshot = rate_cache.snapshot()
+    valuation = value_portfolios(snapshot.rates, args.users or None)
+    with open_text(args.output, "w") as output:
+        writer = csv.writer(output)
+        writer.writerow(["user_id", "value"])
+        for uid, value in valuation.items():
+            writer.writerow([uid, value.quantity_str])
+    total = valuation.total()
+    print(f"Valued {len(valuation)} portfolios at rates snapshot {snapshot.timestamp}: "
+          f"total {total.name} {total.quantity_str}", file=sys.stderr)
+
+def run_match(args: argparse.Namespace):
+    from datetime import timedelta
+    import threading
+    from utils.fx import rate_cache
+    from utils.matcher import OrderMatcher
+
+    matcher = OrderMatcher(rate_cache, timedelta(seconds=args.poll) if args.poll else rate_cache.ttl)
+    matcher.start()
+    print(f"Matching {len(matcher.book)} resting orders. Ctrl-C to stop.", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        matcher.stop()
+
+def start_menu_matcher():
+    """Fills resting orders from the menu process at the rates it fetches, without polling."""
+    from utils.fx import rate_cache
+    from utils.db import DatabaseError
+    from utils.matcher import OrderMatcher
+
+    try:
+        OrderMatcher(rate_cache).start()
+    except DatabaseError:
+        logger.warning("Couldn't load resting orders, they won't fill from this session.", exc_info=True)
+
+def run_serve(args: argparse.Namespace):
+    import asyncio
+    from utils.server import TradingServer
+
+    server = TradingServer(args.workers)
+    try:
+        asyncio.run(server.serve_unix(args.unix) if args.unix else server.serve_tcp(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+def run_loadgen(args: argparse.Namespace):
+    import asyncio
+    from utils.loadgen import run_load
+
+    print(json.dumps(asyncio.run(run_load(args.clients, args.trades, args.host, args.port, args.unix)), indent=2))
 
 def main():
+    # Here rather than at import, so processes that import this module, like the
+    # password_hasher's workers re-importing it as __mp_main__, don't add handlers again
+    setup_logging()
+    args = parse_args()
+    if args.command == "loadgen":
+        run_loadgen(args)
+        return
+    if args.command == "backtest":
+        # Replays a tape in memory, so needs neither the database nor a rate source
+        run_backtest(args)
+        return
+    if args.command in ("export", "provision"):
+        # Only read and write the database, so work without a rate source configured
+        setup_database()
+        if args.command == "export":
+            run_export(args)
+        else:
+            run_provision(args)
+        return
     setup()
+    if args.command == "batch":
+        run_batch(args)
+        return
+    if args.command == "value":
+        run_value(args)
+        return
+    if args.command == "serve":
+        run_serve(args)
+        return
+    if args.command == "match":
+        run_match(args)
+        return
+    start_menu_matcher()
     print("Welcome to fx-trader!")
     menu.main_menu()
 
@@ -0,0 +1,288 @@
+from itertools import islice
+from logging import getLogger
+from typing import Iterable, TextIO
+import numpy as np
+
+from utils.batch import Order, OrderError, ResultWriter, read_orders
+from utils.currency import CCY, BASE_CURRENCY, FX_CURRENCIES, FX_CURRENCY_NAMES, format_minor, parse_minor
+from utils.rate_snapshot import RateSnapshot
+from utils.rate_sources import Snapshot
+
+logger = getLogger(__name__)
+
+# Decimal places of tape rates, which are valued as integers of 10^-RATE_DPS
+RATE_DPS = 10
+
+INT64_MAX = np.iinfo(np.int64).max
+
+class ScheduledOrder(Order):
+    """Represents one order of a backtest script: a batch order with the Unix time it is
+    placed at, in its "timestamp" field.
+
+    Args:
+        line (int): Line or row number of the order in its input, for reporting.
+        fields (dict): The order's timestamp, side, ccy and quantity as read.
+    """
+    def __init__(self, line: int, fields: dict, error: str = None):
+        super().__init__(line, fields, error)
+        try:
+            self.at: int = int(str(fields.get("timestamp") or "").strip())
+        except ValueError:
+            self.at = None
+
+
+class Backtest:
+    """Replays a script of orders over a tape of rate snapshots, against a portfolio held in
+    memory rather than the database.
+
+    Each order executes at the first snapshot at or after its timestamp, priced by
+    Order.price() as the batch command would, so quantities follow the rounding of
+    Currency.to_fx() and Currency.to_base(). Rates must be plain decimals of at most RATE_DPS
+    decimal places. Rates missing from a snapshot carry forward from the last snapshot
+    that had them.
+
+    After every snapshot the portfolio is valued in minor units of the base currency, each
+    FX balance converted and rounded down as Currency.to_base() does. The tape is read
+    chunk_size snapshots at a time and each chunk is valued with NumPy, one slice per run of
+    snapshots between trades, so memory use is bounded by the chunk size rather than the tape.
+
+    Args:
+        initial (int): Starting balance of the base currency, in minor units.
+        chunk_size (int): Snapshots read and valued at a time.
+    """
+    def __init__(self, initial: int, chunk_size: int = 100_000):
+        self.initial = initial
+        self.chunk_size = chunk_size
+        self.balances: dict[CCY, int] = {ccy: 0 for ccy in CCY}
+        self.balances[BASE_CURRENCY] = initial
+        self.counts = {"filled": 0, "rejected": 0}
+        self.ticks = 0
+        self.first_timestamp: int = None
+        self.last_timestamp: int = None
+        self.value = initial
+        self.peak = initial
+        self.max_drawdown = 0.0
+
+        # Last known rate of each FX currency, "" before its first
+        self._last = [""] * len(FX_CURRENCIES)
+
+    def run(self, tape: Iterable[Snapshot], orders: Iterable[ScheduledOrder], writer: ResultWriter,
+            equity: TextIO = None) -> dict:
+        """Replays the orders over the tape, writing each order's result as it executes.
+
+        Results are written in the order the orders execute: orders without a valid timestamp
+        first, then by timestamp, with orders at the same timestamp in script order.
+
+        Args:
+            tape (Iterable[Snapshot]): Snapshots as (timestamp, rates), in time order.
+            orders (Iterable[ScheduledOrder]): The order script.
+            writer (ResultWriter): Where results with fields RESULT_FIELDS are written.
+            equity (TextIO, optional): Where to write a CSV of timestamp and portfolio value
+                after each snapshot.
+
+        Returns:
+            The summary of the run.
+
+        Raises:
+            ValueError: If the tape is empty, out of time order or has an invalid rate.
+        """
+        pending: list[ScheduledOrder] = []
+        for order in orders:
+            if order.error:
+                self._reject(writer, order, order.error)
+            elif order.at is None:
+                self._reject(writer, order, "invalid timestamp")
+            else:
+                pending.append(order)
+        # Stable, so orders at the same timestamp stay in script order, then reversed so the
+        # next order due pops off the end
+        pending.sort(key=lambda order: order.at)
+        pending.reverse()
+
+        if equity is not None:
+            equity.write("timestamp,value\n")
+        tape = iter(tape)
+        while chunk := list(islice(tape, self.chunk_size)):
+            timestamps, values = self._replay(chunk, pending, writer)
+            self._track(values)
+            if equity is not None:
+                dps = BASE_CURRENCY.dps
+                equity.write("".join(f"{timestamp},{format_minor(value, dps)}\n"
+                                     for timestamp, value in zip(timestamps.tolist(), values.tolist())))
+        if not self.ticks:
+            raise ValueError("Rate tape has no snapshots")
+
+        while pending:
+            self._reject(writer, pending.pop(), "after last tick")
+        return self.summary()
+
+    def _reject(self, writer: ResultWriter, order: Order, reason: str, timestamp: int = None):
+        self.counts["rejected"] += 1
+        writer.write(order.result("rejected", reason, timestamp))
+
+    def _replay(self, chunk: list[Snapshot], pending: list, writer: ResultWriter) -> tuple[np.ndarray, np.ndarray]:
+        """Executes the orders due in a chunk of snapshots, returning the chunk's timestamps
+        and the portfolio value after each snapshot."""
+        n = len(chunk)
+        width = len(FX_CURRENCIES)
+        timestamps = [0] * n
+        # Row 0 carries the previous chunk's last rates, forward filled over missing ("") rates
+        rows = [self._last]
+        for i, (timestamp, snapshot_rates) in enumerate(chunk):
+            timestamps[i] = timestamp
+            rows.append([snapshot_rates.get(name, "") for name in FX_CURRENCY_NAMES])
+
+        timestamps = np.array(timestamps, dtype=np.int64)
+        if (np.diff(timestamps) < 0).any() or (self.last_timestamp is not None and self.last_timestamp > timestamps[0]):
+            raise ValueError("Rate tape snapshots are out of time order")
+        strings = np.array(rows, dtype=str)
+        fixed = _parse_rates(strings, np.r_[0, timestamps])
+
+        indices = np.arange(n + 1)
+        for j in range(width):
+            filled = np.maximum.accumulate(np.where(strings[:, j] != "", indices, 0))
+            strings[:, j] = strings[filled, j]
+            fixed[:, j] = fixed[filled, j]
+        self._last = strings[-1].tolist()
+        strings, fixed = strings[1:], fixed[1:]
+
+        # Snapshot index each run of constant balances starts at, with those balances
+        segments = [(0, dict(self.balances))]
+        while pending and pending[-1].at <= timestamps[-1]:
+            i = int(np.searchsorted(timestamps, pending[-1].at))
+            rates = {name: rate for name, rate in zip(FX_CURRENCY_NAMES, strings[i].tolist()) if rate}
+            snapshot = RateSnapshot(int(timestamps[i]), rates)
+            while pending and pending[-1].at <= snapshot.timestamp:
+                self._execute(pending.pop(), snapshot, writer)
+            segments.append((i, dict(self.balances)))
+
+        if self.first_timestamp is None:
+            self.first_timestamp = int(timestamps[0])
+        self.last_timestamp = int(timestamps[-1])
+        self.ticks += n
+
+        values = np.empty(n, dtype=np.int64)
+        for (start, balances), (end, _) in zip(segments, [*segments[1:], (n, None)]):
+            if start < end:
+                values[start:end] = _value(balances, fixed[start:end])
+        return timestamps, values
+
+    def _execute(self, order: ScheduledOrder, snapshot: RateSnapshot, writer: ResultWriter):
+        try:
+            order.price(snapshot)
+        except OrderError as e:
+            self._reject(writer, order, str(e), snapshot.timestamp)
+            return
+        sold, bought = order.sold, order.bought
+        if self.balances[sold.ccy] < sold.minor:
+            self._reject(writer, order, "insufficient funds", snapshot.timestamp)
+            return
+        self.balances[sold.ccy] -= sold.minor
+        self.balances[bought.ccy] += bought.minor
+        self.counts["filled"] += 1
+        writer.write(order.result("filled", "", snapshot.timestamp))
+
+    def _track(self, values: np.ndarray):
+        """Updates the last value, the peak and the largest drawdown from it."""
+        peaks = np.maximum.accumulate(np.r_[self.peak, values])[1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            drawdowns = np.where(peaks > 0, (peaks - values) / peaks, 0.0)
+        self.max_drawdown = max(self.max_drawdown, float(drawdowns.max()))
+        self.peak = int(peaks[-1])
+        self.value = int(values[-1])
+
+    def summary(self) -> dict:
+        """Returns the counts, timestamps, final balances and performance of the run so far,
+        with amounts as decimal strings."""
+        dps = BASE_CURRENCY.dps
+        pnl = self.value - self.initial
+        return {
+            "ticks": self.ticks,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+            "orders": dict(self.counts),
+            "balances": {ccy.name: format_minor(minor, ccy.dps) for ccy, minor in self.balances.items() if minor},
+            "start_value": format_minor(self.initial, dps),
+            "end_value": format_minor(self.value, dps),
+            "pnl": format_minor(pnl, dps),
+            "return": round(pnl / self.initial, 6) if self.initial else None,
+            "max_drawdown": round(self.max_drawdown, 6),
+        }
+
+
+def _parse_rates(strings: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+    """Parses rate strings into integers of 10^-RATE_DPS, as parse_minor() would, with empty
+    strings (missing rates) as 0.
+
+    Plain decimals of up to RATE_DPS places are parsed with NumPy string operations. Any other
+    strings, e.g. with trailing zeros beyond RATE_DPS places, are left to parse_minor().
+
+    Raises:
+        ValueError: If a rate isn't a positive decimal of at most RATE_DPS decimal places.
+    """
+    present = strings != ""
+    whole, _, fraction = np.strings.partition(strings, ".")
+    fraction_length = np.strings.str_len(fraction)
+    simple = (np.strings.isdigit(whole) & (np.strings.str_len(whole) <= 18 - RATE_DPS)
+              & ((fraction_length == 0) | np.strings.isdigit(fraction)) & (fraction_length <= RATE_DPS))
+    digits = np.where(simple, np.strings.add(whole, np.strings.ljust(fraction, RATE_DPS, "0")), "0")
+    fixed = digits.astype(np.int64)
+
+    for i, j in zip(*np.nonzero((present & ~simple) | (simple & (fixed == 0)))):
+        rate = str(strings[i, j])
+        if not (scaled := parse_minor(rate, RATE_DPS)) or scaled > INT64_MAX:
+            raise ValueError(f"Invalid {FX_CURRENCIES[j].name} rate at {timestamps[i]}: {rate}")
+        fixed[i, j] = scaled
+    return fixed
+
+
+def _value(balances: dict[CCY, int], fixed: np.ndarray) -> np.ndarray:
+    """Values balances at each row of fixed point rates (FX per base, in units of
+    10^-RATE_DPS) in minor units of the base currency, rounding each FX balance down.
+
+    quantity / rate in base minor units is minor * 10^(base_dps + RATE_DPS - dps) // fixed,
+    which is evaluated in int64 where it can't overflow and with Python ints otherwise.
+    """
+    values = np.full(len(fixed), balances[BASE_CURRENCY], dtype=np.int64)
+    for j, ccy in enumerate(FX_CURRENCIES):
+        if not (minor := balances[ccy]):
+            continue
+        numerator = minor * 10 ** (BASE_CURRENCY.dps + RATE_DPS - ccy.dps)
+        if numerator <= INT64_MAX:
+            values += numerator // fixed[:, j]
+        else:
+            logger.debug("Valuing large %s balance without int64: %s", ccy.name, minor)
+            values += np.array([numerator // rate for rate in fixed[:, j].tolist()], dtype=np.int64)
+    return values
+
+
+def run_backtest(tape: Iterable[Snapshot], orders: TextIO, results: TextIO, fmt: str = "jsonl",
+                 result_fmt: str = None, equity: TextIO = None, initial: int = None,
+                 chunk_size: int = 100_000) -> dict:
+    """Replays an order script over a rate tape without touching the database, see Backtest.
+
+    Args:
+        tape (Iterable[Snapshot]): Snapshots as (timestamp, rates), in time order, e.g. from
+            read_snapshots().
+        orders (TextIO): Orders with fields timestamp, side, ccy and quantity.
+        results (TextIO): Where results with fields RESULT_FIELDS are written.
+        fmt (str): Format of orders, one of batch.FORMATS.
+        result_fmt (str, optional): Format of results. Defaults to fmt.
+        equity (TextIO, optional): Where to write a CSV of the portfolio value after each snapshot.
+        initial (int, optional): Starting balance of the base currency in minor units.
+            Defaults to a new user's.
+        chunk_size (int): Snapshots read and valued at a time.
+
+    Returns:
+        The summary of the run, see Backtest.summary().
+
+    Raises:
+        ValueError: If the tape is empty, out of time order or has an invalid rate.
+    """
+    if initial is None:
+        initial = parse_minor(BASE_CURRENCY.initial, BASE_CURRENCY.dps)
+    backtest = Backtest(initial, chunk_size)
+    summary = backtest.run(tape, read_orders(orders, fmt, ScheduledOrder),
+                           ResultWriter(results, result_fmt or fmt), equity)
+    logger.info("Backtest complete: %s", summary)
+    return summary
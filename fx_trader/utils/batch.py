@@ -0,0 +1,209 @@
+import csv
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+import json
+from logging import getLogger
+from typing import Iterator, TextIO
+
+from utils.currency import CCY, BASE_CURRENCY, FX_CURRENCY_NAMES, Currency
+from utils.db import DatabaseError, InsufficientFundsError, get_user_ids, execute_trades
+from utils.fx import rate_cache
+from utils.rate_snapshot import RateSnapshot
+
+logger = getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+
+ORDER_FIELDS = ("user", "side", "ccy", "quantity")
+
+RESULT_FIELDS = ("line", "user", "side", "ccy", "quantity", "status", "reason",
+                 "sold_ccy", "sold_quantity", "bought_ccy", "bought_quantity",
+                 "fx_rate", "rates_timestamp")
+
+class OrderError(Exception):
+    pass
+
+class Order:
+    """Represents one order read from a batch.
+
+    Sides and quantities follow the menu: "buy" spends quantity of the base currency on ccy,
+    "sell" sells quantity of ccy for the base currency.
+
+    Args:
+        line (int): Line or row number of the order in its input, for reporting.
+        fields (dict): The order's user, side, ccy and quantity as read.
+        error (str, optional): Why the order couldn't be read, e.g. invalid JSON. The order
+            is rejected with it without being priced.
+    """
+    def __init__(self, line: int, fields: dict, error: str = None):
+        self.line = line
+        self.error = error
+        self.fields = {field: str(fields.get(field) or "").strip() for field in ORDER_FIELDS}
+        self.uid: int = None
+        self.fx_rate: Decimal = None
+        self.bought: Currency = None
+        self.sold: Currency = None
+
+    @property
+    def username(self) -> str:
+        return self.fields["user"].lower()
+
+    def price(self, snapshot: RateSnapshot):
+        """Validates the order and prices it at a rate snapshot, setting bought and sold.
+
+        Raises:
+            OrderError: If the order is invalid.
+        """
+        side = self.fields["side"].lower()
+        ccy_name = self.fields["ccy"].upper()
+        quantity = self.fields["quantity"]
+        if side not in ("buy", "sell"):
+            raise OrderError("invalid side")
+        if ccy_name not in FX_CURRENCY_NAMES:
+            raise OrderError("invalid currency")
+        ccy = CCY.from_string(ccy_name)
+        if (fx_rate := snapshot.rate(ccy)) is None:
+            raise OrderError("no rate")
+        self.fx_rate = fx_rate
+
+        sold_ccy = BASE_CURRENCY if side == "buy" else ccy
+        try:
+            if (minor := sold_ccy.parse_quantity(quantity)) is None:
+                raise OrderError("invalid quantity")
+            self.sold = Currency.from_minor(sold_ccy, minor)
+            if side == "buy":
+                self.bought = self.sold.to_fx(ccy, self.fx_rate)
+            else:
+                self.bought = self.sold.to_base(self.fx_rate)
+        except (ArithmeticError, ValueError):
+            # Too many digits to parse or convert exactly, e.g. InvalidOperation from quantize
+            self.sold = self.bought = None
+            raise OrderError("invalid quantity")
+
+        if self.bought.quantity <= 0:
+            raise OrderError("quantity too small")
+
+    def result(self, status: str, reason: str = "", rates_timestamp: int = None) -> dict:
+        """Returns the result record of the order, with fields RESULT_FIELDS."""
+        return {
+            "line": self.line,
+            **self.fields,
+            "status": status,
+            "reason": reason,
+            "sold_ccy": self.sold.name if self.sold else "",
+            "sold_quantity": self.sold.quantity_str if self.sold else "",
+            "bought_ccy": self.bought.name if self.bought else "",
+            "bought_quantity": self.bought.quantity_str if self.bought else "",
+            "fx_rate": str(self.fx_rate) if self.fx_rate is not None else "",
+            "rates_timestamp": rates_timestamp if rates_timestamp is not None else "",
+        }
+
+
+def read_orders(file: TextIO, fmt: str, order_type: type[Order] = Order) -> Iterator[Order]:
+    """Streams orders from a CSV file with a header row, or from JSON lines, as order_type
+    built from the line number and fields of each."""
+    if fmt == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield order_type(reader.line_num, row)
+        return
+
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+            if not isinstance(fields, dict):
+                raise ValueError("not an object")
+        except ValueError:
+            logger.info("Invalid JSON order on line %s", line_number)
+            yield order_type(line_number, {}, f"invalid order: line {line_number} is not a JSON object")
+            continue
+        yield order_type(line_number, fields)
+
+
+class ResultWriter:
+    """Writes order results to a file as CSV or JSON lines."""
+    def __init__(self, file: TextIO, fmt: str):
+        self.file = file
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(file, fieldnames=RESULT_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, result: dict):
+        if self._csv:
+            self._csv.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + "\n")
+
+
+def run_batch(orders: TextIO, results: TextIO, fmt: str = "jsonl", result_fmt: str = None,
+              chunk_size: int = 500) -> dict[str, int]:
+    """Executes a stream of orders, writing one result per order.
+
+    Every order is priced against the same rate snapshot, taken when the batch starts.
+    Orders are executed in chunks of chunk_size, each chunk in one database transaction.
+
+    Args:
+        orders (TextIO): Orders with fields ORDER_FIELDS.
+        results (TextIO): Where results with fields RESULT_FIELDS are written.
+        fmt (str): Format of orders, one of FORMATS.
+        result_fmt (str, optional): Format of results. Defaults to fmt.
+        chunk_size (int): Orders executed per transaction.
+
+    Returns:
+        Number of orders by result status.
+    """
+    snapshot = rate_cache.snapshot()
+    quote_time = datetime.now()
+    logger.info("Running batch at rates snapshot %s", snapshot.timestamp)
+
+    writer = ResultWriter(results, result_fmt or fmt)
+    counts = {"filled": 0, "rejected": 0, "failed": 0}
+    stream = read_orders(orders, fmt)
+    while chunk := list(islice(stream, chunk_size)):
+        for order, status, reason in _execute_chunk(chunk, snapshot, quote_time):
+            counts[status] += 1
+            writer.write(order.result(status, reason, snapshot.timestamp))
+
+    logger.info("Batch complete: %s", counts)
+    return counts
+
+def _execute_chunk(chunk: list[Order], snapshot: RateSnapshot,
+                   quote_time: datetime) -> Iterator[tuple[Order, str, str]]:
+    """Prices and executes a chunk of orders, yielding each order with its status and reason."""
+    uids = get_user_ids(order.username for order in chunk)
+    outcomes: dict[int, tuple[str, str]] = {}
+    priced: list[Order] = []
+    for order in chunk:
+        try:
+            if order.error:
+                raise OrderError(order.error)
+            if (uid := uids.get(order.username)) is None:
+                raise OrderError("unknown user")
+            order.uid = uid
+            order.price(snapshot)
+        except OrderError as e:
+            outcomes[id(order)] = ("rejected", str(e))
+            continue
+        priced.append(order)
+
+    try:
+        executed = execute_trades((order.uid, order.bought, order.sold, order.fx_rate, quote_time)
+                                  for order in priced)
+    except DatabaseError:
+        logger.error("Error executing batch chunk.", exc_info=True)
+        executed = [DatabaseError("chunk failed")] * len(priced)
+
+    for order, result in zip(priced, executed):
+        if isinstance(result, InsufficientFundsError):
+            outcomes[id(order)] = ("rejected", "insufficient funds")
+        elif isinstance(result, DatabaseError):
+            outcomes[id(order)] = ("failed", "database error")
+        else:
+            outcomes[id(order)] = ("filled", "")
+
+    for order in chunk:
+        yield (order, *outcomes[id(order)])
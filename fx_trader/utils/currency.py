@@ -1,5 +1,4 @@
 from logging import getLogger
-import re
 from enum import Enum
 from decimal import Decimal, ROUND_DOWN
 
@@ -46,16 +45,61 @@ class CCY(Enum):
                 quantity (str): The quantity traded as a string.
                 ccy (CCY): The currency.
         """
-        # should not match zero quantity
-        if re.search(r"^0+(\.0*)?$", quantity) is not None:
-            return False
-        # 0dp should just be a non-negative integer
-        if self.dps == 0:
-            return re.search(r"^0*[0-9]+(\.0*)?$", quantity) is not None
-        # should match valid non-zero quantity
-        if re.search(f"^\\d+(\\.\\d{{0,{self.dps}}}0*)?$", quantity) is None:
-            return False
-        return True
+        return bool(parse_minor(quantity, self.dps))
+
+    def parse_quantity(self, quantity: str) -> int | None:
+        """Validates and parses a quantity traded in one pass, as valid_quantity().
+
+            Args:
+                quantity (str): The quantity traded as a string.
+
+            Returns:
+                The quantity in integer minor units, or None if it isn't valid.
+        """
+        return parse_minor(quantity, self.dps) or None
+
+
+# Most digits of a quantity in minor units, so Currency.from_minor holds it exactly at the
+# default Decimal precision of 28 digits
+MAX_QUANTITY_DIGITS = 28
+
+def parse_minor(quantity: str, dps: int) -> int | None:
+    """Parses a non-negative decimal string into integer minor units of a currency with dps
+    decimal places, without regular expressions or intermediate Decimals.
+
+    Accepts ASCII digits with an optional decimal point, e.g. "12", "12.", "12.5", "012.500".
+    Digits beyond dps decimal places are only accepted if they are zeros. Quantities of more
+    than MAX_QUANTITY_DIGITS digits in minor units are rejected.
+
+    Args:
+        quantity (str): The quantity as a string.
+        dps (int): Number of decimal places allowed.
+
+    Returns:
+        The quantity in units of 10^-dps, or None if quantity isn't valid.
+    """
+    # Bounds the work on long input before int(), which refuses over 4300 digits
+    if len(quantity) > MAX_QUANTITY_DIGITS + 1:
+        return None
+    whole, _, fraction = quantity.partition(".")
+    if not (whole.isascii() and whole.isdigit()) or len(whole) + dps > MAX_QUANTITY_DIGITS:
+        return None
+    if fraction:
+        if not (fraction.isascii() and fraction.isdigit()):
+            return None
+        if len(fraction) > dps:
+            if fraction[dps:].strip("0"):
+                return None
+            fraction = fraction[:dps]
+    return int(whole + fraction + "0" * (dps - len(fraction)))
+
+def format_minor(minor: int, dps: int) -> str:
+    """Formats a quantity in minor units of a currency with dps decimal places as a decimal
+    string, as Currency.quantity_str does, without an intermediate Decimal."""
+    if dps == 0:
+        return str(minor)
+    whole, fraction = divmod(abs(minor), 10 ** dps)
+    return f"{"-" if minor < 0 else ""}{whole}.{fraction:0{dps}d}"
 
 
 BASE_CURRENCY = CCY.USD
@@ -64,17 +108,42 @@ FX_CURRENCY_NAMES: list[str] = [c.name for c in FX_CURRENCIES]
 
 
 class Currency:
-    """Represents a coupling of a certain quantity of currency.
+    """Represents a coupling of a certain quantity of currency. Immutable and hashable.
+
+    Currencies of the same CCY can be added, subtracted and compared.
 
     Args:
-        ccy (CCY): CCY of Currency. Immutable.
+        ccy (CCY): CCY of Currency.
         quantity (Decimal): Quantity of Currency. Should already be quantized to CCY's decimal places.
     """
+    __slots__ = ("_ccy", "_name", "_quantity")
+
     def __init__(self, ccy: CCY, quantity: Decimal):
-        self._ccy: CCY = ccy
-        self._name: str = ccy.name
-        self._quantity: Decimal = None
-        self.quantity: Decimal = quantity
+        # Precision of quantity must match exactly precision of CCY
+        if -quantity.as_tuple().exponent != ccy.dps:
+            raise ValueError(f"Quantity ({quantity}) doesn't match decimal places of currency ({ccy.dps})")
+        _set_ccy(self, ccy)
+        _set_name(self, ccy.name)
+        _set_quantity(self, quantity)
+
+    @classmethod
+    def _trusted(cls, ccy: CCY, quantity: Decimal):
+        """Returns Currency without validating quantity.
+        Only for quantities already quantized to ccy.q, e.g. the result of quantize(ccy.q)."""
+        currency = object.__new__(cls)
+        _set_ccy(currency, ccy)
+        _set_name(currency, ccy.name)
+        _set_quantity(currency, quantity)
+        return currency
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Currency is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Currency is immutable")
+
+    def __reduce__(self):
+        return Currency, (self._ccy, self._quantity)
 
     @property
     def ccy(self):
@@ -88,17 +157,15 @@ class Currency:
     def quantity(self):
         return self._quantity
 
-    @quantity.setter
-    def quantity(self, value: Decimal):
-        # Precision of quantity must match exactly precision of CCY
-        if -value.as_tuple().exponent != self.ccy.dps:
-            raise ValueError(f"Quantity ({value}) doesn't match decimal places of currency ({self.ccy.dps})")
-        self._quantity = value
-
     @property
     def quantity_str(self) -> str:
         """Returns quantity as string."""
-        return str(self.quantity)
+        return str(self._quantity)
+
+    @property
+    def minor(self) -> int:
+        """Returns quantity as an integer number of minor units, e.g. cents for USD."""
+        return int(self._quantity.scaleb(self._ccy.dps))
 
     @classmethod
     def from_string(self, ccy: CCY, quantity_str: str):
@@ -107,7 +174,16 @@ class Currency:
         Args:
             ccy (CCY): CCY of Currency.
             quantity_str (str): Quantity of Currency as string. Must not be more precise than CCY dps."""
-        return Currency(ccy, Decimal(quantity_str).quantize(ccy.q))
+        return Currency._trusted(ccy, Decimal(quantity_str).quantize(ccy.q))
+
+    @classmethod
+    def from_minor(cls, ccy: CCY, minor: int):
+        """Returns Currency given a quantity in integer minor units, e.g. cents for USD.
+
+        Args:
+            ccy (CCY): CCY of Currency.
+            minor (int): Quantity of Currency in units of 10^-dps."""
+        return Currency._trusted(ccy, Decimal(minor).scaleb(-ccy.dps))
 
     def to_base(self, fx_rate: Decimal):
         """Converts FX Currency to Base Currency object with fx_rate.
@@ -118,10 +194,10 @@ class Currency:
         Returns:
             New Currency object in base currency.
         """
-        if self.ccy == BASE_CURRENCY:
+        if self._ccy == BASE_CURRENCY:
             raise NotImplementedError("Unexpected conversion of base to base")
-        new_quantity = (self.quantity / fx_rate).quantize(BASE_CURRENCY.q, ROUND_DOWN)
-        return Currency(BASE_CURRENCY, new_quantity)
+        new_quantity = (self._quantity / fx_rate).quantize(BASE_CURRENCY.q, ROUND_DOWN)
+        return Currency._trusted(BASE_CURRENCY, new_quantity)
 
     def to_fx(self, ccy: CCY, fx_rate: Decimal):
         """Converts Base Currency to FX Currency object with fx_rate.
@@ -132,7 +208,83 @@ class Currency:
         Returns:
             New Currency object in base currency
         """
-        if self.ccy != BASE_CURRENCY:
+        if self._ccy != BASE_CURRENCY:
             raise NotImplementedError("Unexpected conversion of FX to FX")
-        new_quantity = (self.quantity * fx_rate).quantize(ccy.q, ROUND_DOWN)
-        return Currency(ccy, new_quantity)
+        new_quantity = (self._quantity * fx_rate).quantize(ccy.q, ROUND_DOWN)
+        return Currency._trusted(ccy, new_quantity)
+
+    def convert(self, ccy: CCY, fx_rate: Decimal, fx_rate_to: Decimal):
+        """Converts to Currency object of any other ccy through the base currency, rounding once.
+
+        quantity * fx_rate_to / fx_rate is evaluated in full before rounding down to ccy's
+        decimal places, so there is no rounding loss at the base currency.
+
+        Args:
+            ccy (CCY): The currency converted to.
+            fx_rate (Decimal): The FX rate of this currency, in FX per base. 1 for the base currency.
+            fx_rate_to (Decimal): The FX rate of ccy, in FX per base. 1 for the base currency.
+
+        Returns:
+            New Currency object in ccy.
+        """
+        if self._ccy == ccy:
+            raise ValueError("Unexpected conversion of same CCY")
+        new_quantity = (self._quantity * fx_rate_to / fx_rate).quantize(ccy.q, ROUND_DOWN)
+        return Currency._trusted(ccy, new_quantity)
+
+    def _same_ccy(self, other) -> bool:
+        if not isinstance(other, Currency):
+            return False
+        if other._ccy != self._ccy:
+            raise TypeError(f"Can't combine {self._name} with {other._name}")
+        return True
+
+    def __add__(self, other):
+        if not self._same_ccy(other):
+            return NotImplemented
+        return Currency._trusted(self._ccy, self._quantity + other._quantity)
+
+    def __sub__(self, other):
+        if not self._same_ccy(other):
+            return NotImplemented
+        return Currency._trusted(self._ccy, self._quantity - other._quantity)
+
+    def __neg__(self):
+        return Currency._trusted(self._ccy, -self._quantity)
+
+    def __eq__(self, other):
+        if not isinstance(other, Currency):
+            return NotImplemented
+        return self._ccy == other._ccy and self._quantity == other._quantity
+
+    def __hash__(self):
+        return hash((self._ccy, self._quantity))
+
+    def __lt__(self, other):
+        if not self._same_ccy(other):
+            return NotImplemented
+        return self._quantity < other._quantity
+
+    def __le__(self, other):
+        if not self._same_ccy(other):
+            return NotImplemented
+        return self._quantity <= other._quantity
+
+    def __gt__(self, other):
+        if not self._same_ccy(other):
+            return NotImplemented
+        return self._quantity > other._quantity
+
+    def __ge__(self, other):
+        if not self._same_ccy(other):
+            return NotImplemented
+        return self._quantity >= other._quantity
+
+    def __repr__(self):
+        return f"Currency({self._name}, {self._quantity})"
+
+
+# Slot setters, which bypass Currency.__setattr__ so only Currency itself can set its fields
+_set_ccy = Currency._ccy.__set__
+_set_name = Currency._name.__set__
+_set_quantity = Currency._quantity.__set__
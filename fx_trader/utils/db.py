@@ -1,173 +1,1133 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
 from logging import getLogger
+import queue
 import sqlite3
-import pandas as pd
+import threading
+import time
+import json
+from itertools import islice
+from typing import Iterable, Iterator
 
-from utils.security import verify_password
+from utils.security import needs_rehash, password_hasher
 from utils.currency import Currency, CCY
-from utils.user import user
+from utils.ledger import LedgerEntry
+from utils.metrics import db_read_seconds, db_write_seconds
+from utils.orders import RestingOrder
+from utils.portfolio import Portfolio
+from utils.rate_sources import Snapshot
+from utils.user import User, current_user
 
 DB_NAME = "fx_trader.db"
 
+# Applied to every new connection. WAL lets readers run alongside the single writer and
+# synchronous=NORMAL is durable in WAL mode across application crashes.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 67108864",
+)
+
+# Number of prepared statements each connection keeps for reuse
+CACHED_STATEMENTS = 128
+
 logger = getLogger(__name__)
 
 class DatabaseError(Exception):
     pass
 
+class InsufficientFundsError(DatabaseError):
+    pass
+
+class UserExistsError(DatabaseError):
+    pass
+
+class QuoteExpiredError(DatabaseError):
+    pass
+
+class ConnectionPool:
+    """Hands out one long-lived connection per thread.
+
+    Connections are opened lazily on first use in a thread, tuned with PRAGMAS and kept open,
+    so repeated queries reuse both the connection and its prepared statement cache.
+    Connections are in autocommit mode; use transaction() to group statements.
+
+    Connections of threads that have exited are closed when the next connection is opened.
+    Short-lived threads can close theirs straight away with release().
+
+    Args:
+        db_name (str): Path of the SQLite database file.
+    """
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Each open connection with the thread it belongs to
+        self._connections: dict[sqlite3.Connection, threading.Thread] = {}
+
+    def get(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection, opening it if needed."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    def _connect(self) -> sqlite3.Connection:
+        # Each connection is only used by the thread that opened it; check_same_thread is
+        # disabled so that close() can be called from any thread.
+        connection = sqlite3.connect(self.db_name,
+                                     isolation_level=None,
+                                     check_same_thread=False,
+                                     cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        with self._lock:
+            dead = [other for other, thread in self._connections.items() if not thread.is_alive()]
+            for dead_connection in dead:
+                del self._connections[dead_connection]
+            self._connections[connection] = threading.current_thread()
+        for dead_connection in dead:
+            dead_connection.close()
+        if dead:
+            logger.debug("Closed %s database connections of exited threads", len(dead))
+        logger.debug("Opened database connection: %s", self.db_name)
+        return connection
+
+    def release(self):
+        """Closes the calling thread's connection, if it has one. The thread gets a new
+        connection if it uses the pool again."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        self._local.connection = None
+        with self._lock:
+            self._connections.pop(connection, None)
+        connection.close()
+
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """Runs the enclosed statements in one transaction on the thread's connection.
+        Commits on success and rolls back on any exception.
+
+        Args:
+            immediate (bool): Take the write lock at the start (BEGIN IMMEDIATE) rather than
+                on the first write, so read-then-write sequences can't interleave with other writers.
+        """
+        connection = self.get()
+        connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def configure(self, db_name: str):
+        """Closes all connections and points the pool at another database file."""
+        self.close()
+        self.db_name = db_name
+
+    def close(self):
+        """Closes every connection opened by the pool."""
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+# Singleton
+connections = ConnectionPool(DB_NAME)
+
 def initialise_db() -> bool:
+    """Creates the database if it doesn't exist and migrates it to the latest schema version."""
     try:
         # Connects to database (creates it if it doesn't exist)
-        connection = sqlite3.connect(DB_NAME)
-
-        cursor = connection.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            hash TEXT NOT NULL
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS portfolio (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            currency TEXT NOT NULL,
-            quantity TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        connection.commit()
-    except sqlite3.DatabaseError as e:
+        migrate(connections.get())
+    except (sqlite3.DatabaseError, ValueError) as e:
         logger.info("Database error when initialising database: %s", e)
         return False
-    finally:
-        if connection:
-            connection.close()
 
     return True
 
+def migrate(connection: sqlite3.Connection, target: int = None):
+    """Applies the MIGRATIONS a database hasn't had yet, each in its own transaction.
+    The schema version is kept in the database's user_version.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database, in autocommit mode.
+        target (int, optional): Version to migrate up to. Defaults to the latest.
+    """
+    target = len(MIGRATIONS) if target is None else target
+    while True:
+        # The version is read under the write lock so concurrent processes can't both migrate
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version >= target:
+                connection.execute("COMMIT")
+                return
+            migration = MIGRATIONS[version]
+            logger.info("Migrating database to version %s: %s", version + 1, migration.__doc__)
+            migration(connection)
+            connection.execute(f"PRAGMA user_version = {version + 1}")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+def _create_tables(connection: sqlite3.Connection):
+    """Create users and portfolio tables"""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        hash TEXT NOT NULL
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        currency TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+
+def _quantity_to_minor(connection: sqlite3.Connection):
+    """Store portfolio quantities as INTEGER minor units instead of TEXT"""
+    columns = {row[1]: row[2] for row in connection.execute("PRAGMA table_info(portfolio)")}
+    if columns["quantity"].upper() != "TEXT":
+        return
+
+    rows = []
+    for row_id, user_id, currency, quantity_str in connection.execute(
+            "SELECT id, user_id, currency, quantity FROM portfolio"):
+        if (ccy := CCY.from_string(currency)) is None:
+            raise ValueError(f"Unknown currency in portfolio: {currency}")
+        rows.append((row_id, user_id, currency, Currency.from_string(ccy, quantity_str).minor))
+
+    connection.execute("DROP TABLE portfolio")
+    connection.execute('''
+        CREATE TABLE portfolio (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        currency TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    connection.executemany("INSERT INTO portfolio (id, user_id, currency, quantity) VALUES (?, ?, ?, ?)", rows)
+
+def _portfolio_primary_key(connection: sqlite3.Connection):
+    """Key portfolio on (user_id, currency) in a WITHOUT ROWID table"""
+    connection.execute('''
+        CREATE TABLE portfolio_keyed (
+        user_id INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (user_id, currency),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+    ''')
+    connection.execute("""INSERT INTO portfolio_keyed (user_id, currency, quantity)
+        SELECT user_id, currency, quantity FROM portfolio""")
+    connection.execute("DROP TABLE portfolio")
+    connection.execute("ALTER TABLE portfolio_keyed RENAME TO portfolio")
+
+def _create_trades(connection: sqlite3.Connection):
+    """Create the append-only trades ledger"""
+    connection.execute('''
+        CREATE TABLE trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        bought_currency TEXT NOT NULL,
+        bought_quantity INTEGER NOT NULL,
+        sold_currency TEXT NOT NULL,
+        sold_quantity INTEGER NOT NULL,
+        fx_rate TEXT,
+        quote_time TEXT,
+        executed_at TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    # Serves paginated history per user newest first
+    connection.execute("CREATE INDEX trades_user_id ON trades (user_id, id)")
+    for action in ("UPDATE", "DELETE"):
+        connection.execute(f'''
+            CREATE TRIGGER trades_no_{action.lower()} BEFORE {action} ON trades
+            BEGIN SELECT RAISE(ABORT, 'trades is append-only'); END
+        ''')
+
+def _create_rate_history(connection: sqlite3.Connection):
+    """Create the rate history table"""
+    # Keyed by currency first so one currency's history is contiguous for as-of lookups and
+    # range scans, with an index on timestamp for whole snapshots
+    connection.execute('''
+        CREATE TABLE rates (
+        currency TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        rate TEXT NOT NULL,
+        PRIMARY KEY (currency, timestamp)
+        ) WITHOUT ROWID
+    ''')
+    connection.execute("CREATE INDEX rates_timestamp ON rates (timestamp)")
+
+def _create_orders(connection: sqlite3.Connection):
+    """Create the resting orders table"""
+    connection.execute('''
+        CREATE TABLE orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        sold_currency TEXT NOT NULL,
+        sold_quantity INTEGER NOT NULL,
+        bought_currency TEXT NOT NULL,
+        trigger_rate TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        trade_id INTEGER,
+        created_at TEXT NOT NULL,
+        closed_at TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (trade_id) REFERENCES trades(id)
+        )
+    ''')
+    # Serves each user's orders, and loading the open orders into the book at startup and
+    # as they are placed, without scanning the closed ones
+    connection.execute("CREATE INDEX orders_user_id ON orders (user_id, id)")
+    connection.execute("CREATE INDEX orders_open ON orders (id) WHERE status = 'open'")
+
+def _create_holds(connection: sqlite3.Connection):
+    """Create the table of funds held for open quotes"""
+    connection.execute('''
+        CREATE TABLE holds (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    # No index on expires_at: the table only has the holds of open quotes, so the sweep
+    # scans a few rows while every hold and confirm writes one page less
+
+# Schema migrations in order. MIGRATIONS[n] takes a database from version n to n + 1.
+# Only ever append to this list.
+MIGRATIONS = [
+    _create_tables,
+    _quantity_to_minor,
+    _portfolio_primary_key,
+    _create_trades,
+    _create_rate_history,
+    _create_orders,
+    _create_holds,
+]
+
+# (currency, quantity in minor units) each new user starts with
+INITIAL_BALANCES = [(ccy.name, Currency.from_string(ccy, ccy.initial).minor) for ccy in CCY]
+
+_PROVISION_PORTFOLIOS = f"""INSERT OR IGNORE INTO portfolio (user_id, currency, quantity)
+    SELECT u.id, b.column1, b.column2
+    FROM users u CROSS JOIN (VALUES {", ".join(f"('{currency}', {minor})" for currency, minor in INITIAL_BALANCES)}) b
+    WHERE u.username IN (SELECT value FROM json_each(?))"""
+
+@db_read_seconds.timed
 def get_user_id(username: str) -> int:
     try:
-        with sqlite3.connect(DB_NAME) as connection:
-            cursor = connection.cursor()
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username, ))
-            result = cursor.fetchone()
+        cursor = connections.get().execute("SELECT id FROM users WHERE username = ?", (username, ))
+        result = cursor.fetchone()
     except sqlite3.DatabaseError as e:
         logger.info("Database error when searching user id: %s", username)
         raise e
-    finally:
-        if connection:
-            connection.close()
     if result is None:
         logger.info("No such username: %s", username)
         return None
 
     return int(result[0])
 
+@db_read_seconds.timed
+def get_user_ids(usernames: Iterable[str]) -> dict[str, int]:
+    """Returns the user id of each of the usernames that exists, in one query."""
+    usernames = list(set(usernames))
+    if not usernames:
+        return {}
+    try:
+        # One JSON parameter rather than one per name, which SQLite limits
+        cursor = connections.get().execute(
+            "SELECT username, id FROM users WHERE username IN (SELECT value FROM json_each(?))",
+            (json.dumps(usernames), ))
+        return dict(cursor.fetchall())
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when searching user ids: %s", e)
+        raise DatabaseError("Error getting user ids.") from e
+
+@db_read_seconds.timed
 def user_exists(username: str) -> bool:
     try:
-        with sqlite3.connect(DB_NAME) as connection:
-            cursor = connection.cursor()
-            cursor.execute("SELECT 1 FROM users WHERE username = ?", (username, ))
-            result = cursor.fetchone()
+        cursor = connections.get().execute("SELECT 1 FROM users WHERE username = ?", (username, ))
+        result = cursor.fetchone()
     except sqlite3.DatabaseError as e:
         logger.info("Database error when creating new user: %s", e)
         raise DatabaseError("Error checking if user exists.") from e
-    finally:
-        if connection:
-            connection.close()
 
     return result is not None
 
+@db_write_seconds.timed
 def create_user(username: str, hashed_password: str):
-    """Attempts to create new user"""
-    try:
-        if user_exists(username):
-            logger.info("Username already exists: %s", username)
-    except Exception as e:
-        raise DatabaseError("Error creating new user. User already exists.") from e
+    """Creates a user with the initial balance of every currency.
 
+    Raises:
+        UserExistsError: If the username is taken.
+        DatabaseError: If the user couldn't be created.
+    """
     try:
-        with sqlite3.connect(DB_NAME) as connection:
-            cursor = connection.cursor()
-            cursor.execute("INSERT INTO users (username, hash) VALUES (?, ?)",
-                           (username, hashed_password))
+        with connections.transaction() as connection:
+            cursor = connection.execute("INSERT INTO users (username, hash) VALUES (?, ?)",
+                                        (username, hashed_password))
             user_id = cursor.lastrowid
-            for currency in CCY:
-                cursor.execute("INSERT INTO portfolio (user_id, currency, quantity) VALUES (?, ?, ?)", (user_id, currency.name, currency.initial))
-            connection.commit()
+            connection.executemany("INSERT INTO portfolio (user_id, currency, quantity) VALUES (?, ?, ?)",
+                                   [(user_id, currency, minor) for currency, minor in INITIAL_BALANCES])
+    except sqlite3.IntegrityError as e:
+        # The UNIQUE username constraint, rather than a separate check that could race
+        logger.info("Username already exists: %s", username)
+        raise UserExistsError("Error creating new user. User already exists.") from e
     except sqlite3.DatabaseError as e:
         logger.info("Database error when creating new user portfolio: %s", e)
         raise DatabaseError("Error creating new user or checking password.") from e
-    finally:
-        if connection:
-            connection.close()
+
+@db_write_seconds.timed
+def provision_users(users: Iterable[tuple[str, bytes]], chunk_size: int = 10_000) -> tuple[int, int]:
+    """Creates many users with the initial balance of every currency.
+
+    Users are inserted chunk_size at a time, each chunk in one transaction with one
+    executemany for users and one statement for all their balances. Usernames that are
+    taken, in the database or earlier in users, are skipped.
+
+    Args:
+        users (Iterable[tuple[str, bytes]]): Username and hashed password of each user.
+        chunk_size (int): Users inserted per transaction.
+
+    Returns:
+        Number of users created and number skipped as existing.
+
+    Raises:
+        DatabaseError: If a chunk couldn't be inserted. Earlier chunks stay committed.
+    """
+    created = existing = 0
+    users = iter(users)
+    while chunk := list(islice(users, chunk_size)):
+        try:
+            with connections.transaction(immediate=True) as connection:
+                before = connection.total_changes
+                connection.executemany("INSERT OR IGNORE INTO users (username, hash) VALUES (?, ?)", chunk)
+                inserted = connection.total_changes - before
+                # Users that already existed keep their balances
+                connection.execute(_PROVISION_PORTFOLIOS,
+                                   (json.dumps([username for username, _ in chunk]), ))
+        except sqlite3.DatabaseError as e:
+            logger.info("Database error when provisioning users: %s", e)
+            raise DatabaseError("Error provisioning users.") from e
+        created += inserted
+        existing += len(chunk) - inserted
+        logger.debug("Provisioned %s users, %s existing", created, existing)
+    return created, existing
 
 def check_password(username: str, password: str) -> bool:
+    """Returns whether password is the user's. Hashes of an outdated work factor are replaced
+    with one of the current factor on success.
+
+    Raises:
+        DatabaseError: If the hash couldn't be read.
+        PasswordHasherBusyError: If too many passwords are being checked at once.
+    """
     try:
-        with sqlite3.connect(DB_NAME) as connection:
-            cursor = connection.cursor()
-            cursor.execute("SELECT hash FROM users WHERE username = ?", (username, ))
-            result = cursor.fetchone()
-            if result is None:
-                return False
-            actual_hashed_password = result[0]
+        cursor = connections.get().execute("SELECT hash FROM users WHERE username = ?", (username, ))
+        result = cursor.fetchone()
     except sqlite3.DatabaseError as e:
         logger.info("Database error when checking password: %s", e)
         raise DatabaseError("Error creating new user or checking password.") from e
-    finally:
-        if connection:
-            connection.close()
-    return verify_password(password, actual_hashed_password)
+    if result is None:
+        return False
+    actual_hashed_password = result[0]
+    if not password_hasher.verify(password, actual_hashed_password):
+        return False
+    if needs_rehash(actual_hashed_password):
+        _rehash_password(username, password, actual_hashed_password)
+    return True
+
+def _rehash_password(username: str, password: str, old_hashed_password: bytes):
+    """Replaces a user's hash, unless it changed since old_hashed_password was read."""
+    try:
+        connections.get().execute("UPDATE users SET hash = ? WHERE username = ? AND hash = ?",
+                                  (password_hasher.hash(password), username, old_hashed_password))
+        logger.info("Rehashed password of %s", username)
+    except Exception:
+        # The old hash still works, so the next login tries again
+        logger.info("Error rehashing password of %s", username, exc_info=True)
 
-def get_portfolio(username: str) -> pd.DataFrame:
-    logger.debug("Getting portfolio: user_id %s", user.uid)
+@db_read_seconds.timed
+def get_portfolio(username: str) -> Portfolio:
+    logger.debug("Getting portfolio: %s", username)
     try:
-        with sqlite3.connect(DB_NAME) as connection:
-            query = """SELECT p.currency, p.quantity
-                FROM users u JOIN portfolio p ON u.id = p.user_id
-                WHERE u.username = ?"""
-            df = pd.read_sql_query(query, connection, params=(username,))
-            return df
+        cursor = connections.get().execute("""SELECT p.currency, p.quantity
+            FROM users u JOIN portfolio p ON u.id = p.user_id
+            WHERE u.username = ?""", (username, ))
+        return Portfolio(Currency.from_minor(CCY[currency], minor) for currency, minor in cursor.fetchall())
     except Exception as e:
         logger.info("Database error when getting portfolio: %s", e)
         raise DatabaseError("Error getting portfolio.") from e
-    finally:
-        if connection:
-            connection.close()
 
-def get_currency_owned(ccy: CCY) -> Currency:
-    logger.debug("Getting currency: user_id %s: %s", user.uid, ccy.name)
+def iter_balances(user_ids: Iterable[int] = None, chunk_size: int = 100_000) -> Iterator[list[tuple[int, int, int]]]:
+    """Streams portfolio balances ordered by user id, in chunks of rows.
+
+    Args:
+        user_ids (Iterable[int], optional): Only include these users. Defaults to all users.
+        chunk_size (int): Most rows per chunk.
+
+    Yields:
+        Lists of (user_id, CCY value, quantity in minor units) rows.
+    """
+    # Currency names are mapped to CCY values in SQL so every column is an integer
+    ccy_value = f"CASE currency {" ".join(f"WHEN '{c.name}' THEN {c.value}" for c in CCY)} END"
+    query = f"SELECT user_id, {ccy_value}, quantity FROM portfolio"
+    params = ()
+    if user_ids is not None:
+        query += " WHERE user_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(list(user_ids)), )
+    try:
+        cursor = connections.get().execute(query + " ORDER BY user_id", params)
+        while rows := cursor.fetchmany(chunk_size):
+            yield rows
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when reading balances: %s", e)
+        raise DatabaseError("Error reading balances.") from e
+
+def iter_trades(user_ids: Iterable[int] = None, chunk_size: int = 100_000) -> Iterator[list[tuple]]:
+    """Streams the trades ledger oldest first, in chunks of rows.
+
+    Args:
+        user_ids (Iterable[int], optional): Only include these users' trades. Defaults to all users.
+        chunk_size (int): Most rows per chunk.
+
+    Yields:
+        Lists of (id, user_id, bought_currency, bought_quantity, sold_currency, sold_quantity,
+        fx_rate, quote_time, executed_at) rows, with quantities in minor units.
+    """
+    query = """SELECT id, user_id, bought_currency, bought_quantity, sold_currency, sold_quantity,
+        fx_rate, quote_time, executed_at FROM trades"""
+    params = ()
+    if user_ids is not None:
+        query += " WHERE user_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(list(user_ids)), )
     try:
-        with sqlite3.connect(DB_NAME) as connection:
-            cursor = connection.cursor()
-            cursor.execute("""SELECT quantity FROM portfolio
-                WHERE user_id = ? AND currency = ?""", (user.uid, ccy.name))
-            result = cursor.fetchone()
-            quantity_str = result[0]
-            return Currency.from_string(ccy, quantity_str)
+        cursor = connections.get().execute(query + " ORDER BY id", params)
+        while rows := cursor.fetchmany(chunk_size):
+            yield rows
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when reading trades: %s", e)
+        raise DatabaseError("Error reading trades.") from e
+
+@db_read_seconds.timed
+def get_currency_owned(ccy: CCY, session: User = None) -> Currency:
+    """Returns the quantity of ccy owned by a user.
+
+    Args:
+        ccy (CCY): Currency to get.
+        session (User, optional): User to get it for. Defaults to the current user.
+    """
+    session = session or current_user()
+    logger.debug("Getting currency: user_id %s: %s", session.uid, ccy.name)
+    try:
+        cursor = connections.get().execute("""SELECT quantity FROM portfolio
+            WHERE user_id = ? AND currency = ?""", (session.uid, ccy.name))
+        result = cursor.fetchone()
+        return Currency.from_minor(ccy, result[0])
     except Exception as e:
         logger.info("Database error when getting quantity %s owned by user %s: %s",
-                    ccy.name, user.username, e)
+                    ccy.name, session.username, e)
         raise DatabaseError("Error getting quantity owned.") from e
-    finally:
-        if connection:
-            connection.close()
 
-def update_currencies(currency1: CCY, quantity1: str, currency2: CCY, quantity2: str) -> bool:
+@db_write_seconds.timed
+def update_currencies(currency1: CCY, quantity1: str, currency2: CCY, quantity2: str,
+                      session: User = None) -> bool:
+    """Sets two of a user's balances. session defaults to the current user."""
+    session = session or current_user()
     logger.debug("Setting currencies: user_id %s: %s %s, %s %s",
-                user.uid, currency1.name, quantity1, currency2.name, quantity2)
-    try:
-        with sqlite3.connect(DB_NAME) as connection:
-            cursor = connection.cursor()
-            cursor.execute("UPDATE portfolio SET quantity = ? WHERE user_id = ? and currency = ?",
-                           (quantity1, user.uid, currency1.name))
-            cursor.execute("UPDATE portfolio SET quantity = ? WHERE user_id = ? and currency = ?",
-                           (quantity2, user.uid, currency2.name))
-            connection.commit()
+                session.uid, currency1.name, quantity1, currency2.name, quantity2)
+    try:
+        with connections.transaction() as connection:
+            connection.execute("UPDATE portfolio SET quantity = ? WHERE user_id = ? and currency = ?",
+                               (Currency.from_string(currency1, quantity1).minor, session.uid, currency1.name))
+            connection.execute("UPDATE portfolio SET quantity = ? WHERE user_id = ? and currency = ?",
+                               (Currency.from_string(currency2, quantity2).minor, session.uid, currency2.name))
             return True
     except Exception:
         logger.error("Database error when getting updating transaction...TODO", exc_info=True)
         return False
-    finally:
-        if connection:
-            connection.close()
+
+@db_write_seconds.timed
+def execute_trade(uid: int, bought: Currency, sold: Currency,
+                  fx_rate: Decimal = None, quote_time: datetime = None) -> tuple[Currency, Currency]:
+    """Credits bought and debits sold for a user and records the trade in the ledger,
+    in one transaction.
+
+    Both balances are updated relative to their current value, and the debit only applies if
+    the balance covers it, so concurrent trades on the same account can't overdraw it.
+
+    Args:
+        uid (int): User id of the account traded.
+        bought (Currency): Currency credited.
+        sold (Currency): Currency debited.
+        fx_rate (Decimal, optional): FX rate the trade was priced at, for the ledger.
+        quote_time (datetime, optional): Time the FX rate was quoted, for the ledger.
+
+    Returns:
+        The new balances of the bought and sold currencies.
+
+    Raises:
+        InsufficientFundsError: If the balance of the sold currency is less than sold.
+        DatabaseError: If the trade couldn't be written. Nothing is written.
+    """
+    logger.debug("Executing trade: user_id %s: +%s %s, -%s %s",
+                 uid, bought.name, bought.quantity_str, sold.name, sold.quantity_str)
+    try:
+        with connections.transaction(immediate=True) as connection:
+            new_s = _debit(connection, uid, sold)
+            new_b = _credit(connection, uid, bought)
+            connection.execute(INSERT_TRADE, _ledger_row(uid, bought, sold, fx_rate, quote_time))
+    except InsufficientFundsError:
+        logger.info("Insufficient funds for trade: user_id %s: %s %s", uid, sold.name, sold.quantity_str)
+        raise
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when executing trade for user_id %s: %s", uid, e)
+        raise DatabaseError("Error executing trade.") from e
+
+    return new_b, new_s
+
+@db_write_seconds.timed
+def execute_trades(trades: Iterable[tuple[int, Currency, Currency, Decimal, datetime]]
+                   ) -> list[tuple[Currency, Currency] | DatabaseError]:
+    """Executes many trades in one transaction, each applied or rejected on its own.
+
+    Each trade runs in a savepoint, so a rejected trade leaves no partial write while the
+    others still commit together. Ledger rows of the applied trades are inserted in one
+    batch at the end of the same transaction.
+
+    Args:
+        trades (Iterable[tuple[int, Currency, Currency, Decimal, datetime]]): User id, bought,
+            sold, FX rate and quote time of each trade, as the arguments of execute_trade().
+
+    Returns:
+        For each trade in order, the new balances of the bought and sold currencies, or the
+        InsufficientFundsError or DatabaseError that rejected it.
+
+    Raises:
+        DatabaseError: If the transaction as a whole couldn't be written. Nothing is written.
+    """
+    results = []
+    ledger_rows = []
+    try:
+        with connections.transaction(immediate=True) as connection:
+            for uid, bought, sold, fx_rate, quote_time in trades:
+                connection.execute("SAVEPOINT trade")
+                try:
+                    new_s = _debit(connection, uid, sold)
+                    new_b = _credit(connection, uid, bought)
+                except (InsufficientFundsError, sqlite3.DatabaseError) as e:
+                    connection.execute("ROLLBACK TO trade")
+                    results.append(e if isinstance(e, InsufficientFundsError) else DatabaseError(str(e)))
+                else:
+                    results.append((new_b, new_s))
+                    ledger_rows.append(_ledger_row(uid, bought, sold, fx_rate, quote_time))
+                connection.execute("RELEASE trade")
+            connection.executemany(INSERT_TRADE, ledger_rows)
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when executing %s trades: %s", len(results), e)
+        raise DatabaseError("Error executing trades.") from e
+
+    return results
+
+@db_write_seconds.timed
+def hold_funds(uid: int, sold: Currency, expires_at: float) -> tuple[int, Currency]:
+    """Takes sold out of a user's balance and holds it for a quote until expires_at.
+
+    Args:
+        uid (int): User id of the account quoted.
+        sold (Currency): Currency to hold.
+        expires_at (float): Unix time the hold expires at, after which the quote can't be
+            confirmed and release_expired_holds() returns sold to the balance.
+
+    Returns:
+        The id of the hold and the balance of the sold currency left.
+
+    Raises:
+        InsufficientFundsError: If the balance of the sold currency is less than sold.
+        DatabaseError: If the hold couldn't be written. Nothing is written.
+    """
+    try:
+        with connections.transaction(immediate=True) as connection:
+            balance = _debit(connection, uid, sold)
+            hold_id = connection.execute("INSERT INTO holds (user_id, currency, quantity, expires_at) VALUES (?, ?, ?, ?)",
+                                         (uid, sold.name, sold.minor, expires_at)).lastrowid
+    except InsufficientFundsError:
+        logger.info("Insufficient funds to hold: user_id %s: %s %s", uid, sold.name, sold.quantity_str)
+        raise
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when holding funds for user_id %s: %s", uid, e)
+        raise DatabaseError("Error holding funds.") from e
+    return hold_id, balance
+
+@db_write_seconds.timed
+def confirm_hold(hold_id: int, uid: int, bought: Currency, sold: Currency,
+                 fx_rate: Decimal = None, quote_time: datetime = None) -> Currency:
+    """Executes a quoted trade from its held funds, without reading the sold balance again.
+
+    The hold is claimed with one conditional delete, which fails once it has expired or been
+    released, then bought is credited and the trade recorded in the ledger.
+
+    Args:
+        hold_id (int): Id of the hold from hold_funds().
+        uid (int): User id of the account traded.
+        bought (Currency): Currency credited.
+        sold (Currency): Currency held, for the ledger.
+        fx_rate (Decimal, optional): FX rate the trade was priced at, for the ledger.
+        quote_time (datetime, optional): Time the FX rate was quoted, for the ledger.
+
+    Returns:
+        The new balance of the bought currency.
+
+    Raises:
+        QuoteExpiredError: If the hold has expired or been released. Nothing is written.
+        DatabaseError: If the trade couldn't be written. Nothing is written.
+    """
+    try:
+        with connections.transaction(immediate=True) as connection:
+            if connection.execute("DELETE FROM holds WHERE id = ? AND user_id = ? AND expires_at > ?",
+                                  (hold_id, uid, time.time())).rowcount == 0:
+                raise QuoteExpiredError("Quote expired.")
+            new_b = _credit(connection, uid, bought)
+            connection.execute(INSERT_TRADE, _ledger_row(uid, bought, sold, fx_rate, quote_time))
+    except QuoteExpiredError:
+        logger.info("Quote expired: user_id %s: hold %s", uid, hold_id)
+        raise
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when confirming hold %s for user_id %s: %s", hold_id, uid, e)
+        raise DatabaseError("Error executing trade.") from e
+    return new_b
+
+@db_write_seconds.timed
+def release_hold(hold_id: int, uid: int) -> bool:
+    """Returns held funds to a user's balance.
+
+    Returns:
+        Whether the hold was released. False if it was already confirmed or released.
+
+    Raises:
+        DatabaseError: If the hold couldn't be released.
+    """
+    try:
+        with connections.transaction(immediate=True) as connection:
+            if (held := connection.execute("DELETE FROM holds WHERE id = ? AND user_id = ? RETURNING currency, quantity",
+                                           (hold_id, uid)).fetchone()) is None:
+                return False
+            _credit(connection, uid, Currency.from_minor(CCY[held[0]], held[1]))
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when releasing hold %s for user_id %s: %s", hold_id, uid, e)
+        raise DatabaseError("Error releasing hold.") from e
+    return True
+
+@db_write_seconds.timed
+def release_expired_holds(now: float = None) -> int:
+    """Returns the funds of every hold expired by now to their balances.
+
+    Args:
+        now (float, optional): Unix time. Defaults to the current time.
+
+    Returns:
+        Number of holds released.
+    """
+    now = time.time() if now is None else now
+    try:
+        with connections.transaction(immediate=True) as connection:
+            connection.execute("""UPDATE portfolio SET quantity = portfolio.quantity + expired.quantity
+                FROM (SELECT user_id, currency, SUM(quantity) AS quantity FROM holds
+                      WHERE expires_at <= ? GROUP BY user_id, currency) AS expired
+                WHERE portfolio.user_id = expired.user_id AND portfolio.currency = expired.currency""", (now, ))
+            return connection.execute("DELETE FROM holds WHERE expires_at <= ?", (now, )).rowcount
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when releasing expired holds: %s", e)
+        raise DatabaseError("Error releasing expired holds.") from e
+
+INSERT_TRADE = """INSERT INTO trades (user_id, bought_currency, bought_quantity, sold_currency, sold_quantity,
+    fx_rate, quote_time, executed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+def _ledger_row(uid: int, bought: Currency, sold: Currency, fx_rate: Decimal, quote_time: datetime) -> tuple:
+    return (uid, bought.name, bought.minor, sold.name, sold.minor,
+            None if fx_rate is None else str(fx_rate),
+            None if quote_time is None else quote_time.isoformat(),
+            datetime.now().isoformat())
+
+def _debit(connection: sqlite3.Connection, uid: int, currency: Currency) -> Currency:
+    """Subtracts currency from a user's balance if it is covered, returning the new balance."""
+    result = connection.execute("""UPDATE portfolio SET quantity = quantity - ?
+        WHERE user_id = ? AND currency = ? AND quantity >= ?
+        RETURNING quantity""", (currency.minor, uid, currency.name, currency.minor)).fetchone()
+    if result is None:
+        raise InsufficientFundsError(f"Insufficient {currency.name} to sell {currency.quantity_str}.")
+    return Currency.from_minor(currency.ccy, result[0])
+
+def _credit(connection: sqlite3.Connection, uid: int, currency: Currency) -> Currency:
+    """Adds currency to a user's balance, returning the new balance."""
+    result = connection.execute("""UPDATE portfolio SET quantity = quantity + ?
+        WHERE user_id = ? AND currency = ?
+        RETURNING quantity""", (currency.minor, uid, currency.name)).fetchone()
+    if result is None:
+        raise sqlite3.DatabaseError(f"No {currency.name} balance for user_id {uid}")
+    return Currency.from_minor(currency.ccy, result[0])
+
+@db_read_seconds.timed
+def get_trade_history(uid: int, limit: int = 20, before_id: int = None) -> list[LedgerEntry]:
+    """Returns a page of a user's trades, newest first.
+
+    Args:
+        uid (int): User id.
+        limit (int): Most trades returned.
+        before_id (int, optional): Only return trades older than this trade id. Pass the
+            trade_id of the last entry of a page to get the next page.
+    """
+    if before_id is None:
+        before_id = 2**63 - 1 # Largest possible trade id
+    try:
+        cursor = connections.get().execute("""SELECT id, bought_currency, bought_quantity, sold_currency,
+                sold_quantity, fx_rate, quote_time, executed_at
+            FROM trades WHERE user_id = ? AND id < ?
+            ORDER BY id DESC LIMIT ?""", (uid, before_id, limit))
+        rows = cursor.fetchall()
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when getting trade history for user_id %s: %s", uid, e)
+        raise DatabaseError("Error getting trade history.") from e
+
+    return [LedgerEntry(trade_id,
+                        Currency.from_minor(CCY[bought_ccy], bought_minor),
+                        Currency.from_minor(CCY[sold_ccy], sold_minor),
+                        None if fx_rate is None else Decimal(fx_rate),
+                        None if quote_time is None else datetime.fromisoformat(quote_time),
+                        datetime.fromisoformat(executed_at))
+            for trade_id, bought_ccy, bought_minor, sold_ccy, sold_minor, fx_rate, quote_time, executed_at in rows]
+
+@db_write_seconds.timed
+def record_rates(snapshots: Iterable[Snapshot]) -> int:
+    """Appends rate snapshots to the rate history, ignoring any already recorded.
+
+    Returns:
+        Number of rates recorded.
+    """
+    try:
+        with connections.transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO rates (currency, timestamp, rate) VALUES (?, ?, ?)",
+                                   ((currency, timestamp, str(rate))
+                                    for timestamp, rates in snapshots for currency, rate in rates.items()))
+            return connection.total_changes - before
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when recording rates: %s", e)
+        raise DatabaseError("Error recording rates.") from e
+
+@db_read_seconds.timed
+def get_rates_as_of(timestamp: int = None) -> Snapshot:
+    """Returns the latest recorded snapshot at or before timestamp, or None if there's none.
+
+    Args:
+        timestamp (int, optional): Unix seconds. Defaults to the latest snapshot recorded.
+    """
+    if timestamp is None:
+        timestamp = 2**63 - 1 # Largest possible timestamp
+    try:
+        connection = connections.get()
+        # Both queries are index seeks on rates_timestamp
+        (snapshot_timestamp, ) = connection.execute(
+            "SELECT MAX(timestamp) FROM rates WHERE timestamp <= ?", (timestamp, )).fetchone()
+        if snapshot_timestamp is None:
+            return None
+        rows = connection.execute("SELECT currency, rate FROM rates WHERE timestamp = ?",
+                                  (snapshot_timestamp, )).fetchall()
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when getting rates as of %s: %s", timestamp, e)
+        raise DatabaseError("Error getting rates.") from e
+    return snapshot_timestamp, dict(rows)
+
+@db_read_seconds.timed
+def get_rate_as_of(ccy: CCY, timestamp: int) -> tuple[int, Decimal]:
+    """Returns the timestamp and rate of ccy's latest recorded rate at or before timestamp,
+    or None if there's none."""
+    try:
+        result = connections.get().execute("""SELECT timestamp, rate FROM rates
+            WHERE currency = ? AND timestamp <= ?
+            ORDER BY timestamp DESC LIMIT 1""", (ccy.name, timestamp)).fetchone()
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when getting %s rate as of %s: %s", ccy.name, timestamp, e)
+        raise DatabaseError("Error getting rate.") from e
+    if result is None:
+        return None
+    return result[0], Decimal(result[1])
+
+@db_read_seconds.timed
+def get_rate_history(ccy: CCY, start: int, end: int) -> list[tuple[int, Decimal]]:
+    """Returns the (timestamp, rate) of every recorded rate of ccy from start to end inclusive,
+    oldest first."""
+    try:
+        rows = connections.get().execute("""SELECT timestamp, rate FROM rates
+            WHERE currency = ? AND timestamp BETWEEN ? AND ?
+            ORDER BY timestamp""", (ccy.name, start, end)).fetchall()
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when getting %s rate history: %s", ccy.name, e)
+        raise DatabaseError("Error getting rate history.") from e
+    return [(timestamp, Decimal(rate)) for timestamp, rate in rows]
+
+@db_write_seconds.timed
+def place_order(uid: int, kind: str, sold: Currency, bought_ccy: CCY, trigger: Decimal) -> RestingOrder:
+    """Records a new open limit or stop order, as described by RestingOrder.
+
+    Funds aren't set aside: an order that can't be covered when it triggers is rejected.
+
+    Returns:
+        The order placed.
+
+    Raises:
+        DatabaseError: If the order couldn't be written.
+    """
+    created_at = datetime.now()
+    try:
+        cursor = connections.get().execute("""INSERT INTO orders (user_id, kind, sold_currency, sold_quantity,
+                bought_currency, trigger_rate, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (uid, kind, sold.name, sold.minor, bought_ccy.name, str(trigger), created_at.isoformat()))
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when placing order for user_id %s: %s", uid, e)
+        raise DatabaseError("Error placing order.") from e
+    return RestingOrder(cursor.lastrowid, uid, kind, sold, bought_ccy, trigger, created_at)
+
+@db_write_seconds.timed
+def cancel_order(uid: int, order_id: int) -> bool:
+    """Cancels one of a user's open orders.
+
+    Returns:
+        Whether the order was cancelled. False if it isn't the user's or is no longer open.
+
+    Raises:
+        DatabaseError: If the order couldn't be cancelled.
+    """
+    try:
+        cursor = connections.get().execute("""UPDATE orders SET status = 'cancelled', closed_at = ?
+            WHERE id = ? AND user_id = ? AND status = 'open'""", (datetime.now().isoformat(), order_id, uid))
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when cancelling order %s: %s", order_id, e)
+        raise DatabaseError("Error cancelling order.") from e
+    return cursor.rowcount == 1
+
+_SELECT_ORDERS = """SELECT id, user_id, kind, sold_currency, sold_quantity, bought_currency, trigger_rate, created_at
+    FROM orders"""
+
+def _resting_order(row: tuple) -> RestingOrder:
+    order_id, uid, kind, sold_ccy, sold_minor, bought_ccy, trigger, created_at = row
+    return RestingOrder(order_id, uid, kind, Currency.from_minor(CCY[sold_ccy], sold_minor), CCY[bought_ccy],
+                        Decimal(trigger), datetime.fromisoformat(created_at))
+
+@db_read_seconds.timed
+def get_open_orders(uid: int) -> list[RestingOrder]:
+    """Returns a user's open orders, oldest first."""
+    try:
+        rows = connections.get().execute(f"""{_SELECT_ORDERS}
+            WHERE user_id = ? AND status = 'open' ORDER BY id""", (uid, )).fetchall()
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when getting orders for user_id %s: %s", uid, e)
+        raise DatabaseError("Error getting orders.") from e
+    return [_resting_order(row) for row in rows]
+
+@db_read_seconds.timed
+def load_open_orders(after_id: int = 0) -> list[RestingOrder]:
+    """Returns every user's open orders with an id greater than after_id, oldest first."""
+    try:
+        rows = connections.get().execute(f"""{_SELECT_ORDERS}
+            WHERE status = 'open' AND id > ? ORDER BY id""", (after_id, )).fetchall()
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when loading open orders: %s", e)
+        raise DatabaseError("Error loading orders.") from e
+    return [_resting_order(row) for row in rows]
+
+@db_write_seconds.timed
+def fill_orders(fills: Iterable[tuple[RestingOrder, Currency, Decimal, datetime]]
+                ) -> list[tuple[Currency, Currency] | DatabaseError | None]:
+    """Executes triggered orders in one transaction, each filled or rejected on its own.
+
+    Each order is claimed by moving it from open to filled, so an order cancelled meanwhile,
+    or filled by another process, is skipped. An order that can't be covered is rejected.
+    Each runs in a savepoint, as in execute_trades().
+
+    Args:
+        fills (Iterable[tuple[RestingOrder, Currency, Decimal, datetime]]): Each order, the
+            currency it buys, and the FX rate and quote time it fills at.
+
+    Returns:
+        For each order in order, the new balances of the bought and sold currencies, the
+        InsufficientFundsError or DatabaseError that rejected it, or None if it was skipped.
+
+    Raises:
+        DatabaseError: If the transaction as a whole couldn't be written. Nothing is written.
+    """
+    results = []
+    closed_at = datetime.now().isoformat()
+    try:
+        with connections.transaction(immediate=True) as connection:
+            for order, bought, fx_rate, quote_time in fills:
+                connection.execute("SAVEPOINT fill")
+                claimed = connection.execute("""UPDATE orders SET status = 'filled', closed_at = ?
+                    WHERE id = ? AND status = 'open'""", (closed_at, order.order_id)).rowcount
+                if not claimed:
+                    results.append(None)
+                    connection.execute("RELEASE fill")
+                    continue
+                try:
+                    if bought.minor <= 0:
+                        raise DatabaseError(f"Quantity too small to buy {bought.name}.")
+                    new_s = _debit(connection, order.uid, order.sold)
+                    new_b = _credit(connection, order.uid, bought)
+                    trade_id = connection.execute(
+                        INSERT_TRADE, _ledger_row(order.uid, bought, order.sold, fx_rate, quote_time)).lastrowid
+                    connection.execute("UPDATE orders SET trade_id = ? WHERE id = ?", (trade_id, order.order_id))
+                except (DatabaseError, sqlite3.DatabaseError) as e:
+                    connection.execute("ROLLBACK TO fill")
+                    connection.execute("""UPDATE orders SET status = 'rejected', closed_at = ?
+                        WHERE id = ?""", (closed_at, order.order_id))
+                    results.append(e if isinstance(e, DatabaseError) else DatabaseError(str(e)))
+                else:
+                    results.append((new_b, new_s))
+                connection.execute("RELEASE fill")
+    except sqlite3.DatabaseError as e:
+        logger.info("Database error when filling %s orders: %s", len(results), e)
+        raise DatabaseError("Error filling orders.") from e
+
+    return results
+
+
+class HoldSweeper:
+    """Releases expired holds from a daemon thread every interval seconds.
+
+    Args:
+        interval (float): Seconds between sweeps.
+    """
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        """Starts sweeping if it hasn't started yet."""
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="hold-sweeper", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if released := release_expired_holds():
+                    logger.info("Released %s expired holds.", released)
+            except DatabaseError:
+                logger.warning("Error sweeping expired holds.", exc_info=True)
+
+
+class GroupCommitter:
+    """Executes trades submitted from many threads together, several per transaction.
+
+    Trades queue up while the previous group commits, then all of them are written with
+    execute_trades() in a single transaction, sharing one commit. An error writing a group
+    is raised to each of its callers, and the committer carries on with the next group.
+
+    Args:
+        max_group (int): Most trades written per transaction.
+    """
+    def __init__(self, max_group: int = 256):
+        self.max_group = max_group
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread = None
+
+    def execute(self, uid: int, bought: Currency, sold: Currency,
+                fx_rate: Decimal = None, quote_time: datetime = None) -> tuple[Currency, Currency]:
+        """Executes a trade as execute_trade() does, blocking until its group has committed.
+
+        Raises:
+            InsufficientFundsError: If the balance of the sold currency is less than sold.
+            DatabaseError: If the trade's group couldn't be written.
+            Exception: Any other error writing the trade's group.
+        """
+        self._start()
+        future = Future()
+        self._queue.put(((uid, bought, sold, fx_rate, quote_time), future))
+        result = future.result()
+        if isinstance(result, DatabaseError):
+            raise result
+        return result
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def close(self):
+        """Stops the committer thread once the trades already submitted are written.
+        A later execute() starts it again."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        try:
+            while (item := self._queue.get()) is not None:
+                group = [item]
+                while len(group) < self.max_group:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        # Stop after this group, as close() waits for the trades before it
+                        self._commit(group)
+                        return
+                    group.append(item)
+                self._commit(group)
+        finally:
+            connections.release()
+
+    def _commit(self, group: list[tuple[tuple, Future]]):
+        try:
+            results = execute_trades(trade for trade, _ in group)
+        except DatabaseError as e:
+            results = [e] * len(group)
+        except Exception as e:
+            logger.error("Error executing a group of %s trades.", len(group), exc_info=True)
+            for _, future in group:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
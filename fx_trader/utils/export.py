@@ -0,0 +1,109 @@
+import csv
+import json
+from logging import getLogger
+from typing import BinaryIO, Iterable, Iterator, TextIO
+
+from utils.currency import CCY, format_minor
+from utils.db import iter_balances, iter_trades
+
+logger = getLogger(__name__)
+
+FORMATS = ("csv", "jsonl", "parquet", "arrow")
+
+# Formats written to a binary rather than a text file. Both need pyarrow.
+BINARY_FORMATS = ("parquet", "arrow")
+
+PORTFOLIO_FIELDS = ("user_id", "currency", "quantity")
+
+TRADE_FIELDS = ("trade_id", "user_id", "bought_currency", "bought_quantity", "sold_currency",
+                "sold_quantity", "fx_rate", "quote_time", "executed_at")
+
+# Integer columns of each table, all others are strings
+_INTEGER_FIELDS = ("trade_id", "user_id")
+
+_CCY_BY_VALUE = {ccy.value: ccy for ccy in CCY}
+_DPS_BY_NAME = {ccy.name: ccy.dps for ccy in CCY}
+
+def _portfolio_chunks(user_ids: Iterable[int], chunk_size: int) -> Iterator[list[tuple]]:
+    for rows in iter_balances(user_ids, chunk_size):
+        yield [(uid, (ccy := _CCY_BY_VALUE[ccy_value]).name, format_minor(minor, ccy.dps))
+               for uid, ccy_value, minor in rows]
+
+def _trade_chunks(user_ids: Iterable[int], chunk_size: int) -> Iterator[list[tuple]]:
+    for rows in iter_trades(user_ids, chunk_size):
+        yield [(trade_id, uid, bought, format_minor(bought_minor, _DPS_BY_NAME[bought]),
+                sold, format_minor(sold_minor, _DPS_BY_NAME[sold]), fx_rate, quote_time, executed_at)
+               for trade_id, uid, bought, bought_minor, sold, sold_minor, fx_rate, quote_time, executed_at in rows]
+
+# Table name -> (fields, chunks of rows of those fields)
+TABLES = {
+    "portfolio": (PORTFOLIO_FIELDS, _portfolio_chunks),
+    "trades": (TRADE_FIELDS, _trade_chunks),
+}
+
+def export_table(table: str, output: TextIO | BinaryIO, fmt: str, user_ids: Iterable[int] = None,
+                 chunk_size: int = 100_000) -> int:
+    """Streams a table to output, chunk_size rows at a time, so memory use is bounded by the
+    chunk size rather than the table size.
+
+    Quantities are written as exact decimal strings in their currency's decimal places.
+
+    Args:
+        table (str): "portfolio" or "trades".
+        output (TextIO | BinaryIO): Where the rows are written. A text file opened with
+            newline="" for csv and jsonl, a binary file for parquet and arrow.
+        fmt (str): One of FORMATS. "arrow" is the Arrow IPC file format.
+        user_ids (Iterable[int], optional): Only export these users' rows. Defaults to all users.
+        chunk_size (int): Rows read and written at a time.
+
+    Returns:
+        Number of rows written.
+
+    Raises:
+        ValueError: If table or fmt is unknown.
+        ImportError: If fmt needs pyarrow and it isn't installed.
+        DatabaseError: If the table couldn't be read.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    fields, chunks = TABLES[table]
+    chunks = chunks(None if user_ids is None else list(user_ids), chunk_size)
+
+    if fmt in BINARY_FORMATS:
+        return _write_arrow(chunks, fields, output, fmt)
+
+    rows_written = 0
+    if fmt == "csv":
+        writer = csv.writer(output)
+        writer.writerow(fields)
+        for rows in chunks:
+            writer.writerows(rows)
+            rows_written += len(rows)
+    else:
+        for rows in chunks:
+            output.write("".join(json.dumps(dict(zip(fields, row))) + "\n" for row in rows))
+            rows_written += len(rows)
+    return rows_written
+
+def _write_arrow(chunks: Iterator[list[tuple]], fields: tuple[str, ...], output: BinaryIO, fmt: str) -> int:
+    """Writes each chunk as one record batch of a Parquet or Arrow IPC file."""
+    import pyarrow as pa
+
+    schema = pa.schema([(field, pa.int64() if field in _INTEGER_FIELDS else pa.string()) for field in fields])
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(output, schema)
+    else:
+        writer = pa.ipc.new_file(output, schema)
+
+    rows_written = 0
+    try:
+        for rows in chunks:
+            columns = [pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+            rows_written += len(rows)
+    finally:
+        writer.close()
+    return rows_written
@@ -1,33 +1,188 @@
+from datetime import timedelta
 from decimal import Decimal
 from logging import getLogger
 import os
-import requests
+import threading
+import time
+from typing import Callable
 
-from utils.currency import CCY, BASE_CURRENCY, FX_CURRENCY_NAMES
+from utils.currency import CCY
+from utils.db import DatabaseError, connections, get_rates_as_of, record_rates
+from utils.metrics import rate_fetch_seconds
+from utils.rate_snapshot import RateSnapshot
+from utils.rate_sources import RateSource, OpenExchangeRatesSource
+from utils.transaction import quote_timeout
 
-RATES_URL = f"""https://openexchangerates.org/api/latest.json?app_id={os.getenv("OER_API_KEY")}&base={BASE_CURRENCY.name}&symbols={",".join(FX_CURRENCY_NAMES)}"""
+# Time a fetched rate snapshot is served from cache. Defaults to the quote timeout, so a quote
+# is never priced off a snapshot older than its own validity window.
+rate_ttl: timedelta = timedelta(seconds=float(os.getenv("FX_RATE_TTL", quote_timeout.total_seconds())))
+
+# Time after rate_ttl a snapshot may still be served while a fresh one is fetched, or when the
+# rate source fails. 0 always waits for the source.
+rate_stale: timedelta = timedelta(seconds=float(os.getenv("FX_RATE_STALE", "0")))
+
+# Set FX_RATE_HISTORY=0 to not record fetched snapshots in the rate history
+RATE_HISTORY = os.getenv("FX_RATE_HISTORY", "1") != "0"
 
 logger = getLogger(__name__)
 
-def get_rates() -> dict[str, str]:
-    response = requests.get(RATES_URL, timeout=10)
-    data = response.json(parse_float=str)
-    if response.status_code != 200:
-        logger.info("Error getting FX rates: %s: %s", response.status_code, response.text)
-        raise ConnectionError("Error getting FX rates")
+class RateCache:
+    """Serves the latest rate snapshot for ttl before fetching a new one.
+
+    Each fetch is parsed once into a RateSnapshot, which every caller then shares.
+    Concurrent callers that find the cache expired share a single upstream fetch:
+    one thread fetches while the rest wait for its result.
+
+    For stale after ttl, callers get the expired snapshot straight away while one background
+    thread fetches a new one, so a slow source doesn't hold them up. If the source fails, the
+    last snapshot is served until it is older than ttl + stale. With history, each new snapshot
+    is recorded in the rate history, which also seeds an empty cache when the source fails.
+    Listeners are called with each new snapshot, e.g. to match resting orders against it.
+
+    Args:
+        source (RateSource): Where snapshots are fetched from.
+        ttl (timedelta): How long a snapshot is served before it is refreshed.
+        stale (timedelta): How long after ttl a snapshot may still be served.
+        history (bool): Record snapshots in, and fall back to, the rate history.
+    """
+    def __init__(self, source: RateSource, ttl: timedelta, stale: timedelta = timedelta(0),
+                 history: bool = False):
+        self.source = source
+        self.ttl = ttl
+        self.stale = stale
+        self.history = history
+        self._lock = threading.Lock()
+        # (snapshot, monotonic expiry), replaced as a whole so readers never see a mix
+        self._entry: tuple[RateSnapshot, float] = None
+        self._refreshing = False
+        self._refreshing_lock = threading.Lock()
+        self._listeners: list[Callable[[RateSnapshot], None]] = []
+
+    def snapshot(self) -> RateSnapshot:
+        """Returns the cached snapshot, refreshing it if expired."""
+        entry = self._entry
+        now = time.monotonic()
+        if entry is None or now >= entry[1]:
+            if entry is not None and now < entry[1] + self.stale.total_seconds():
+                self._refresh_in_background()
+            else:
+                entry = self._refresh()
+        return entry[0]
+
+    def _refresh(self) -> tuple[RateSnapshot, float]:
+        with self._lock:
+            # Another thread may have refreshed while this one waited for the lock
+            entry = self._entry
+            now = time.monotonic()
+            if entry is not None and now < entry[1]:
+                return entry
+
+            try:
+                with rate_fetch_seconds.time():
+                    timestamp, rates = self.source.fetch()
+            except Exception:
+                if (entry := self._fallback(entry, now)) is None:
+                    raise
+                logger.warning("Error fetching FX rates, serving snapshot %s.", entry[0].timestamp, exc_info=True)
+                self._entry = entry
+                return entry
+
+            if entry is not None and entry[0].timestamp == timestamp:
+                # Upstream hasn't published a new snapshot, keep serving the one we have
+                snapshot = entry[0]
+            else:
+                logger.debug("New FX rate snapshot: %s", timestamp)
+                snapshot = RateSnapshot(timestamp, rates)
+                self._record(timestamp, rates)
+                self._notify(snapshot)
+            self._entry = (snapshot, time.monotonic() + self.ttl.total_seconds())
+            return self._entry
+
+    def _fallback(self, entry: tuple[RateSnapshot, float], now: float) -> tuple[RateSnapshot, float]:
+        """Returns the entry to serve when the source fails, or None if there's none fresh enough."""
+        stale = self.stale.total_seconds()
+        if entry is not None:
+            return entry if now < entry[1] + stale else None
+        if not self.history or stale <= 0:
+            return None
+        try:
+            recorded = get_rates_as_of()
+        except DatabaseError:
+            return None
+        if recorded is None:
+            return None
+        # Expires as if it had been fetched when it was published
+        expiry = now + self.ttl.total_seconds() - (time.time() - recorded[0])
+        return (RateSnapshot(*recorded), expiry) if now < expiry + stale else None
+
+    def _record(self, timestamp: int, rates: dict[str, str]):
+        if not self.history:
+            return
+        try:
+            record_rates([(timestamp, rates)])
+        except DatabaseError:
+            # Serving rates matters more than recording them
+            logger.info("Couldn't record FX rate snapshot %s.", timestamp, exc_info=True)
+
+    def add_listener(self, listener: Callable[[RateSnapshot], None]):
+        """Calls listener with each new snapshot fetched. It is called from the fetching thread
+        while other callers wait for the snapshot, so it should only hand the snapshot off."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[RateSnapshot], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, snapshot: RateSnapshot):
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot)
+            except Exception:
+                logger.warning("Error notifying FX rate snapshot %s.", snapshot.timestamp, exc_info=True)
+
+    def _refresh_in_background(self):
+        with self._refreshing_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="rate-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self._refresh()
+        except Exception:
+            logger.info("Error refreshing FX rates in the background.", exc_info=True)
+        finally:
+            # The thread exits now, so it doesn't keep the connection recording the snapshot used
+            connections.release()
+            with self._refreshing_lock:
+                self._refreshing = False
+
+    def clear(self):
+        """Drops the cached snapshot so the next snapshot() fetches."""
+        with self._lock:
+            self._entry = None
+
+    def set_source(self, source: RateSource):
+        """Switches to another rate source, dropping the cached snapshot."""
+        with self._lock:
+            self.source = source
+            self._entry = None
+
+
+# Singleton, pointed at the configured source by set_rate_source()
+rate_cache = RateCache(OpenExchangeRatesSource(os.getenv("OER_API_KEY")), rate_ttl, rate_stale, RATE_HISTORY)
 
-    if "rates" not in data:
-        logger.info("No \"rates\" in API response: %s", response.text)
-        raise ConnectionError("Error getting FX rates")
+def set_rate_source(source: RateSource):
+    """Sets the source all rates are fetched from."""
+    logger.info("Using rate source: %s", type(source).__name__)
+    rate_cache.set_source(source)
 
-    rates = data["rates"]
-    return rates
+def get_snapshot() -> RateSnapshot:
+    """Returns the current rate snapshot."""
+    return rate_cache.snapshot()
 
 def get_rate(ccy: CCY) -> Decimal:
-    rates = get_rates()
-    try:
-        rate = rates[ccy.name]
-    except KeyError:
+    if (rate := get_snapshot().rate(ccy)) is None:
         logger.error("%s not found in returned rates.", ccy.name)
-        return None
-    return Decimal(rate)
+    return rate
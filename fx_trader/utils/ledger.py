@@ -0,0 +1,31 @@
+from datetime import datetime
+from decimal import Decimal
+
+from utils.currency import Currency
+
+class LedgerEntry:
+    """Represents one executed trade recorded in the trades ledger.
+
+    Args:
+        trade_id (int): Ledger id of the trade. Increases with execution order.
+        bought (Currency): Currency credited.
+        sold (Currency): Currency debited.
+        fx_rate (Decimal, optional): FX rate the trade was priced at.
+        quote_time (datetime, optional): Time the FX rate was quoted.
+        executed_at (datetime): Time the trade was executed.
+    """
+    def __init__(self, trade_id: int, bought: Currency, sold: Currency, fx_rate: Decimal,
+                 quote_time: datetime, executed_at: datetime):
+        self.trade_id = trade_id
+        self.bought = bought
+        self.sold = sold
+        self.fx_rate = fx_rate
+        self.quote_time = quote_time
+        self.executed_at = executed_at
+
+    def __str__(self):
+        rate = f" @ {self.fx_rate}" if self.fx_rate is not None else ""
+        return "#{} {} {} {}{} => {} {}".format(
+            self.trade_id, self.executed_at.strftime("%Y-%m-%d %H:%M:%S"),
+            self.sold.name, self.sold.quantity_str, rate,
+            self.bought.name, self.bought.quantity_str)
@@ -0,0 +1,109 @@
+import asyncio
+import json
+from logging import getLogger
+import random
+import statistics
+import time
+
+logger = getLogger(__name__)
+
+class Client:
+    """A trading server client speaking the line-delimited JSON protocol of TradingServer."""
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, host: str = None, port: int = None, unix: str = None):
+        if unix:
+            return cls(*await asyncio.open_unix_connection(unix))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, op: str, **args) -> dict:
+        self._writer.write(json.dumps({"op": op, **args}).encode() + b"\n")
+        await self._writer.drain()
+        return json.loads(await self._reader.readline())
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+async def _login(number: int, password: str, connect: dict) -> Client:
+    """Connects, registers and logs in one trader."""
+    client = await Client.connect(**connect)
+    username = f"loadgen{number}"
+    await client.request("register", username=username, password=password)
+    if not (response := await client.request("login", username=username, password=password))["ok"]:
+        await client.close()
+        raise ConnectionError(f"Login failed for {username}: {response.get("error")}")
+    return client
+
+async def _trade(number: int, client: Client, trades: int, latencies: list[float], outcomes: dict[str, int]):
+    """Quotes and trades small random amounts, recording each round trip's latency."""
+    rng = random.Random(number)
+    try:
+        for _ in range(trades):
+            start = time.perf_counter()
+            side = rng.choice(("buy", "sell"))
+            quantity = "1.00" if side == "buy" else "0.50"
+            quote = await client.request("quote", side=side, ccy=rng.choice(("EUR", "GBP", "CHF")),
+                                         quantity=quantity)
+            if not quote["ok"]:
+                outcomes[quote["error"]] = outcomes.get(quote["error"], 0) + 1
+                continue
+            trade = await client.request("trade", quote_id=quote["quote_id"])
+            latencies.append(time.perf_counter() - start)
+            outcome = "filled" if trade["ok"] else trade["error"]
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    finally:
+        await client.close()
+
+async def run_load(clients: int, trades: int, host: str = "127.0.0.1", port: int = 8765,
+                   unix: str = None, password: str = "loadgen") -> dict:
+    """Runs concurrent traders against a TradingServer and returns throughput and latency stats.
+
+    All traders log in first, then trade at the same time, so login cost doesn't count
+    towards trade throughput.
+
+    Args:
+        clients (int): Concurrent connections, each trading as its own user.
+        trades (int): Quote and trade round trips per client.
+        host (str), port (int): TCP address of the server.
+        unix (str, optional): Unix socket path of the server, used instead of host and port.
+        password (str): Password the loadgen users are registered with.
+    """
+    connect = {"unix": unix} if unix else {"host": host, "port": port}
+    start = time.perf_counter()
+    logins = await asyncio.gather(*(_login(i, password, connect) for i in range(clients)),
+                                  return_exceptions=True)
+    login_seconds = time.perf_counter() - start
+    for result in logins:
+        if isinstance(result, Exception):
+            logger.error("Trader failed to log in: %s", result)
+    traders = [(i, client) for i, client in enumerate(logins) if not isinstance(client, Exception)]
+
+    latencies: list[float] = []
+    outcomes: dict[str, int] = {}
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_trade(i, client, trades, latencies, outcomes) for i, client in traders),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Trader failed: %s", result)
+
+    latencies.sort()
+    return {
+        "clients": clients,
+        "login_seconds": login_seconds,
+        "trade_seconds": elapsed,
+        "trades_per_second": len(latencies) / elapsed if elapsed else 0,
+        "outcomes": outcomes,
+        "latency_ms": {
+            "p50": statistics.median(latencies) * 1000 if latencies else None,
+            "p99": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+            "max": latencies[-1] * 1000 if latencies else None,
+        },
+        "failed_clients": sum(isinstance(result, Exception) for result in (*logins, *results)),
+    }
@@ -1,12 +1,44 @@
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
 
-def setup_logging(level=logging.DEBUG) -> None:
-    """Sets up logging for the application."""
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s | %(levelname)s | %(name)s: %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        handlers=[
-            logging.StreamHandler()  # Output to console
-        ]
-    )
+LOG_FORMAT = '%(asctime)s | %(levelname)s | %(name)s: %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Level of the application's logs, e.g. DEBUG, INFO or WARNING
+LOG_LEVEL = os.getenv("FX_LOG_LEVEL", "WARNING").upper()
+
+_listener: QueueListener = None
+
+def setup_logging(level: str | int = LOG_LEVEL) -> None:
+    """Sets up logging for the application.
+
+    Records are put on a queue by the logging thread and written to the console by a
+    background listener thread, so a slow console never holds up a trade. Records below
+    level are dropped before they are formatted.
+    """
+    global _listener
+    stop_logging()
+
+    console = logging.StreamHandler()  # Output to console
+    console.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging() -> None:
+    """Writes out queued records and stops the listener thread. Call before os._exit, which
+    skips atexit."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
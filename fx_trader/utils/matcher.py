@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+from logging import getLogger
+import queue
+import threading
+
+from utils.currency import Currency
+from utils.db import DatabaseError, fill_orders, load_open_orders
+from utils.fx import RateCache
+from utils.metrics import match_seconds
+from utils.orders import OrderBook, RestingOrder
+from utils.rate_snapshot import RateSnapshot
+
+logger = getLogger(__name__)
+
+class OrderMatcher:
+    """Fills resting limit and stop orders as new rate snapshots arrive.
+
+    Open orders are loaded from the database into an OrderBook on start, and orders placed
+    since, from any process, are picked up before each match pass. Each new snapshot the rate
+    cache fetches is queued by a listener and matched from the matcher's own thread, so
+    fetching rates never waits for orders to fill. Triggered orders are filled together with
+    fill_orders(), which skips any cancelled or filled elsewhere in the meantime.
+
+    Args:
+        cache (RateCache): Cache whose new snapshots are matched.
+        poll (timedelta, optional): How often to ask the cache for a snapshot while no other
+            caller does, so orders keep matching while nobody quotes. None only matches the
+            snapshots other callers fetch.
+    """
+    def __init__(self, cache: RateCache, poll: timedelta = None):
+        self.cache = cache
+        self.poll = poll
+        self.book = OrderBook()
+        self._last_id = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        """Loads the open orders and starts matching new snapshots in a daemon thread.
+
+        Raises:
+            DatabaseError: If the open orders couldn't be loaded.
+        """
+        if self._thread is not None:
+            return
+        self.sync()
+        logger.info("Matching %s resting orders.", len(self.book))
+        self.cache.add_listener(self._queue.put)
+        self._thread = threading.Thread(target=self._run, name="order-matcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops matching once the snapshots already queued are matched."""
+        if self._thread is None:
+            return
+        self.cache.remove_listener(self._queue.put)
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def sync(self) -> int:
+        """Adds the orders placed since the last sync to the book, returning how many.
+
+        Raises:
+            DatabaseError: If the orders couldn't be loaded.
+        """
+        orders = load_open_orders(self._last_id)
+        for order in orders:
+            self.book.add(order)
+        if orders:
+            self._last_id = orders[-1].order_id
+        return len(orders)
+
+    def tick(self, snapshot: RateSnapshot) -> list[tuple[RestingOrder, tuple[Currency, Currency] | DatabaseError | None]]:
+        """Matches a snapshot against the book and fills the orders it triggers.
+
+        Returns:
+            Each triggered order with its result from fill_orders().
+        """
+        try:
+            self.sync()
+        except DatabaseError:
+            logger.warning("Error loading new orders, matching the book as is.", exc_info=True)
+
+        with match_seconds.time():
+            crossed = self.book.match(snapshot)
+        if not crossed:
+            return []
+
+        quote_time = datetime.now()
+        fills = [(order, snapshot.convert(order.sold, order.bought_ccy), rate, quote_time) for order, rate in crossed]
+        try:
+            results = fill_orders(fills)
+        except DatabaseError:
+            # Nothing was written, so the orders rest again until the next snapshot
+            logger.warning("Error filling %s orders at snapshot %s.", len(fills), snapshot.timestamp, exc_info=True)
+            for order, _ in crossed:
+                self.book.add(order)
+            return []
+
+        for (order, rate), result in zip(crossed, results):
+            if isinstance(result, DatabaseError):
+                logger.info("Rejected order #%s at %s: %s", order.order_id, rate, result)
+            elif result is not None:
+                logger.info("Filled order #%s at %s", order.order_id, rate)
+        return [(order, result) for (order, _), result in zip(crossed, results)]
+
+    def _run(self):
+        timeout = None if self.poll is None else self.poll.total_seconds()
+        while True:
+            try:
+                snapshot = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                try:
+                    # A new snapshot reaches the queue through the listener
+                    self.cache.snapshot()
+                except Exception:
+                    logger.info("Error polling FX rates for orders.", exc_info=True)
+                continue
+            if snapshot is None:
+                return
+            try:
+                self.tick(snapshot)
+            except Exception:
+                logger.error("Error matching orders at snapshot %s.", snapshot.timestamp, exc_info=True)
@@ -6,8 +6,9 @@ from typing import Callable, Iterable
 from utils.currency import *
 from utils.db import *
 from utils.fx import *
-from utils.security import hash_password
-from utils.transaction import Transaction, QUOTE_TIMEOUT_SECONDS
+from utils.orders import InvalidOrderError, parse_order
+from utils.security import password_hasher
+from utils.transaction import Quote, QUOTE_TIMEOUT_SECONDS
 
 from utils.user import user
 
@@ -42,7 +43,10 @@ def main_menu():
                 MenuOption("2", "Show rates", show_rates),
                 MenuOption("3", "Buy FX", buy_fx),
                 MenuOption("4", "Sell FX", sell_fx),
-                MenuOption("5", "Logout", logout)
+                MenuOption("5", "Convert FX", convert_fx),
+                MenuOption("6", "Trade history", show_trade_history),
+                MenuOption("7", "Limit/stop orders", manage_orders),
+                MenuOption("8", "Logout", logout)
             ]
         menu_options.append(MenuOption("x", "Exit", close))
         menu = Menu(menu_options)
@@ -74,10 +78,12 @@ def new_user() -> None:
             print("Passwords do not match. Try again.")
             continue
         break
-    hashed_password = hash_password(new_password)
+    hashed_password = password_hasher.hash(new_password)
     try:
         create_user(new_username, hashed_password)
         print(f"User {new_username} created!")
+    except UserExistsError:
+        print("User already exists.")
     except Exception:
         print("Error creating user.")
 
@@ -117,18 +123,108 @@ def close():
 
 @print_lines()
 def show_portfolio():
-    """Prints current portfolio."""
-    df = get_portfolio(user.username)
-    print(df.to_string(index=False, header=["Currency", "Quantity"]))
+    """Prints current portfolio and its value in the base currency."""
+    portfolio = get_portfolio(user.username)
+    print(portfolio.to_string())
+    try:
+        value = portfolio.value(get_snapshot().rates)
+    except Exception:
+        logger.info("Couldn't value portfolio", exc_info=True)
+        print("Value unavailable: error getting FX rates.")
+        return
+    print(f"Value: {value.name} {value.quantity_str}")
+
+@print_lines("Trade History")
+def show_trade_history(page_size: int = 10):
+    """Prints the user's trades, newest first, a page at a time."""
+    before_id = None
+    while True:
+        try:
+            entries = get_trade_history(user.uid, page_size, before_id)
+        except DatabaseError:
+            print("Error getting trade history.")
+            return
+        if not entries:
+            print("No more trades." if before_id else "No trades yet.")
+            return
+        for entry in entries:
+            print(entry)
+        if len(entries) < page_size:
+            return
+        if input("More (y/n): ").strip().lower() != "y":
+            return
+        before_id = entries[-1].trade_id
+
+@print_lines("Limit/Stop Orders")
+def manage_orders():
+    """Prints the user's open orders and places or cancels orders."""
+    while True:
+        try:
+            orders = get_open_orders(user.uid)
+        except DatabaseError:
+            print("Error getting orders.")
+            return
+        for order in orders:
+            print(order)
+        if not orders:
+            print("No open orders.")
+        action = input("Place (p), cancel (c) or blank to return: ").strip().lower()
+        if action == "p":
+            place_resting_order()
+        elif action == "c":
+            order_id = input("Order to cancel: #").strip()
+            try:
+                cancelled = order_id.isdigit() and cancel_order(user.uid, int(order_id))
+            except DatabaseError:
+                print("Error cancelling order.")
+                continue
+            print("Order cancelled." if cancelled else "No such open order.")
+        else:
+            return
+
+def place_resting_order():
+    """Menu for placing a limit or stop order."""
+    print("A limit order fills once the rate rises to the trigger, a stop order once it falls to it.")
+    print("Enter blank value to cancel.")
+    print(", ".join(ccy.name for ccy in CCY))
+    fields = {}
+    for field, prompt in (("kind", "Kind (limit/stop): "), ("sold", "Currency to sell: "),
+                          ("bought", "Currency to buy: "), ("quantity", "Quantity to sell: ")):
+        fields[field] = input(prompt).strip()
+        if not fields[field]:
+            print("Aborting: Blank value.")
+            return
+    try:
+        snapshot = get_snapshot()
+        sold_ccy, bought_ccy = CCY.from_string(fields["sold"].upper()), CCY.from_string(fields["bought"].upper())
+        print(f"Current rate: 1 {sold_ccy.name} = {bought_ccy.name} {snapshot.cross(sold_ccy, bought_ccy)}")
+    except Exception:
+        logger.info("Couldn't quote order rate", exc_info=True)
+    fields["trigger"] = input("Trigger rate: ").strip()
+    if not fields["trigger"]:
+        print("Aborting: Blank value.")
+        return
+
+    try:
+        kind, sold, bought_ccy, trigger = parse_order(**fields)
+    except InvalidOrderError as e:
+        print(f"Invalid order: {e}.")
+        return
+    try:
+        order = place_order(user.uid, kind, sold, bought_ccy, trigger)
+    except DatabaseError:
+        print("Error placing order.")
+        return
+    print(f"Placed: {order}")
 
 @print_lines("Show Rates")
 def show_rates():
     """Prints all current FX rates."""
     try:
-        rates = get_rates()
+        snapshot = get_snapshot()
         print("1 USD =")
-        for rate in rates:
-            print(f"  {rate} {rates[rate]}")
+        for ccy, rate in snapshot.rates.items():
+            print(f"  {ccy.name} {rate}")
     except Exception:
         print("Error getting FX rates.")
 
@@ -160,42 +256,23 @@ def buy_fx():
         if len(base_quantity_sold_str) == 0:
             print("Aborting: Blank quantity.")
             return
-        if not BASE_CURRENCY.valid_quantity(base_quantity_sold_str):
+        if (base_minor_sold := BASE_CURRENCY.parse_quantity(base_quantity_sold_str)) is None:
             print("Invalid quantity. Try again.")
             continue
-        base_sold = Currency.from_string(BASE_CURRENCY, base_quantity_sold_str)
+        base_sold = Currency.from_minor(BASE_CURRENCY, base_minor_sold)
         if base_sold.quantity > base.quantity:
             print("Insufficient funds. Try again.")
             continue
         break
 
     # Verify trade
-    while True:
-        if (fx_rate := get_rate(fx_ccy)) is None:
-            print("Error getting FX rates.")
-            return
-        quote_time = datetime.now()
-
-        fx_bought = base_sold.to_fx(fx_ccy, fx_rate)
-        transaction = Transaction(fx_bought, base_sold, fx_rate, quote_time)
-
-        print(F"Quote valid for {QUOTE_TIMEOUT_SECONDS} seconds:")
-        transaction.print()
-        while True:
-            confirm = input("Confirm (y/n): ").strip().lower()
-            if transaction.expired():
-                print("Quote expired. Try again.")
-                return
+    if (fx_rate := get_rate(fx_ccy)) is None:
+        print("Error getting FX rates.")
+        return
+    quote_time = datetime.now()
 
-            if confirm == "n":
-                print("Trade aborted.")
-                return
-            elif confirm == "y":
-                if transaction.execute():
-                    print("Confirmed!")
-                else:
-                    print("Error executing transaction.")
-                return
+    fx_bought = base_sold.to_fx(fx_ccy, fx_rate)
+    confirm_quote(Quote(fx_bought, base_sold, fx_rate, quote_time))
 
 @print_lines("Sell FX")
 def sell_fx():
@@ -225,42 +302,124 @@ def sell_fx():
         if len(fx_quantity_sold_str) == 0:
             print("Aborting: Blank quantity.")
             return
-        if not fx_ccy.valid_quantity(fx_quantity_sold_str):
+        if (fx_minor_sold := fx_ccy.parse_quantity(fx_quantity_sold_str)) is None:
             print("Invalid quantity. Try again.")
             continue
-        fx_sold = Currency.from_string(fx_ccy, fx_quantity_sold_str)
+        fx_sold = Currency.from_minor(fx_ccy, fx_minor_sold)
         if fx_sold.quantity > fx.quantity:
             print("Insufficient funds. Try again.")
             continue
         break
 
     # Verify trade
+    if (fx_rate := get_rate(fx_ccy)) is None:
+        print("Error getting FX rates.")
+        return
+    quote_time = datetime.now()
+
+    base_bought = fx_sold.to_base(fx_rate)
+    confirm_quote(Quote(base_bought, fx_sold, fx_rate, quote_time))
+
+@print_lines("Convert FX")
+def convert_fx():
+    """Menu for converting one FX to another in a single trade."""
+    print("Enter FX to sell and FX to buy. Enter blank value to cancel.")
+    print(", ".join(FX_CURRENCY_NAMES))
+    # Verify FX
+    while True:
+        sold_ccy = input("FX to sell: ").strip().upper()
+        if len(sold_ccy) == 0:
+            print("Aborting: Blank currency.")
+            return
+        if sold_ccy not in FX_CURRENCY_NAMES:
+            print("Invalid currency. Try again.")
+            continue
+        break
+    sold_ccy = CCY.from_string(sold_ccy)
     while True:
-        if (fx_rate := get_rate(fx_ccy)) is None:
-            print("Error getting FX rates.")
+        bought_ccy = input("FX to buy: ").strip().upper()
+        if len(bought_ccy) == 0:
+            print("Aborting: Blank currency.")
             return
-        quote_time = datetime.now()
+        if bought_ccy not in FX_CURRENCY_NAMES:
+            print("Invalid currency. Try again.")
+            continue
+        if bought_ccy == sold_ccy.name:
+            print("Can't convert to the same currency. Try again.")
+            continue
+        break
+    bought_ccy = CCY.from_string(bought_ccy)
+    fx = get_currency_owned(sold_ccy)
+    print(f"Balance: {sold_ccy.name} {fx.quantity_str}")
+    if fx.quantity <= 0:
+        print("Insufficient funds.")
+        return
+
+    # Verify quantity of fx to sell
+    while True:
+        fx_quantity_sold_str = input(f"Quantity to sell: {sold_ccy.name} ").strip()
+        if len(fx_quantity_sold_str) == 0:
+            print("Aborting: Blank quantity.")
+            return
+        if (fx_minor_sold := sold_ccy.parse_quantity(fx_quantity_sold_str)) is None:
+            print("Invalid quantity. Try again.")
+            continue
+        fx_sold = Currency.from_minor(sold_ccy, fx_minor_sold)
+        if fx_sold.quantity > fx.quantity:
+            print("Insufficient funds. Try again.")
+            continue
+        break
 
-        base_bought = fx_sold.to_base(fx_rate)
-        transaction = Transaction(base_bought, fx_sold, fx_rate, quote_time)
+    # Verify trade
+    try:
+        snapshot = get_snapshot()
+    except Exception:
+        print("Error getting FX rates.")
+        return
+    if sold_ccy not in snapshot or bought_ccy not in snapshot:
+        print("Error getting FX rates.")
+        return
+    quote_time = datetime.now()
 
-        print(F"Quote valid for {QUOTE_TIMEOUT_SECONDS} seconds:")
-        transaction.print()
-        while True:
-            confirm = input("Confirm (y/n): ").strip().lower()
-            if transaction.expired():
-                print("Quote expired. Try again.")
-                return
+    fx_bought = snapshot.convert(fx_sold, bought_ccy)
+    if fx_bought.quantity <= 0:
+        print("Quantity too small.")
+        return
+    confirm_quote(Quote(fx_bought, fx_sold, snapshot.cross(sold_ccy, bought_ccy), quote_time))
+
+def confirm_quote(quote: Quote):
+    """Holds the sold currency for a quote and executes it if the user confirms in time."""
+    try:
+        quote.reserve()
+    except InsufficientFundsError:
+        print("Insufficient funds.")
+        return
+    except DatabaseError:
+        print("Error executing transaction.")
+        return
 
-            if confirm == "n":
-                print("Trade aborted.")
+    print(F"Quote valid for {QUOTE_TIMEOUT_SECONDS} seconds:")
+    quote.print()
+    while True:
+        confirm = input("Confirm (y/n): ").strip().lower()
+        if confirm == "n":
+            quote.release()
+            print("Trade aborted.")
+            return
+        elif confirm == "y":
+            try:
+                balances = quote.confirm()
+            except QuoteExpiredError:
+                print("Quote expired. Try again.")
                 return
-            elif confirm == "y":
-                if transaction.execute():
-                    print("Confirmed!")
-                else:
-                    print("Error executing transaction.")
+            except DatabaseError:
+                quote.release()
+                print("Error executing transaction.")
                 return
+            print("Confirmed!")
+            for balance in balances:
+                print(f"Balance: {balance.name} {balance.quantity_str}")
+            return
 
 class MenuOption:
     """Represents one menu option a user can select.
@@ -0,0 +1,181 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import functools
+from logging import getLogger
+import os
+import threading
+import time
+from typing import Callable, Iterator
+
+logger = getLogger(__name__)
+
+# Upper bounds in seconds of latency histogram buckets, from 50 µs to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Counts observations into fixed buckets, like a Prometheus histogram.
+
+    Observing is a bisect and three additions under a lock, so it is cheap enough for
+    every trade.
+
+    Args:
+        name (str): Metric name, e.g. "fx_trade_seconds".
+        description (str): Help text exported with the metric.
+        buckets (tuple[float, ...]): Sorted upper bounds of the buckets. Larger observations
+            fall in an implicit +Inf bucket.
+    """
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes the seconds spent in the enclosed block, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def timed(self, func: Callable) -> Callable:
+        """Decorator observing the seconds spent in each call of func."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start)
+        return wrapper
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        """Returns the count per bucket, with +Inf last, the sum and the count of observations."""
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def quantile(self, q: float) -> float:
+        """Returns an estimate of the q quantile: the upper bound of the bucket it falls in.
+        None if nothing has been observed, inf if it falls beyond the last bucket."""
+        counts, _, count = self.snapshot()
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._sum = 0.0
+            self._count = 0
+
+
+class Registry:
+    """Holds the application's histograms and exports them."""
+    def __init__(self):
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._exporter: threading.Thread = None
+        self._stop = threading.Event()
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        """Returns the histogram called name, creating it if needed."""
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, description, buckets)
+            return self._histograms[name]
+
+    def dump(self) -> dict[str, dict]:
+        """Returns count, sum, mean and p50/p90/p99 estimates of every histogram, in seconds."""
+        summary = {}
+        for histogram in list(self._histograms.values()):
+            _, total, count = histogram.snapshot()
+            summary[histogram.name] = {
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else None,
+                "p50": histogram.quantile(0.5),
+                "p90": histogram.quantile(0.9),
+                "p99": histogram.quantile(0.99),
+            }
+        return summary
+
+    def to_prometheus(self) -> str:
+        """Returns every histogram in the Prometheus text exposition format."""
+        lines = []
+        for histogram in list(self._histograms.values()):
+            counts, total, count = histogram.snapshot()
+            lines.append(f"# HELP {histogram.name} {histogram.description}")
+            lines.append(f"# TYPE {histogram.name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip((*histogram.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                lines.append(f'{histogram.name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{histogram.name}_sum {total}")
+            lines.append(f"{histogram.name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Writes every histogram to path in the Prometheus text format, replacing the file
+        atomically so a scraper never reads it half written."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    def start_exporter(self, path: str, interval: float = 15.0):
+        """Writes the histograms to path every interval seconds from a daemon thread, and once
+        more on stop_exporter()."""
+        def run():
+            while not self._stop.wait(interval):
+                self._export(path)
+            self._export(path)
+
+        self._stop.clear()
+        self._exporter = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+        self._exporter.start()
+        logger.info("Exporting metrics to %s every %s s", path, interval)
+
+    def stop_exporter(self):
+        if self._exporter is not None:
+            self._stop.set()
+            self._exporter.join()
+            self._exporter = None
+
+    def _export(self, path: str):
+        try:
+            self.write_prometheus(path)
+        except OSError:
+            logger.warning("Error writing metrics to %s", path, exc_info=True)
+
+    def reset(self):
+        for histogram in list(self._histograms.values()):
+            histogram.reset()
+
+
+# Singleton
+metrics = Registry()
+
+# Hot path latencies
+rate_fetch_seconds = metrics.histogram("fx_rate_fetch_seconds", "Time fetching a rate snapshot from the rate source.")
+db_read_seconds = metrics.histogram("fx_db_read_seconds", "Time reading users, balances or trades from the database.")
+db_write_seconds = metrics.histogram("fx_db_write_seconds", "Time of database transactions writing users, balances, trades or rates.")
+trade_seconds = metrics.histogram("fx_trade_seconds", "Time executing a trade, from submission to commit.")
+match_seconds = metrics.histogram("fx_match_seconds", "Time matching resting orders against a new rate snapshot, before filling them.")
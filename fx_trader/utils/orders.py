@@ -0,0 +1,176 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from heapq import heapify, heappop, heappush
+from logging import getLogger
+import threading
+
+from utils.currency import CCY, Currency
+from utils.rate_snapshot import RateSnapshot
+
+logger = getLogger(__name__)
+
+ORDER_KINDS = ("limit", "stop")
+
+# Cancelled orders left in the heaps before they are rebuilt without them
+COMPACT_MIN = 1024
+
+class InvalidOrderError(ValueError):
+    pass
+
+class RestingOrder:
+    """Represents one limit or stop order waiting for its trigger rate.
+
+    The trigger is a rate of bought per sold, as quoted by RateSnapshot.cross(). A limit order
+    fills once the rate rises to the trigger or above, a stop order once it falls to the
+    trigger or below. Either fills the whole quantity at the rate of the snapshot that
+    crossed the trigger.
+
+    Args:
+        order_id (int): Id of the order. Increases with placement order.
+        uid (int): User id of the account the order trades.
+        kind (str): "limit" or "stop".
+        sold (Currency): Currency debited when the order fills.
+        bought_ccy (CCY): Currency credited when the order fills.
+        trigger (Decimal): Rate of bought per sold the order fills at.
+        created_at (datetime): Time the order was placed.
+    """
+    __slots__ = ("order_id", "uid", "kind", "sold", "bought_ccy", "trigger", "created_at")
+
+    def __init__(self, order_id: int, uid: int, kind: str, sold: Currency, bought_ccy: CCY,
+                 trigger: Decimal, created_at: datetime):
+        self.order_id = order_id
+        self.uid = uid
+        self.kind = kind
+        self.sold = sold
+        self.bought_ccy = bought_ccy
+        self.trigger = trigger
+        self.created_at = created_at
+
+    @property
+    def pair(self) -> tuple[CCY, CCY]:
+        return self.sold.ccy, self.bought_ccy
+
+    def triggered(self, rate: Decimal) -> bool:
+        """Returns whether the order fills at a rate of bought per sold."""
+        return rate >= self.trigger if self.kind == "limit" else rate <= self.trigger
+
+    def __str__(self):
+        condition = ">=" if self.kind == "limit" else "<="
+        return "#{} {} {} {} {} => {} when {} {}".format(
+            self.order_id, self.created_at.strftime("%Y-%m-%d %H:%M:%S"), self.kind,
+            self.sold.name, self.sold.quantity_str, self.bought_ccy.name, condition, self.trigger)
+
+
+def parse_order(kind: str, sold: str, bought: str, quantity: str, trigger: str) -> tuple[str, Currency, CCY, Decimal]:
+    """Validates the fields of a new order as entered.
+
+    Returns:
+        The kind, sold currency, bought currency and trigger of the order.
+
+    Raises:
+        InvalidOrderError: If a field is invalid.
+    """
+    kind = str(kind or "").strip().lower()
+    if kind not in ORDER_KINDS:
+        raise InvalidOrderError("invalid kind")
+    sold_ccy = CCY.from_string(str(sold or "").strip().upper())
+    bought_ccy = CCY.from_string(str(bought or "").strip().upper())
+    if sold_ccy is None or bought_ccy is None:
+        raise InvalidOrderError("invalid currency")
+    if sold_ccy == bought_ccy:
+        raise InvalidOrderError("same currency")
+    if (minor := sold_ccy.parse_quantity(str(quantity or "").strip())) is None:
+        raise InvalidOrderError("invalid quantity")
+    try:
+        trigger = Decimal(str(trigger or "").strip())
+    except InvalidOperation:
+        raise InvalidOrderError("invalid trigger")
+    if not trigger.is_finite() or trigger <= 0:
+        raise InvalidOrderError("invalid trigger")
+    return kind, Currency.from_minor(sold_ccy, minor), bought_ccy, trigger
+
+
+class OrderBook:
+    """Holds resting orders by currency pair, indexed by trigger rate.
+
+    Each pair has two heaps: limit orders by lowest trigger first, and stop orders by highest
+    trigger first. A match pass only looks at the top of each heap and pops while the
+    snapshot's rate crosses it, so its cost grows with the orders filled, not the orders
+    resting. Orders at the same trigger fill oldest first.
+
+    Removed orders are dropped from the heaps lazily, when they reach the top or when enough
+    have piled up to rebuild the heaps without them.
+    """
+    def __init__(self):
+        self._orders: dict[int, RestingOrder] = {}
+        # (sold, bought) -> heap of (trigger, order_id) for limits and (-trigger, order_id) for stops
+        self._limits: dict[tuple[CCY, CCY], list[tuple[Decimal, int]]] = {}
+        self._stops: dict[tuple[CCY, CCY], list[tuple[Decimal, int]]] = {}
+        self._removed = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._orders
+
+    def add(self, order: RestingOrder):
+        """Adds an order to the book. Adding an order already in the book does nothing."""
+        with self._lock:
+            if order.order_id in self._orders:
+                return
+            self._orders[order.order_id] = order
+            self._push(order)
+
+    def _push(self, order: RestingOrder):
+        if order.kind == "limit":
+            heappush(self._limits.setdefault(order.pair, []), (order.trigger, order.order_id))
+        else:
+            heappush(self._stops.setdefault(order.pair, []), (-order.trigger, order.order_id))
+
+    def discard(self, order_id: int) -> RestingOrder:
+        """Removes an order from the book, returning it, or None if it isn't in the book."""
+        with self._lock:
+            if (order := self._orders.pop(order_id, None)) is None:
+                return None
+            self._removed += 1
+            if self._removed > max(COMPACT_MIN, len(self._orders)):
+                self._compact()
+            return order
+
+    def _compact(self):
+        """Rebuilds the heaps from the orders still in the book."""
+        self._limits = {}
+        self._stops = {}
+        for order in self._orders.values():
+            heaps = self._limits if order.kind == "limit" else self._stops
+            key = order.trigger if order.kind == "limit" else -order.trigger
+            heaps.setdefault(order.pair, []).append((key, order.order_id))
+        for heap in (*self._limits.values(), *self._stops.values()):
+            heapify(heap)
+        self._removed = 0
+
+    def match(self, snapshot: RateSnapshot) -> list[tuple[RestingOrder, Decimal]]:
+        """Removes and returns the orders a snapshot triggers, oldest first, each with the
+        rate of bought per sold it fills at."""
+        crossed = []
+        with self._lock:
+            for heaps, sign in ((self._limits, 1), (self._stops, -1)):
+                for pair, heap in heaps.items():
+                    if not heap:
+                        continue
+                    try:
+                        rate = snapshot.cross(*pair)
+                    except KeyError:
+                        continue
+                    # Limits fill while trigger <= rate, stops while -trigger <= -rate
+                    key = rate if sign == 1 else -rate
+                    while heap and heap[0][0] <= key:
+                        _, order_id = heappop(heap)
+                        if (order := self._orders.pop(order_id, None)) is None:
+                            self._removed -= 1
+                            continue
+                        crossed.append((order, rate))
+        crossed.sort(key=lambda fill: fill[0].order_id)
+        return crossed
@@ -0,0 +1,61 @@
+from decimal import Decimal
+from typing import Iterable, Iterator
+
+from utils.currency import CCY, BASE_CURRENCY, Currency
+
+class Portfolio:
+    """Represents the balances held by one user, one Currency per CCY.
+
+    Args:
+        balances (Iterable[Currency]): Balance of each currency held.
+    """
+    HEADER = ("Currency", "Quantity")
+
+    def __init__(self, balances: Iterable[Currency]):
+        self.balances: list[Currency] = list(balances)
+
+    def __iter__(self) -> Iterator[Currency]:
+        return iter(self.balances)
+
+    def __len__(self) -> int:
+        return len(self.balances)
+
+    def to_string(self, header: bool = True) -> str:
+        """Returns the portfolio as a table with one row per currency.
+
+        Args:
+            header (bool): Include a header row.
+        """
+        rows = [(balance.name, balance.quantity_str) for balance in self.balances]
+        if header:
+            rows.insert(0, self.HEADER)
+        name_width = max((len(name) for name, _ in rows), default=0)
+        quantity_width = max((len(quantity) for _, quantity in rows), default=0)
+        return "\n".join(f"{name:<{name_width}} {quantity:>{quantity_width}}" for name, quantity in rows)
+
+    def value(self, rates: dict[CCY, Decimal]) -> Currency:
+        """Returns the total value of the portfolio in the base currency.
+        Each FX balance is converted with Currency.to_base, rounding each one down.
+
+        Args:
+            rates (dict[CCY, Decimal]): Rate of every FX currency held, in FX per base,
+                e.g. RateSnapshot.rates.
+        """
+        total = Currency.from_minor(BASE_CURRENCY, 0)
+        for balance in self.balances:
+            if balance.ccy == BASE_CURRENCY:
+                total += balance
+            else:
+                total += balance.to_base(rates[balance.ccy])
+        return total
+
+    def to_dataframe(self):
+        """Returns the portfolio as a pandas DataFrame with currency and quantity columns.
+        Requires pandas, which is only imported here."""
+        import pandas as pd
+
+        return pd.DataFrame([(balance.name, balance.quantity) for balance in self.balances],
+                            columns=["currency", "quantity"])
+
+    def __str__(self):
+        return self.to_string()
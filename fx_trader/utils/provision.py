@@ -0,0 +1,74 @@
+import csv
+from itertools import islice
+import json
+from logging import getLogger
+from typing import Iterator, TextIO
+
+from utils.db import get_user_ids, provision_users
+from utils.security import password_hasher
+
+logger = getLogger(__name__)
+
+ACCOUNT_FIELDS = ("username", "password")
+
+def read_accounts(file: TextIO, fmt: str) -> Iterator[tuple[str, str]]:
+    """Streams (username, password) pairs from a CSV file with a header row, or from JSON lines.
+
+    Usernames are normalised as at registration. Records without both fields are skipped.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(file)
+        records = ((reader.line_num, row) for row in reader)
+    else:
+        records = _read_json_lines(file)
+
+    for line_number, fields in records:
+        username = str(fields.get("username") or "").strip().lower()
+        password = str(fields.get("password") or "")
+        if not username or not password:
+            logger.info("Skipping account without username and password on line %s", line_number)
+            continue
+        yield username, password
+
+def _read_json_lines(file: TextIO) -> Iterator[tuple[int, dict]]:
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            fields = json.loads(line)
+            if not isinstance(fields, dict):
+                raise ValueError("not an object")
+        except ValueError:
+            fields = {}
+        yield line_number, fields
+
+
+def run_provision(accounts: TextIO, fmt: str = "jsonl", chunk_size: int = 10_000,
+                  rounds: int = None) -> dict[str, int]:
+    """Creates users from a stream of accounts, each with the initial balances.
+
+    Passwords of each chunk are hashed across the password_hasher's processes, then the
+    chunk is inserted in one transaction. Existing usernames are skipped, and aren't hashed
+    if they already existed when the chunk was read.
+
+    Args:
+        accounts (TextIO): Accounts with fields ACCOUNT_FIELDS.
+        fmt (str): Format of accounts, "csv" or "jsonl".
+        chunk_size (int): Accounts hashed and inserted at a time.
+        rounds (int, optional): bcrypt work factor. Defaults to BCRYPT_ROUNDS. Lower factors make
+            provisioning faster, and each hash is raised to BCRYPT_ROUNDS on the user's first login.
+
+    Returns:
+        Number of accounts created and skipped as existing.
+    """
+    counts = {"created": 0, "existing": 0}
+    stream = read_accounts(accounts, fmt)
+    while chunk := list(islice(stream, chunk_size)):
+        taken = get_user_ids(username for username, _ in chunk)
+        new = [(username, password) for username, password in chunk if username not in taken]
+        hashes = password_hasher.hash_many([password for _, password in new], rounds)
+        created, existing = provision_users(zip((username for username, _ in new), hashes), chunk_size)
+        counts["created"] += created
+        counts["existing"] += existing + len(chunk) - len(new)
+        logger.info("Provisioned %s accounts", sum(counts.values()))
+    return counts
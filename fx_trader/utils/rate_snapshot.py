@@ -0,0 +1,85 @@
+from decimal import Decimal, localcontext
+from logging import getLogger
+from types import MappingProxyType
+
+from utils.currency import CCY, BASE_CURRENCY, Currency
+
+logger = getLogger(__name__)
+
+# Significant digits of cross rates, as quoted and recorded in the ledger
+CROSS_RATE_DIGITS = 10
+
+class RateSnapshot:
+    """One fetch of FX rates, parsed once and shared read-only between threads.
+
+    Holds the rate of every known currency in FX per base, with the base currency at 1, and
+    the matrix of cross rates between every pair, triangulated through the base currency and
+    rounded to CROSS_RATE_DIGITS. Cross rates are for quoting: amounts are converted with
+    convert(), from the rates themselves, so the matrix's rounding never reaches a balance.
+
+    Args:
+        timestamp (int): Snapshot time in Unix seconds.
+        rates (dict[str, str]): Rates as fetched, by currency name in FX per base. Unknown
+            currencies are ignored.
+    """
+    def __init__(self, timestamp: int, rates: dict[str, str]):
+        self.timestamp = timestamp
+        self.strings: MappingProxyType[str, str] = MappingProxyType(dict(rates))
+
+        per_base = {BASE_CURRENCY: Decimal(1)}
+        for name, rate in rates.items():
+            if (ccy := CCY.from_string(name)) is not None and ccy != BASE_CURRENCY:
+                per_base[ccy] = Decimal(rate)
+        self.currencies: tuple[CCY, ...] = tuple(sorted(per_base, key=lambda ccy: ccy.value))
+        self._index = {ccy: i for i, ccy in enumerate(self.currencies)}
+        self._per_base = tuple(per_base[ccy] for ccy in self.currencies)
+        self.rates: MappingProxyType[CCY, Decimal] = MappingProxyType(
+            {ccy: per_base[ccy] for ccy in self.currencies if ccy != BASE_CURRENCY})
+
+        # matrix[i][j] is currencies[j] per currencies[i]; the inverse of matrix[j][i]
+        with localcontext() as context:
+            context.prec = CROSS_RATE_DIGITS
+            self.matrix: tuple[tuple[Decimal, ...], ...] = tuple(
+                tuple(bought / sold for bought in self._per_base) for sold in self._per_base)
+        self._array = None
+
+    def __contains__(self, ccy: CCY) -> bool:
+        return ccy in self._index
+
+    def rate(self, ccy: CCY) -> Decimal:
+        """Returns the rate of ccy in FX per base, or None if the snapshot has none."""
+        if (i := self._index.get(ccy)) is None:
+            return None
+        return self._per_base[i]
+
+    def cross(self, sold: CCY, bought: CCY) -> Decimal:
+        """Returns the rate of bought per sold.
+
+        Raises:
+            KeyError: If the snapshot has no rate for either currency.
+        """
+        return self.matrix[self._index[sold]][self._index[bought]]
+
+    def convert(self, currency: Currency, ccy: CCY) -> Currency:
+        """Converts currency to ccy through the base currency, rounding down once.
+
+        Raises:
+            KeyError: If the snapshot has no rate for either currency.
+        """
+        return currency.convert(ccy, self._per_base[self._index[currency.ccy]], self._per_base[self._index[ccy]])
+
+    def array(self):
+        """Returns the cross rate matrix as a read-only NumPy float64 array, indexed as
+        currencies, for analytics. Built on first use."""
+        if self._array is None:
+            import numpy as np
+
+            per_base = np.array([float(rate) for rate in self._per_base], dtype=np.float64)
+            array = per_base[np.newaxis, :] / per_base[:, np.newaxis]
+            array.flags.writeable = False
+            # Built at most a few times if threads race, each the same
+            self._array = array
+        return self._array
+
+    def __repr__(self):
+        return f"RateSnapshot({self.timestamp}, {len(self.rates)} rates)"
@@ -0,0 +1,157 @@
+from abc import ABC, abstractmethod
+import csv
+import json
+from logging import getLogger
+import math
+import os
+import random
+import time
+from typing import Iterator
+
+from utils.currency import BASE_CURRENCY, FX_CURRENCY_NAMES
+
+logger = getLogger(__name__)
+
+Snapshot = tuple[int, dict[str, str]]
+
+class RateSource(ABC):
+    """A source of FX rate snapshots."""
+    @abstractmethod
+    def fetch(self) -> Snapshot:
+        """Returns the snapshot timestamp (Unix seconds) and the rates of every FX currency,
+        as strings in FX per base."""
+
+
+class OpenExchangeRatesSource(RateSource):
+    """Latest rates from the Open Exchange Rates API.
+
+    Args:
+        api_key (str): Open Exchange Rates app id.
+        timeout (float): Seconds to wait for the API.
+    """
+    def __init__(self, api_key: str, timeout: float = 10):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.url = ("https://openexchangerates.org/api/latest.json"
+                    f"?app_id={api_key}&base={BASE_CURRENCY.name}&symbols={",".join(FX_CURRENCY_NAMES)}")
+
+    def fetch(self) -> Snapshot:
+        import requests
+
+        response = requests.get(self.url, timeout=self.timeout)
+        data = response.json(parse_float=str)
+        if response.status_code != 200:
+            logger.info("Error getting FX rates: %s: %s", response.status_code, response.text)
+            raise ConnectionError("Error getting FX rates")
+
+        if "rates" not in data:
+            logger.info("No \"rates\" in API response: %s", response.text)
+            raise ConnectionError("Error getting FX rates")
+
+        return int(data.get("timestamp", time.time())), data["rates"]
+
+
+def read_snapshots(path: str) -> Iterator[Snapshot]:
+    """Streams snapshots from a file, one at a time.
+
+    Files ending in .csv need a header of "timestamp" followed by currency names, with one
+    snapshot per row. Any other file is read as JSON lines in the Open Exchange Rates format,
+    {"timestamp": ..., "rates": {...}}, one snapshot per line.
+    """
+    with open(path, newline="") as file:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(file):
+                timestamp = int(row.pop("timestamp"))
+                yield timestamp, {name: rate.strip() for name, rate in row.items()}
+        else:
+            # Rates kept as strings, so they parse exactly as Decimals
+            decoder = json.JSONDecoder(parse_float=str, parse_int=str)
+            for line in file:
+                if not line.strip():
+                    continue
+                data = decoder.decode(line)
+                yield int(data["timestamp"]), {name: str(rate) for name, rate in data["rates"].items()}
+
+
+class FileRateSource(RateSource):
+    """Replays recorded snapshots from a file, returning the next one on each fetch.
+
+    Args:
+        path (str): JSON lines or CSV file of snapshots, see read_snapshots().
+        loop (bool): Start again from the first snapshot after the last. Otherwise the last
+            snapshot is repeated.
+    """
+    def __init__(self, path: str, loop: bool = True):
+        if not os.path.isfile(path):
+            raise ValueError(f"No such rates file: {path}")
+        self.path = path
+        self.loop = loop
+        self._snapshots = read_snapshots(path)
+        self._last: Snapshot = None
+
+    def fetch(self) -> Snapshot:
+        try:
+            self._last = next(self._snapshots)
+        except StopIteration:
+            if self._last is None:
+                raise ConnectionError(f"No snapshots in {self.path}")
+            if self.loop:
+                self._snapshots = read_snapshots(self.path)
+                self._last = next(self._snapshots)
+        return self._last
+
+
+class RandomWalkRateSource(RateSource):
+    """Synthetic rates that take a geometric random walk step on each fetch.
+
+    Args:
+        start (dict[str, float], optional): Starting rate of each FX currency. Defaults to
+            START_RATES, and 1 for any currency missing from it.
+        volatility (float): Standard deviation of each log-rate step.
+        interval (int): Seconds the snapshot timestamp advances per fetch.
+        seed (int, optional): Seed for a reproducible walk.
+    """
+    START_RATES = {"AUD": 1.5, "CAD": 1.36, "CHF": 0.88, "EUR": 0.92, "GBP": 0.79, "JPY": 150.0}
+
+    def __init__(self, start: dict[str, float] = None, volatility: float = 0.0005,
+                 interval: int = 1, seed: int = None):
+        start = start or self.START_RATES
+        self.rates = {name: float(start.get(name, 1)) for name in FX_CURRENCY_NAMES}
+        self.volatility = volatility
+        self.interval = interval
+        self.timestamp = int(time.time())
+        self._random = random.Random(seed)
+
+    def fetch(self) -> Snapshot:
+        self.timestamp += self.interval
+        for name, rate in self.rates.items():
+            self.rates[name] = rate * math.exp(self._random.gauss(0, self.volatility))
+        return self.timestamp, {name: f"{rate:.6f}" for name, rate in self.rates.items()}
+
+
+def rate_source_from_config(spec: str) -> RateSource:
+    """Builds a rate source from a config string, as set in FX_RATE_SOURCE.
+
+    Args:
+        spec (str): One of
+            "oer"           Open Exchange Rates, with the app id in OER_API_KEY.
+            "file:<path>"   Replay of a snapshot file, see FileRateSource.
+            "random[:seed]" Synthetic random walk, see RandomWalkRateSource.
+
+    Raises:
+        ValueError: If spec is not recognised or the source can't be configured.
+    """
+    kind, _, argument = spec.strip().partition(":")
+    kind = kind.lower()
+    if kind == "oer":
+        if (api_key := os.getenv("OER_API_KEY")) is None:
+            raise ValueError("No API key.")
+        return OpenExchangeRatesSource(api_key)
+    if kind == "file":
+        return FileRateSource(argument)
+    if kind == "random":
+        try:
+            return RandomWalkRateSource(seed=int(argument) if argument else None)
+        except ValueError as e:
+            raise ValueError(f"Invalid random walk seed: {argument}") from e
+    raise ValueError(f"Unknown rate source: {spec}")
@@ -1,10 +1,182 @@
-import bcrypt
+from collections import OrderedDict
+import hashlib
+import hmac
+from itertools import repeat
+from logging import getLogger
+import os
+import secrets
+import threading
+import time
+
+logger = getLogger(__name__)
+
+# bcrypt work factor of new hashes. Existing hashes of another cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("FX_BCRYPT_ROUNDS", "12"))
+
+# Processes hashing and verifying passwords. 0 runs bcrypt on the calling thread
+BCRYPT_WORKERS = int(os.getenv("FX_BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+
+# Successful logins remembered, so repeat logins skip bcrypt. 0 disables the cache
+LOGIN_CACHE_SIZE = int(os.getenv("FX_LOGIN_CACHE_SIZE", "1024"))
+LOGIN_CACHE_SECONDS = float(os.getenv("FX_LOGIN_CACHE_SECONDS", "300"))
+
+def hash_password(password: str, rounds: int = None) -> bytes:
+    import bcrypt
 
-def hash_password(password: str) -> str:
     password_bytes = password.encode('utf-8')
-    hashed_password = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    hashed_password = bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds or BCRYPT_ROUNDS))
     return hashed_password
 
-def verify_password(password:str, actual_hashed_password: str):
+def verify_password(password:str, actual_hashed_password: bytes):
+    import bcrypt
+
     password_bytes = password.encode('utf-8')
     return bcrypt.checkpw(password_bytes, actual_hashed_password)
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """Returns the work factor of a bcrypt hash, e.g. 12 for b"$2b$12$..."."""
+    return int(hashed_password.split(b"$")[2])
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    return hash_rounds(hashed_password) != BCRYPT_ROUNDS
+
+
+class PasswordHasherBusyError(Exception):
+    pass
+
+class PasswordHasher:
+    """Hashes and verifies passwords in a pool of processes, with backpressure and a cache of
+    successful verifications.
+
+    bcrypt is CPU bound, so a process per core lets logins scale across cores without
+    slowing the threads serving other requests. At most max_pending calls wait for or run in
+    the pool; callers beyond that wait up to timeout seconds for a slot, then are refused, so
+    a login storm can't queue unbounded work.
+
+    The cache holds a keyed digest of each hash and password that verified, never the
+    password itself, and is only consulted for hashes it was filled from. Failed
+    verifications aren't cached, so guessing a password always costs a bcrypt.
+
+    Args:
+        workers (int): Processes in the pool. 0 runs bcrypt on the calling thread.
+        max_pending (int, optional): Most calls in flight. Defaults to 4 per worker.
+        timeout (float): Seconds to wait for a slot before raising PasswordHasherBusyError.
+        cache_size (int): Most verifications cached. 0 disables the cache.
+        cache_seconds (float): Seconds a cached verification stays valid.
+    """
+    def __init__(self, workers: int = BCRYPT_WORKERS, max_pending: int = None, timeout: float = 5.0,
+                 cache_size: int = LOGIN_CACHE_SIZE, cache_seconds: float = LOGIN_CACHE_SECONDS):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending or 4 * max(workers, 1))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._cache_size = cache_size
+        self._cache_seconds = cache_seconds
+        self._cache: OrderedDict[bytes, float] = OrderedDict()
+        self._cache_key = secrets.token_bytes(32)
+
+    def hash(self, password: str, rounds: int = None) -> bytes:
+        """Returns a new bcrypt hash of password, at rounds or BCRYPT_ROUNDS.
+
+        Raises:
+            PasswordHasherBusyError: If no slot is free within timeout.
+        """
+        # Resolved here, so the work factor is the parent's even if workers see another config
+        return self._call(hash_password, password, rounds or BCRYPT_ROUNDS)
+
+    def hash_many(self, passwords: list[str], rounds: int = None) -> list[bytes]:
+        """Returns a new bcrypt hash of each password, hashed across all workers at once.
+
+        Takes one slot for the whole list, so a bulk job can't starve logins.
+
+        Raises:
+            PasswordHasherBusyError: If no slot is free within timeout.
+        """
+        if not passwords:
+            return []
+        rounds = rounds or BCRYPT_ROUNDS
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusyError("Too many password operations in progress.")
+        try:
+            if self.workers == 0:
+                return [hash_password(password, rounds) for password in passwords]
+            chunksize = max(1, len(passwords) // (4 * self.workers))
+            return list(self._get_pool().map(hash_password, passwords, repeat(rounds), chunksize=chunksize))
+        finally:
+            self._slots.release()
+
+    def verify(self, password: str, hashed_password: bytes) -> bool:
+        """Returns whether password matches hashed_password.
+
+        Raises:
+            PasswordHasherBusyError: If the result isn't cached and no slot is free within timeout.
+        """
+        digest = self._digest(password, hashed_password)
+        if self._cached(digest):
+            return True
+        if not self._call(verify_password, password, hashed_password):
+            return False
+        self._remember(digest)
+        return True
+
+    def _call(self, func, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusyError("Too many password operations in progress.")
+        try:
+            if self.workers == 0:
+                return func(*args)
+            return self._get_pool().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_pool(self):
+        # Started on first use, so commands that never check a password don't pay for it
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        with self._lock:
+            if self._pool is None:
+                logger.debug("Starting %s password hashing processes", self.workers)
+                # Spawned rather than forked, as the parent has threads holding locks
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _digest(self, password: str, hashed_password: bytes) -> bytes:
+        return hmac.digest(self._cache_key, hashed_password + b"\0" + password.encode("utf-8"), hashlib.sha256)
+
+    def _cached(self, digest: bytes) -> bool:
+        if self._cache_size == 0:
+            return False
+        with self._lock:
+            if (expires := self._cache.get(digest)) is None:
+                return False
+            if expires < time.monotonic():
+                del self._cache[digest]
+                return False
+            self._cache.move_to_end(digest)
+            return True
+
+    def _remember(self, digest: bytes):
+        if self._cache_size == 0:
+            return
+        with self._lock:
+            self._cache[digest] = time.monotonic() + self._cache_seconds
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+# Singleton
+password_hasher = PasswordHasher()
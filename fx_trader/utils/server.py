@@ -0,0 +1,295 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import datetime
+import functools
+import itertools
+import json
+from logging import getLogger
+
+from utils.batch import Order, OrderError
+from utils.db import DatabaseError, GroupCommitter, InsufficientFundsError, UserExistsError, \
+    cancel_order, check_password, create_user, get_open_orders, get_portfolio, get_user_id, place_order
+from utils.fx import rate_cache
+from utils.matcher import OrderMatcher
+from utils.metrics import metrics, trade_seconds
+from utils.orders import InvalidOrderError, RestingOrder, parse_order
+from utils.security import PasswordHasherBusyError, password_hasher
+from utils.transaction import Transaction, quote_timeout
+from utils.user import User, as_user
+
+logger = getLogger(__name__)
+
+# Most open quotes kept per session, the oldest are dropped first
+MAX_QUOTES = 100
+
+class RequestError(Exception):
+    pass
+
+class Session:
+    """State of one client connection: the logged in user and their open quotes."""
+    def __init__(self):
+        self.user = User()
+        self.quotes: dict[int, Transaction] = {}
+        self._quote_ids = itertools.count(1)
+
+    def add_quote(self, transaction: Transaction) -> int:
+        quote_id = next(self._quote_ids)
+        self.quotes[quote_id] = transaction
+        if len(self.quotes) > MAX_QUOTES:
+            del self.quotes[next(iter(self.quotes))]
+        return quote_id
+
+
+class TradingServer:
+    """Serves the trade engine to many clients over a line-delimited JSON protocol.
+
+    Each request is one JSON object per line with an "op" and its arguments, plus an optional
+    "id" echoed in the response. Each response is one JSON object per line with "ok" and
+    either the result fields or an "error".
+
+    Ops:
+        register  {username, password}
+        login     {username, password}
+        logout    {}
+        portfolio {}                      -> {balances: {ccy: quantity}}
+        quote     {side, ccy, quantity}   -> {quote_id, sold, bought, fx_rate, expires_in}
+        trade     {quote_id}              -> {balances: {ccy: quantity}}
+        order     {kind, sold, bought, quantity, trigger} -> {order}
+        orders    {}                      -> {orders: [order]}
+        cancel    {order_id}              -> {}
+        metrics   {}                      -> {metrics: {name: {count, sum, mean, p50, p90, p99}}}
+
+    Sides and quantities follow the menu and batch mode: "buy" spends quantity of the base
+    currency, "sell" sells quantity of FX. Database and password work runs in a thread pool so
+    the event loop only handles I/O, bcrypt itself runs in the password_hasher's processes, and
+    trades share commits through a GroupCommitter. Logins refused by the password_hasher's
+    backpressure fail with "server busy".
+
+    Orders are limit or stop orders selling quantity of sold for bought once the rate of
+    bought per sold crosses trigger, as RestingOrder describes. The server runs an
+    OrderMatcher that fills them as the rates tick.
+
+    Args:
+        workers (int): Threads in the pool for blocking work.
+    """
+    def __init__(self, workers: int = 8):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="server")
+        self._committer = GroupCommitter()
+        self.matcher = OrderMatcher(rate_cache, poll=rate_cache.ttl)
+        self._ops = {
+            "register": self._register,
+            "login": self._login,
+            "logout": self._logout,
+            "portfolio": self._portfolio,
+            "quote": self._quote,
+            "trade": self._trade,
+            "order": self._order,
+            "orders": self._orders,
+            "cancel": self._cancel,
+            "metrics": self._metrics,
+        }
+
+    async def serve_tcp(self, host: str, port: int):
+        async with await self.start_tcp(host, port) as server:
+            await server.serve_forever()
+
+    async def serve_unix(self, path: str):
+        async with await self.start_unix(path) as server:
+            await server.serve_forever()
+
+    async def start_tcp(self, host: str, port: int) -> asyncio.Server:
+        """Starts the matcher and accepts connections on host and port, 0 for any free port.
+
+        Returns:
+            The listening server, whose sockets give the port bound.
+        """
+        await self._run(self.matcher.start)
+        server = await asyncio.start_server(self._handle, host, port)
+        logger.info("Serving on %s:%s", host, server.sockets[0].getsockname()[1])
+        return server
+
+    async def start_unix(self, path: str) -> asyncio.Server:
+        """Starts the matcher and accepts connections on the unix socket at path."""
+        await self._run(self.matcher.start)
+        server = await asyncio.start_unix_server(self._handle, path)
+        logger.info("Serving on %s", path)
+        return server
+
+    def close(self):
+        """Stops the matcher, the committer and the thread pool. Call once the server is closed."""
+        self.matcher.stop()
+        self._committer.close()
+        self._pool.shutdown()
+
+    async def _run(self, func, *args):
+        # Executor threads don't inherit the task's context, so the session's user is passed along
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool, functools.partial(context.run, func, *args))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session()
+        peer = writer.get_extra_info("peername") or "unix socket"
+        logger.debug("Client connected: %s", peer)
+        try:
+            # Each connection runs in its own task, so this doesn't leak into other sessions
+            with as_user(session.user):
+                while line := await reader.readline():
+                    if line.strip():
+                        writer.write(json.dumps(await self._respond(session, line)).encode() + b"\n")
+                        await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            logger.debug("Client disconnected: %s", peer)
+            writer.close()
+
+    async def _respond(self, session: Session, line: bytes) -> dict:
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("not an object")
+            except ValueError:
+                raise RequestError("invalid JSON")
+            request_id = request.get("id")
+            if (op := self._ops.get(request.get("op"))) is None:
+                raise RequestError("unknown op")
+            result = await op(session, request)
+            response = {"ok": True, **result}
+        except RequestError as e:
+            response = {"ok": False, "error": str(e)}
+        except Exception:
+            logger.error("Error handling request.", exc_info=True)
+            response = {"ok": False, "error": "internal error"}
+        if request_id is not None:
+            response["id"] = request_id
+        return response
+
+    @staticmethod
+    def _credentials(request: dict) -> tuple[str, str]:
+        username = str(request.get("username") or "").strip().lower()
+        password = str(request.get("password") or "")
+        if not username or not password:
+            raise RequestError("username and password required")
+        return username, password
+
+    @staticmethod
+    def _logged_in(session: Session):
+        if not session.user.exists():
+            raise RequestError("not logged in")
+
+    async def _register(self, session: Session, request: dict) -> dict:
+        username, password = self._credentials(request)
+        try:
+            hashed_password = await self._run(password_hasher.hash, password)
+        except PasswordHasherBusyError:
+            raise RequestError("server busy")
+        try:
+            await self._run(create_user, username, hashed_password)
+        except UserExistsError:
+            raise RequestError("user already exists")
+        except DatabaseError:
+            raise RequestError("error creating user")
+        return {}
+
+    async def _login(self, session: Session, request: dict) -> dict:
+        username, password = self._credentials(request)
+        try:
+            if not await self._run(check_password, username, password):
+                raise RequestError("user or password incorrect")
+        except PasswordHasherBusyError:
+            raise RequestError("server busy")
+        session.user.set(await self._run(get_user_id, username), username)
+        session.quotes.clear()
+        return {"username": username}
+
+    async def _logout(self, session: Session, request: dict) -> dict:
+        session.user.logout()
+        session.quotes.clear()
+        return {}
+
+    async def _portfolio(self, session: Session, request: dict) -> dict:
+        self._logged_in(session)
+        portfolio = await self._run(get_portfolio, session.user.username)
+        return {"balances": {balance.name: balance.quantity_str for balance in portfolio}}
+
+    async def _quote(self, session: Session, request: dict) -> dict:
+        self._logged_in(session)
+        snapshot = await self._run(rate_cache.snapshot)
+        order = Order(0, request)
+        try:
+            order.price(snapshot)
+        except OrderError as e:
+            raise RequestError(str(e))
+        transaction = Transaction(order.bought, order.sold, order.fx_rate, datetime.now())
+        return {
+            "quote_id": session.add_quote(transaction),
+            "sold": {"ccy": order.sold.name, "quantity": order.sold.quantity_str},
+            "bought": {"ccy": order.bought.name, "quantity": order.bought.quantity_str},
+            "fx_rate": str(order.fx_rate),
+            "expires_in": quote_timeout.total_seconds(),
+        }
+
+    async def _trade(self, session: Session, request: dict) -> dict:
+        self._logged_in(session)
+        if (transaction := session.quotes.pop(request.get("quote_id"), None)) is None:
+            raise RequestError("unknown quote")
+        if transaction.expired():
+            raise RequestError("quote expired")
+        try:
+            with trade_seconds.time():
+                balances = await self._run(self._committer.execute, session.user.uid, transaction.b,
+                                           transaction.s, transaction.fx_rate, transaction.quote_time)
+        except InsufficientFundsError:
+            raise RequestError("insufficient funds")
+        except DatabaseError:
+            raise RequestError("error executing trade")
+        return {"balances": {balance.name: balance.quantity_str for balance in balances}}
+
+    @staticmethod
+    def _order_fields(order: RestingOrder) -> dict:
+        return {
+            "order_id": order.order_id,
+            "kind": order.kind,
+            "sold": {"ccy": order.sold.name, "quantity": order.sold.quantity_str},
+            "bought": order.bought_ccy.name,
+            "trigger": str(order.trigger),
+            "created_at": order.created_at.isoformat(),
+        }
+
+    async def _order(self, session: Session, request: dict) -> dict:
+        self._logged_in(session)
+        try:
+            kind, sold, bought_ccy, trigger = parse_order(request.get("kind"), request.get("sold"), request.get("bought"),
+                                                          request.get("quantity"), request.get("trigger"))
+        except InvalidOrderError as e:
+            raise RequestError(str(e))
+        try:
+            order = await self._run(place_order, session.user.uid, kind, sold, bought_ccy, trigger)
+        except DatabaseError:
+            raise RequestError("error placing order")
+        return {"order": self._order_fields(order)}
+
+    async def _orders(self, session: Session, request: dict) -> dict:
+        self._logged_in(session)
+        orders = await self._run(get_open_orders, session.user.uid)
+        return {"orders": [self._order_fields(order) for order in orders]}
+
+    async def _cancel(self, session: Session, request: dict) -> dict:
+        self._logged_in(session)
+        order_id = request.get("order_id")
+        if not isinstance(order_id, int):
+            raise RequestError("unknown order")
+        try:
+            if not await self._run(cancel_order, session.user.uid, order_id):
+                raise RequestError("unknown order")
+        except DatabaseError:
+            raise RequestError("error cancelling order")
+        self.matcher.book.discard(order_id)
+        return {}
+
+    async def _metrics(self, session: Session, request: dict) -> dict:
+        return {"metrics": metrics.dump()}
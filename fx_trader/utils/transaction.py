@@ -1,9 +1,13 @@
 from datetime import datetime, timedelta
 from decimal import Decimal
 from logging import getLogger
+import os
 
 from utils.currency import Currency
-from utils.db import get_currency_owned, update_currencies
+from utils.db import DatabaseError, InsufficientFundsError, GroupCommitter, HoldSweeper, \
+    confirm_hold, execute_trade, hold_funds, release_hold
+from utils.metrics import trade_seconds
+from utils.user import User, current_user
 
 logger = getLogger(__name__)
 
@@ -12,37 +16,54 @@ quote_timeout: datetime = timedelta(seconds=10)
 
 QUOTE_TIMEOUT_SECONDS: str = str(int(quote_timeout.total_seconds()))
 
+# Set FX_GROUP_COMMIT=1 to let trades from concurrent sessions share database commits
+group_committer = GroupCommitter() if os.getenv("FX_GROUP_COMMIT") == "1" else None
+
+# Returns the funds of abandoned quotes, started by the first Quote reserved
+hold_sweeper = HoldSweeper(float(os.getenv("FX_HOLD_SWEEP_SECONDS", "1")))
+
 class Transaction:
     """Represents a transaction exchanging one currency for another."""
-    def __init__(self, currency_bought: Currency, currency_sold: Currency, fx_rate: Decimal = None, quote_time: datetime = datetime.now()):
+    def __init__(self, currency_bought: Currency, currency_sold: Currency, fx_rate: Decimal = None, quote_time: datetime = None):
         """Args:
             currency_bought (Currency): Currency to be bought.
             currency_sold (Currency): Currency to be sold.
-            fx_rate (Decimal, optional): FX rate exchanged at. Used for __str__ only.
+            fx_rate (Decimal, optional): FX rate exchanged at. Used for __str__ and the trades ledger.
             quote_time (datetime, optional): Time FX rate was quoted. Defaults to current time.
         """
         self.b = currency_bought
         self.s = currency_sold
         self.fx_rate = fx_rate
-        self.quote_time = quote_time
+        self.quote_time = quote_time or datetime.now()
         self._validate_init()
 
     def _validate_init(self):
         if self.b.ccy == self.s.ccy:
             raise ValueError("Unexpected transaction of same CCY")
 
-    def execute(self) -> bool:
-        old_b = get_currency_owned(self.b.ccy)
-        old_s = get_currency_owned(self.s.ccy)
+    @trade_seconds.timed
+    def execute(self, session: User = None) -> tuple[Currency, Currency]:
+        """Executes the transaction atomically for a user and records it in the trades ledger.
 
-        new_b = Currency(self.b.ccy, old_b.quantity + self.b.quantity)
-        new_s = Currency(self.s.ccy, old_s.quantity - self.s.quantity)
+        Args:
+            session (User, optional): User to trade for. Defaults to the current user.
 
-        if update_currencies(self.b.ccy, new_b.quantity_str, self.s.ccy, new_s.quantity_str):
-            return True
+        Returns:
+            The new balances of the bought and sold currencies, or None if the transaction failed.
 
-        logger.error("Error executing transaction.", exc_info=True)
-        return False
+        Raises:
+            InsufficientFundsError: If the user doesn't own enough of the sold currency.
+        """
+        uid = (session or current_user()).uid
+        try:
+            if group_committer is not None:
+                return group_committer.execute(uid, self.b, self.s, self.fx_rate, self.quote_time)
+            return execute_trade(uid, self.b, self.s, self.fx_rate, self.quote_time)
+        except InsufficientFundsError:
+            raise
+        except DatabaseError:
+            logger.error("Error executing transaction.", exc_info=True)
+            return None
 
     def expired(self) -> bool:
         if datetime.now() - self.quote_time > quote_timeout:
@@ -61,3 +82,76 @@ class Transaction:
 
     def print(self):
         print(self)
+
+
+class Quote(Transaction):
+    """A transaction whose sold currency is held out of the user's balance while it is quoted.
+
+    reserve() takes the sold currency out of the balance with a hold that expires with the
+    quote, so no other session can spend it meanwhile. confirm() then executes the trade from
+    the hold in one conditional write, failing once the hold has expired, without reading the
+    balances again. Holds that are neither confirmed nor released are returned by the
+    hold_sweeper.
+
+    Args:
+        currency_bought (Currency): Currency to be bought.
+        currency_sold (Currency): Currency to be sold.
+        fx_rate (Decimal, optional): FX rate exchanged at.
+        quote_time (datetime, optional): Time FX rate was quoted. Defaults to current time.
+        session (User, optional): User to quote for. Defaults to the current user.
+    """
+    def __init__(self, currency_bought: Currency, currency_sold: Currency, fx_rate: Decimal = None,
+                 quote_time: datetime = None, session: User = None):
+        super().__init__(currency_bought, currency_sold, fx_rate, quote_time)
+        self.uid = (session or current_user()).uid
+        self.hold_id: int = None
+        # Balance of the sold currency left after the hold
+        self.balance: Currency = None
+
+    @property
+    def expires_at(self) -> float:
+        """Unix time the quote and its hold expire at."""
+        return (self.quote_time + quote_timeout).timestamp()
+
+    def reserve(self) -> Currency:
+        """Holds the sold currency until the quote expires.
+
+        Returns:
+            The balance of the sold currency left.
+
+        Raises:
+            InsufficientFundsError: If the user doesn't own enough of the sold currency.
+            DatabaseError: If the funds couldn't be held.
+        """
+        hold_sweeper.start()
+        self.hold_id, self.balance = hold_funds(self.uid, self.s, self.expires_at)
+        return self.balance
+
+    @trade_seconds.timed
+    def confirm(self) -> tuple[Currency, Currency]:
+        """Executes the reserved transaction and records it in the trades ledger.
+
+        Returns:
+            The new balance of the bought currency and the balance of the sold currency left
+            when it was reserved.
+
+        Raises:
+            QuoteExpiredError: If the quote has expired or was released.
+            DatabaseError: If the transaction couldn't be written.
+        """
+        new_b = confirm_hold(self.hold_id, self.uid, self.b, self.s, self.fx_rate, self.quote_time)
+        self.hold_id = None
+        return new_b, self.balance
+
+    def release(self) -> bool:
+        """Returns the held currency to the balance, if the quote still holds it."""
+        if self.hold_id is None:
+            return False
+        try:
+            released = release_hold(self.hold_id, self.uid)
+        except DatabaseError:
+            # The hold_sweeper returns it once it expires
+            logger.warning("Error releasing hold %s.", self.hold_id, exc_info=True)
+            return False
+        self.hold_id = None
+        return released
@@ -1,7 +1,11 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
 class User:
-    def __init__(self):
-        self.uid = None
-        self.username = None
+    def __init__(self, uid: int = None, username: str = None):
+        self.uid = uid
+        self.username = username
 
     def set(self, uid: int, username: str):
         self.uid = uid
@@ -17,3 +21,23 @@ class User:
 
 # Singleton
 user = User()
+
+# User acting in the current thread or asyncio task, for functions not passed one explicitly
+_current_user: ContextVar[User] = ContextVar("current_user", default=user)
+
+def current_user() -> User:
+    """Returns the user set by the innermost as_user of this context, or the singleton if none."""
+    return _current_user.get()
+
+@contextmanager
+def as_user(session_user: User) -> Iterator[User]:
+    """Makes session_user the current user of this thread or asyncio task until exit.
+
+    Each thread and asyncio task has its own context, so sessions of different users can
+    run in parallel without affecting each other or the singleton.
+    """
+    token = _current_user.set(session_user)
+    try:
+        yield session_user
+    finally:
+        _current_user.reset(token)
@@ -0,0 +1,117 @@
+from decimal import Decimal
+from logging import getLogger
+from math import gcd
+from typing import Iterable, Iterator
+import numpy as np
+
+from utils.currency import CCY, BASE_CURRENCY, Currency
+from utils.db import iter_balances
+
+logger = getLogger(__name__)
+
+INT64_MAX = np.iinfo(np.int64).max
+
+class Valuation:
+    """Base currency value of many portfolios at one rate snapshot.
+
+    Args:
+        user_ids (np.ndarray): Sorted user ids.
+        totals (np.ndarray): Value of each user's portfolio in minor units of the base currency,
+            of dtype object if a value doesn't fit in int64.
+    """
+    def __init__(self, user_ids: np.ndarray, totals: np.ndarray):
+        self.user_ids = user_ids
+        self.totals = totals
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def get(self, uid: int) -> Currency:
+        """Returns the value of a user's portfolio, or None if the user wasn't valued."""
+        i = np.searchsorted(self.user_ids, uid)
+        if i == len(self.user_ids) or self.user_ids[i] != uid:
+            return None
+        return Currency.from_minor(BASE_CURRENCY, int(self.totals[i]))
+
+    def items(self) -> Iterator[tuple[int, Currency]]:
+        """Yields each user id with the value of its portfolio."""
+        for uid, total in zip(self.user_ids.tolist(), self.totals.tolist()):
+            yield uid, Currency.from_minor(BASE_CURRENCY, total)
+
+    def total(self) -> Currency:
+        """Returns the value of all portfolios together."""
+        return Currency.from_minor(BASE_CURRENCY, sum(self.totals.tolist()))
+
+
+def value_portfolios(rates: dict[CCY, Decimal], user_ids: Iterable[int] = None,
+                     chunk_size: int = 100_000) -> Valuation:
+    """Values portfolios in the base currency, reading all balances in one query.
+
+    Each FX balance is converted with exact integer arithmetic and rounded down, as
+    Currency.to_base does, then summed per user with the base currency balance.
+
+    Args:
+        rates (dict[CCY, Decimal]): Rate of every FX currency held, in FX per base,
+            e.g. RateSnapshot.rates.
+        user_ids (Iterable[int], optional): Only value these users. Defaults to all users.
+        chunk_size (int): Rows read from the database at a time.
+
+    Raises:
+        KeyError: If a currency held has no rate.
+    """
+    chunks = [np.array(rows, dtype=np.int64) for rows in iter_balances(user_ids, chunk_size)]
+    if not chunks:
+        return Valuation(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    balances = np.concatenate(chunks)
+    uids, ccy_values, minor = balances[:, 0], balances[:, 1], balances[:, 2]
+
+    values = np.zeros(len(balances), dtype=np.int64)
+    for ccy in CCY:
+        rows = ccy_values == ccy.value
+        if not rows.any():
+            continue
+        if ccy == BASE_CURRENCY:
+            values[rows] = minor[rows]
+        else:
+            converted = _to_base_minor(minor[rows], ccy, rates[ccy])
+            if converted.dtype == object and values.dtype != object:
+                values = values.astype(object)
+            values[rows] = converted
+
+    if values.dtype != object and np.abs(values).max() > INT64_MAX // len(CCY):
+        # A user's total of up to one value per currency could overflow int64
+        values = values.astype(object)
+
+    # Rows are ordered by user id, so each user's rows are contiguous
+    starts = np.flatnonzero(np.r_[True, uids[1:] != uids[:-1]])
+    return Valuation(uids[starts], np.add.reduceat(values, starts))
+
+def _to_base_minor(minor: np.ndarray, ccy: CCY, fx_rate: Decimal) -> np.ndarray:
+    """Converts minor units of ccy to minor units of the base currency at fx_rate (FX per base),
+    rounding toward zero.
+
+    quantity / fx_rate in base minor units is minor * 10^base_dps * rate_den / (rate_num * 10^dps),
+    which is evaluated in int64 where it can't overflow and with Python ints otherwise. The
+    result has dtype object if a value doesn't fit in int64.
+    """
+    rate_numerator, rate_denominator = fx_rate.as_integer_ratio()
+    numerator = 10 ** BASE_CURRENCY.dps * rate_denominator
+    denominator = rate_numerator * 10 ** ccy.dps
+    divisor = gcd(numerator, denominator)
+    numerator, denominator = numerator // divisor, denominator // divisor
+
+    magnitude = np.abs(minor)
+    result = np.zeros_like(minor)
+    if numerator <= INT64_MAX and denominator <= INT64_MAX:
+        safe = magnitude <= INT64_MAX // numerator
+        result[safe] = magnitude[safe] * numerator // denominator
+    else:
+        safe = np.zeros(len(minor), dtype=bool)
+    if len(large := np.flatnonzero(~safe)):
+        logger.debug("Valuing %s large %s balances without int64", len(large), ccy.name)
+        values = [int(magnitude[i]) * numerator // denominator for i in large.tolist()]
+        if max(values) > INT64_MAX:
+            # Values that don't fit in int64 are kept as Python ints
+            result = result.astype(object)
+        result[large] = values
+    return np.where(minor < 0, -result, result)
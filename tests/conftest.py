@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The app imports its modules as utils.*, relative to fx_trader
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fx_trader"))
+
+from utils import db
+
+@pytest.fixture
+def database(tmp_path):
+    """Points the connection pool at a new database of the latest schema for one test."""
+    db.connections.configure(str(tmp_path / "test.db"))
+    db.initialise_db()
+    yield
+    db.connections.close()
@@ -0,0 +1,159 @@
+from decimal import Decimal
+import csv
+import io
+import json
+
+import pytest
+
+from utils import db
+from utils.backtest import Backtest, ScheduledOrder, run_backtest
+from utils.batch import ResultWriter
+from utils.currency import CCY, Currency
+from utils.rate_sources import RandomWalkRateSource
+
+USD, EUR, JPY = CCY.USD, CCY.EUR, CCY.JPY
+
+TAPE = [
+    (100, {"EUR": "0.90", "JPY": "150"}),
+    (110, {"EUR": "0.80", "JPY": "150"}),
+    # JPY missing, carried forward
+    (120, {"EUR": "1.00"}),
+    (130, {"EUR": "0.95", "JPY": "160"}),
+]
+
+def orders_jsonl(*orders: dict) -> io.StringIO:
+    return io.StringIO("".join(json.dumps(order) + "\n" for order in orders))
+
+def backtest(orders: io.StringIO, tape=TAPE, **kwargs) -> tuple[dict, list[dict], list[dict]]:
+    results, equity = io.StringIO(), io.StringIO(newline="")
+    summary = run_backtest(iter(tape), orders, results, equity=equity, **kwargs)
+    return (summary, [json.loads(line) for line in results.getvalue().splitlines()],
+            list(csv.DictReader(io.StringIO(equity.getvalue(), newline=""))))
+
+def test_backtest_trades_and_values():
+    summary, results, equity = backtest(orders_jsonl(
+        {"timestamp": 105, "side": "buy", "ccy": "EUR", "quantity": "100"},
+        {"timestamp": 120, "side": "sell", "ccy": "EUR", "quantity": "40"},
+    ))
+    # Executed at the next snapshot at or after each timestamp, as Currency.to_fx and to_base round
+    bought = Currency.from_string(USD, "100").to_fx(EUR, Decimal("0.80"))
+    sold_for = Currency.from_string(EUR, "40").to_base(Decimal("1.00"))
+    assert [(result["status"], result["rates_timestamp"], result["bought_quantity"]) for result in results] == [
+        ("filled", 110, bought.quantity_str), ("filled", 120, sold_for.quantity_str)]
+
+    eur = bought.minor - 4000
+    usd = 1_000_000 - 10000 + sold_for.minor
+    end = usd + Currency.from_minor(EUR, eur).to_base(Decimal("0.95")).minor
+    assert [row["value"] for row in equity] == [
+        "10000.00", "10000.00",
+        Currency.from_minor(USD, usd + Currency.from_minor(EUR, eur).to_base(Decimal("1.00")).minor).quantity_str,
+        Currency.from_minor(USD, end).quantity_str]
+    assert [int(row["timestamp"]) for row in equity] == [100, 110, 120, 130]
+
+    assert summary["ticks"] == 4
+    assert (summary["first_timestamp"], summary["last_timestamp"]) == (100, 130)
+    assert summary["orders"] == {"filled": 2, "rejected": 0}
+    assert summary["balances"] == {"EUR": Currency.from_minor(EUR, eur).quantity_str,
+                                   "USD": Currency.from_minor(USD, usd).quantity_str}
+    assert summary["end_value"] == Currency.from_minor(USD, end).quantity_str
+    assert summary["pnl"] == Currency.from_minor(USD, end - 1_000_000).quantity_str
+
+def test_backtest_balances_in_minor_units():
+    backtest = Backtest(1_000_000, chunk_size=2)
+    orders = [ScheduledOrder(1, {"timestamp": 105, "side": "buy", "ccy": "JPY", "quantity": "100"}),
+              ScheduledOrder(2, {"timestamp": 130, "side": "sell", "ccy": "JPY", "quantity": "1000"})]
+    summary = backtest.run(iter(TAPE), orders, ResultWriter(io.StringIO(), "jsonl"))
+    jpy = Currency.from_string(USD, "100").to_fx(JPY, Decimal("150")).minor - 1000
+    usd = 1_000_000 - 10000 + Currency.from_string(JPY, "1000").to_base(Decimal("160")).minor
+    assert (backtest.balances[JPY], backtest.balances[USD], backtest.balances[EUR]) == (jpy, usd, 0)
+    assert backtest.counts == summary["orders"] == {"filled": 2, "rejected": 0}
+    assert (backtest.ticks, backtest.first_timestamp, backtest.last_timestamp) == (4, 100, 130)
+
+def test_backtest_rejections():
+    summary, results, _ = backtest(orders_jsonl(
+        {"timestamp": 100, "side": "buy", "ccy": "EUR", "quantity": "20000"},
+        {"timestamp": "soon", "side": "buy", "ccy": "EUR", "quantity": "1"},
+        {"timestamp": 100, "side": "sell", "ccy": "EUR", "quantity": "1"},
+        {"timestamp": 100, "side": "hold", "ccy": "EUR", "quantity": "1"},
+        {"timestamp": 100, "side": "buy", "ccy": "JPY", "quantity": "0.001"},
+        {"timestamp": 100, "side": "buy", "ccy": "CHF", "quantity": "1"},
+        {"timestamp": 131, "side": "buy", "ccy": "EUR", "quantity": "1"},
+        {"timestamp": 100, "side": "buy", "ccy": "JPY", "quantity": "1" * 30},
+    ))
+    assert [(result["line"], result["reason"]) for result in results] == [
+        (2, "invalid timestamp"), (1, "insufficient funds"), (3, "insufficient funds"),
+        (4, "invalid side"), (5, "invalid quantity"), (6, "no rate"), (8, "invalid quantity"), (7, "after last tick")]
+    assert summary["orders"] == {"filled": 0, "rejected": 8}
+    assert summary["end_value"] == "10000.00"
+    assert summary["max_drawdown"] == 0
+
+def test_backtest_carries_rates_forward():
+    # JPY bought at 110 is valued at 150 at 120, which has no JPY rate
+    _, results, equity = backtest(orders_jsonl(
+        {"timestamp": 110, "side": "buy", "ccy": "JPY", "quantity": "1000"}), initial=100_000)
+    [result] = results
+    assert result["bought_quantity"] == "150000"
+    assert equity[2]["value"] == "1000.00"
+    assert equity[3]["value"] == str(Currency.from_string(JPY, "150000").to_base(Decimal("160")).quantity)
+
+def test_backtest_chunks_match():
+    source = RandomWalkRateSource(seed=1, volatility=0.01)
+    tape = [source.fetch() for _ in range(500)]
+    script = [{"timestamp": tape[i][0], "side": "buy" if i % 2 else "sell", "ccy": ccy, "quantity": "100"}
+              for i, ccy in zip(range(0, 500, 7), ["EUR", "GBP", "JPY", "CHF"] * 20)]
+    runs = [backtest(orders_jsonl(*script), tape, chunk_size=chunk_size) for chunk_size in (1, 33, 1000)]
+    assert runs[0] == runs[1] == runs[2]
+    summary, _, equity = runs[0]
+    assert summary["orders"]["filled"] > 0
+    peak = max_drawdown = 0
+    for row in equity:
+        value = float(row["value"])
+        peak = max(peak, value)
+        max_drawdown = max(max_drawdown, (peak - value) / peak)
+    assert summary["max_drawdown"] == pytest.approx(max_drawdown, abs=1e-6)
+
+def test_backtest_values_large_balances():
+    # Beyond int64 once scaled by the fixed point rate
+    summary, _, _ = backtest(orders_jsonl(
+        {"timestamp": 100, "side": "buy", "ccy": "EUR", "quantity": "5000000000000"}), initial=10 ** 15)
+    eur = Currency.from_string(USD, "5000000000000").to_fx(EUR, Decimal("0.90"))
+    usd = 10 ** 15 - 500_000_000_000_000
+    assert summary["end_value"] == Currency.from_minor(
+        USD, usd + eur.to_base(Decimal("0.95")).minor).quantity_str
+
+@pytest.mark.parametrize("tape, error", [
+    ([], "no snapshots"),
+    ([(100, {"EUR": "0.9"}), (90, {"EUR": "0.9"})], "out of time order"),
+    ([(100, {"EUR": "0"})], "Invalid EUR rate"),
+    ([(100, {"EUR": "9e-1"})], "Invalid EUR rate"),
+])
+def test_backtest_invalid_tapes(tape, error):
+    with pytest.raises(ValueError, match=error):
+        backtest(orders_jsonl(), tape)
+
+def test_backtest_out_of_order_across_chunks():
+    with pytest.raises(ValueError, match="out of time order"):
+        backtest(orders_jsonl(), [(100, {"EUR": "0.9"}), (90, {"EUR": "0.9"})], chunk_size=1)
+
+def test_backtest_rejects_malformed_json():
+    orders = io.StringIO('{"timestamp": 100, "side": "buy", "ccy": "EUR", "quantity": "1"}\n{not json\n')
+    summary, results, _ = backtest(orders)
+    assert [(result["line"], result["status"], result["reason"]) for result in results] == [
+        (2, "rejected", "invalid order: line 2 is not a JSON object"), (1, "filled", "")]
+    assert summary["orders"] == {"filled": 1, "rejected": 1}
+
+def test_scheduled_order_csv():
+    orders = io.StringIO("timestamp,side,ccy,quantity\n105,buy,EUR,100\n,sell,EUR,1\n")
+    results = io.StringIO(newline="")
+    summary = run_backtest(iter(TAPE), orders, results, "csv")
+    assert summary["orders"] == {"filled": 1, "rejected": 1}
+    assert [row["status"] for row in csv.DictReader(io.StringIO(results.getvalue()))] == ["rejected", "filled"]
+    assert ScheduledOrder(1, {"timestamp": " 7 "}).at == 7
+
+def test_backtest_leaves_database_alone(tmp_path):
+    db.connections.configure(str(tmp_path / "test.db"))
+    try:
+        backtest(orders_jsonl({"timestamp": 100, "side": "buy", "ccy": "EUR", "quantity": "1"}))
+    finally:
+        db.connections.close()
+    assert not (tmp_path / "test.db").exists()
@@ -0,0 +1,100 @@
+from decimal import Decimal
+import csv
+import io
+import json
+import time
+
+import pytest
+
+from utils import db
+from utils.batch import RESULT_FIELDS, run_batch
+from utils.currency import CCY, Currency
+from utils.fx import rate_cache
+from utils.rate_sources import RateSource
+
+USD, EUR, JPY = CCY.USD, CCY.EUR, CCY.JPY
+
+class FixedSource(RateSource):
+    """Serves the same rates every fetch."""
+    def __init__(self):
+        self.timestamp = int(time.time())
+
+    def fetch(self):
+        return self.timestamp, {"EUR": "0.9", "JPY": "150"}
+
+@pytest.fixture
+def rates(monkeypatch):
+    monkeypatch.setattr(rate_cache, "source", FixedSource())
+    rate_cache.clear()
+    yield rate_cache.source.timestamp
+    rate_cache.clear()
+
+@pytest.fixture
+def users(database):
+    db.create_user("alice", b"")
+    db.create_user("bob", b"")
+
+def balances(username: str) -> dict[str, str]:
+    return {balance.name: balance.quantity_str for balance in db.get_portfolio(username)}
+
+def run(lines: list[str], fmt: str = "jsonl", **kwargs) -> tuple[dict, list[dict]]:
+    results = io.StringIO(newline="")
+    counts = run_batch(io.StringIO("\n".join(lines) + "\n"), results, fmt, **kwargs)
+    if fmt == "csv":
+        return counts, list(csv.DictReader(io.StringIO(results.getvalue(), newline="")))
+    return counts, [json.loads(line) for line in results.getvalue().splitlines()]
+
+def test_batch_results(users, rates):
+    counts, results = run([
+        json.dumps({"user": "Alice", "side": "buy", "ccy": "EUR", "quantity": "100"}),
+        json.dumps({"user": "bob", "side": "sell", "ccy": "EUR", "quantity": "1"}),
+        json.dumps({"user": "carol", "side": "buy", "ccy": "EUR", "quantity": "1"}),
+        json.dumps({"user": "bob", "side": "buy", "ccy": "XYZ", "quantity": "1"}),
+        "{not json",
+        "",
+        json.dumps(["alice", "buy", "EUR", "1"]),
+        json.dumps({"user": "bob", "side": "buy", "ccy": "JPY", "quantity": "10000"}),
+    ], chunk_size=3)
+    assert counts == {"filled": 2, "rejected": 5, "failed": 0}
+    assert [list(result) for result in results] == [list(RESULT_FIELDS)] * 7
+    assert [(result["line"], result["status"], result["reason"]) for result in results] == [
+        (1, "filled", ""),
+        (2, "rejected", "insufficient funds"),
+        (3, "rejected", "unknown user"),
+        (4, "rejected", "invalid currency"),
+        (5, "rejected", "invalid order: line 5 is not a JSON object"),
+        (7, "rejected", "invalid order: line 7 is not a JSON object"),
+        (8, "filled", ""),
+    ]
+
+    filled = results[0]
+    assert (filled["user"], filled["sold_ccy"], filled["sold_quantity"], filled["bought_ccy"],
+            filled["bought_quantity"], filled["fx_rate"], filled["rates_timestamp"]) == (
+        "Alice", "USD", "100.00", "EUR", "90.00", "0.9", rates)
+    expected = Currency.from_string(USD, "10000").to_fx(JPY, Decimal("150"))
+    assert results[-1]["bought_quantity"] == expected.quantity_str
+
+    assert balances("alice")["USD"] == "9900.00"
+    assert balances("alice")["EUR"] == "90.00"
+    assert balances("bob")["USD"] == "0.00"
+    assert balances("bob")["JPY"] == expected.quantity_str
+    assert balances("bob")["EUR"] == "0.00"
+
+def test_batch_csv(users, rates):
+    counts, results = run(["user,side,ccy,quantity", "alice,sell,EUR,1", "alice,buy,EUR,1.001", "bob,buy,EUR,10"], "csv")
+    assert counts == {"filled": 1, "rejected": 2, "failed": 0}
+    assert [(result["line"], result["reason"]) for result in results] == [
+        ("2", "insufficient funds"), ("3", "invalid quantity"), ("4", "")]
+    assert balances("bob")["EUR"] == "9.00"
+    assert balances("alice")["USD"] == "10000.00"
+
+def test_batch_oversized_quantities(users, rates):
+    counts, results = run([
+        json.dumps({"user": "alice", "side": "buy", "ccy": "JPY", "quantity": "1" * 30}),
+        json.dumps({"user": "alice", "side": "sell", "ccy": "EUR", "quantity": "9" * 5000}),
+        json.dumps({"user": "alice", "side": "buy", "ccy": "EUR", "quantity": "100"}),
+    ], chunk_size=2)
+    assert counts == {"filled": 1, "rejected": 2, "failed": 0}
+    assert [(result["status"], result["reason"], result["sold_quantity"]) for result in results] == [
+        ("rejected", "invalid quantity", ""), ("rejected", "invalid quantity", ""), ("filled", "", "100.00")]
+    assert balances("alice")["USD"] == "9900.00"
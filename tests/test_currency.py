@@ -2,7 +2,7 @@ from decimal import Decimal
 from types import MethodType
 import pytest
 
-from fx_trader.utils.currency import CCY, BASE_CURRENCY, Currency
+from utils.currency import CCY, BASE_CURRENCY, Currency, format_minor, parse_minor
 
 # === CCY: Attributes ===
 @pytest.mark.parametrize("ccy", [c for c in CCY])
@@ -86,6 +86,53 @@ def test_currency_usd_creation_from_string_invalid(quantity):
     except Exception:
         assert True
 
+# === Currency: minor units ===
+@pytest.mark.parametrize("ccy,quantity,minor", [
+    (CCY.USD, "0.00", 0), (CCY.USD, "0.01", 1), (CCY.USD, "12345.67", 1234567),
+    (CCY.JPY, "0", 0), (CCY.JPY, "1", 1), (CCY.JPY, "12345", 12345)])
+def test_currency_minor(ccy, quantity, minor):
+    assert Currency(ccy, Decimal(quantity)).minor == minor
+
+@pytest.mark.parametrize("ccy,minor,quantity", [
+    (CCY.USD, 0, "0.00"), (CCY.USD, 1, "0.01"), (CCY.USD, 1234567, "12345.67"),
+    (CCY.JPY, 0, "0"), (CCY.JPY, 12345, "12345")])
+def test_currency_from_minor(ccy, minor, quantity):
+    currency = Currency.from_minor(ccy, minor)
+    assert currency.ccy == ccy
+    assert currency.quantity_str == quantity
+
+# === Currency: value type ===
+def test_currency_immutable():
+    usd = Currency(CCY.USD, Decimal("1.00"))
+    with pytest.raises(AttributeError):
+        usd.quantity = Decimal("2.00")
+    with pytest.raises(AttributeError):
+        usd._quantity = Decimal("2.00")
+    with pytest.raises(AttributeError):
+        usd.other = 1
+    assert usd.quantity == Decimal("1.00")
+
+def test_currency_equality_hash():
+    assert Currency(CCY.USD, Decimal("1.00")) == Currency.from_string(CCY.USD, "1")
+    assert Currency(CCY.USD, Decimal("1.00")) != Currency(CCY.EUR, Decimal("1.00"))
+    assert Currency(CCY.USD, Decimal("1.00")) != Currency(CCY.USD, Decimal("1.01"))
+    assert len({Currency(CCY.USD, Decimal("1.00")), Currency.from_minor(CCY.USD, 100)}) == 1
+
+def test_currency_arithmetic():
+    a = Currency(CCY.USD, Decimal("1.25"))
+    b = Currency(CCY.USD, Decimal("0.75"))
+    assert a + b == Currency(CCY.USD, Decimal("2.00"))
+    assert a - b == Currency(CCY.USD, Decimal("0.50"))
+    assert b - a == -Currency(CCY.USD, Decimal("0.50"))
+    assert (a + b).quantity_str == "2.00"
+    assert b < a and a > b and a >= a and a <= a
+
+@pytest.mark.parametrize("operation", [
+    lambda a, b: a + b, lambda a, b: a - b, lambda a, b: a < b, lambda a, b: a >= b])
+def test_currency_arithmetic_different_ccy(operation):
+    with pytest.raises(TypeError):
+        operation(Currency(CCY.USD, Decimal("1.00")), Currency(CCY.EUR, Decimal("1.00")))
+
 # === Currency: to_base ===
 def test_currency_to_base(mocker):
     assert BASE_CURRENCY.dps == 2 # test assumption
@@ -136,6 +183,30 @@ def test_currency_to_fx_rounddown(mocker, dps, q, base_quantity, fx_rate, expect
     assert fx.ccy == mock_ccy
     assert fx.quantity == expected_fx_quantity
 
+# === Currency: convert ===
+@pytest.mark.parametrize("sold, bought, fx_rate, fx_rate_to, quantity, expected", [
+    # Through the base currency in one rounding: two trades would give JPY 16247
+    (CCY.EUR, CCY.JPY, Decimal("0.92"), Decimal("149.5"), "99.99", "16248"),
+    (CCY.EUR, CCY.GBP, Decimal("3"), Decimal("1"), "3.00", "1.00"),
+    (CCY.GBP, CCY.EUR, Decimal("0.8"), Decimal("0.9"), "0.80", "0.90"),
+    (CCY.JPY, CCY.CHF, Decimal("150"), Decimal("0.88"), "1", "0.00"),
+    (CCY.EUR, BASE_CURRENCY, Decimal("4.2"), Decimal("1"), "100.00", "23.80"),
+    (BASE_CURRENCY, CCY.EUR, Decimal("1"), Decimal("0.1234"), "50.00", "6.17")])
+def test_currency_convert(sold, bought, fx_rate, fx_rate_to, quantity, expected):
+    converted = Currency.from_string(sold, quantity).convert(bought, fx_rate, fx_rate_to)
+    assert converted.ccy == bought
+    assert converted.quantity_str == expected
+
+def test_currency_convert_matches_to_base_and_to_fx():
+    fx = Currency.from_string(CCY.EUR, "123.45")
+    assert fx.convert(BASE_CURRENCY, Decimal("0.9173"), Decimal(1)) == fx.to_base(Decimal("0.9173"))
+    base = Currency.from_string(BASE_CURRENCY, "123.45")
+    assert base.convert(CCY.JPY, Decimal(1), Decimal("149.87")) == base.to_fx(CCY.JPY, Decimal("149.87"))
+
+def test_currency_convert_same_ccy():
+    with pytest.raises(ValueError):
+        Currency.from_string(CCY.EUR, "1").convert(CCY.EUR, Decimal(1), Decimal(1))
+
 # === valid_quantity ===
 @pytest.mark.parametrize("quantity", [
     "0", "0.0", "0.00", "0.000", "0.0000", "0.00000",
@@ -186,3 +257,43 @@ def test_valid_quantity(mocker, dps, quantity):
     mock_ccy.dps = dps
     mock_ccy.valid_quantity = MethodType(CCY.valid_quantity, mock_ccy)
     assert mock_ccy.valid_quantity(quantity)
+
+# === parse_quantity ===
+@pytest.mark.parametrize("dps, quantity, minor", [
+    (0, "1", 1), (0, "123", 123), (0, "1.0", 1), (0, "01.00", 1), (0, "7.", 7),
+    (2, "1", 100), (2, "1.1", 110), (2, "1.11", 111), (2, "01.110", 111), (2, "0.01", 1),
+    (5, "1.11111", 111111), (5, "01.111110", 111111), (5, "12345", 1234500000)])
+def test_parse_quantity(mocker, dps, quantity, minor):
+    mock_ccy = mocker.Mock()
+    mock_ccy.dps = dps
+    mock_ccy.parse_quantity = MethodType(CCY.parse_quantity, mock_ccy)
+    assert mock_ccy.parse_quantity(quantity) == minor
+
+@pytest.mark.parametrize("quantity", ["", " ", "abc", "-1", "0", "0.00", ".5", "1.2.3", "1 ", "1e3", "١"])
+def test_parse_quantity_invalid(quantity):
+    for ccy in CCY:
+        assert ccy.parse_quantity(quantity) is None
+
+@pytest.mark.parametrize("quantity", ["1" * 29, "1" * 5000, "1." + "0" * 5000])
+def test_parse_quantity_too_long(quantity):
+    for ccy in CCY:
+        assert ccy.parse_quantity(quantity) is None
+        assert ccy.valid_quantity(quantity) is False
+
+def test_parse_quantity_longest():
+    assert CCY.JPY.parse_quantity("9" * 28) == int("9" * 28)
+    assert CCY.USD.parse_quantity("9" * 26 + ".99") == int("9" * 28)
+    # 29 digits in cents
+    assert CCY.USD.parse_quantity("9" * 27) is None
+    assert Currency.from_minor(CCY.USD, int("9" * 28)).quantity_str == "9" * 26 + ".99"
+
+@pytest.mark.parametrize("dps, quantity", [(0, "0"), (2, "0.00"), (2, "000.0")])
+def test_parse_minor_zero(dps, quantity):
+    """Zero parses, it is only rejected as a quantity traded."""
+    assert parse_minor(quantity, dps) == 0
+
+# === format_minor ===
+@pytest.mark.parametrize("minor", [0, 1, 9, 10, 99, 100, 12345, 1000000, -1, -12345])
+def test_format_minor(minor):
+    for ccy in CCY:
+        assert format_minor(minor, ccy.dps) == Currency.from_minor(ccy, minor).quantity_str
@@ -0,0 +1,139 @@
+import sqlite3
+
+import pytest
+
+from utils import db
+from utils.currency import CCY
+from utils.user import User
+
+# The schema before versioning, with quantities as decimal strings
+BASELINE_SCHEMA = '''
+    CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    hash TEXT NOT NULL
+    );
+    CREATE TABLE portfolio (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    currency TEXT NOT NULL,
+    quantity TEXT NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+'''
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "test.db")
+    db.connections.configure(path)
+    yield path
+    db.connections.close()
+
+def create_baseline(path: str, portfolio: list[tuple[int, str, str]]):
+    connection = sqlite3.connect(path)
+    connection.executescript(BASELINE_SCHEMA)
+    connection.executemany("INSERT INTO users (username, hash) VALUES (?, '')", [("alice", ), ("bob", )])
+    connection.executemany("INSERT INTO portfolio (user_id, currency, quantity) VALUES (?, ?, ?)", portfolio)
+    connection.commit()
+    connection.close()
+
+def portfolio_rows() -> list[tuple]:
+    return db.connections.get().execute(
+        "SELECT user_id, currency, quantity, typeof(quantity) FROM portfolio ORDER BY user_id, currency").fetchall()
+
+# === Migrations ===
+def test_quantity_to_minor(db_path):
+    create_baseline(db_path, [
+        (1, "USD", "10000"),
+        (1, "EUR", "12.5"),
+        (1, "JPY", "10000"),
+        (2, "USD", "0.01"),
+        (2, "GBP", "0"),
+        (2, "JPY", "123456789"),
+    ])
+    assert db.initialise_db()
+    assert portfolio_rows() == [
+        (1, "EUR", 1250, "integer"),
+        (1, "JPY", 10000, "integer"),
+        (1, "USD", 1_000_000, "integer"),
+        (2, "GBP", 0, "integer"),
+        (2, "JPY", 123456789, "integer"),
+        (2, "USD", 1, "integer"),
+    ]
+    assert db.get_currency_owned(CCY.JPY, User(1, "alice")).quantity_str == "10000"
+
+def test_quantity_to_minor_unknown_currency(db_path):
+    create_baseline(db_path, [(1, "USD", "1"), (1, "XYZ", "1")])
+    assert not db.initialise_db()
+    # Nothing of the failed migration is kept
+    connection = db.connections.get()
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == 1
+    assert connection.execute("SELECT currency, quantity FROM portfolio ORDER BY id").fetchall() == [
+        ("USD", "1"), ("XYZ", "1")]
+
+# === Schema versions ===
+def user_version() -> int:
+    return db.connections.get().execute("PRAGMA user_version").fetchone()[0]
+
+def schema() -> list[tuple]:
+    return db.connections.get().execute("SELECT type, name, sql FROM sqlite_schema ORDER BY name").fetchall()
+
+def record_migrations(monkeypatch) -> list:
+    """Replaces MIGRATIONS with wrappers that record each migration applied."""
+    applied = []
+
+    def recorded(migration):
+        def apply(connection):
+            applied.append(migration)
+            migration(connection)
+        return apply
+
+    monkeypatch.setattr(db, "MIGRATIONS", [recorded(migration) for migration in db.MIGRATIONS])
+    return applied
+
+def test_fresh_database_at_latest_version(db_path):
+    assert db.initialise_db()
+    assert user_version() == len(db.MIGRATIONS)
+    tables = {name for kind, name, _ in schema() if kind == "table"}
+    assert {"users", "portfolio", "trades", "rates", "orders", "holds"} <= tables
+
+def test_migrate_again_is_a_no_op(db_path, monkeypatch):
+    assert db.initialise_db()
+    db.create_user("alice", b"")
+    before = schema()
+    applied = record_migrations(monkeypatch)
+    assert db.initialise_db()
+    assert applied == []
+    assert schema() == before
+    assert user_version() == len(db.MIGRATIONS)
+    assert db.get_user_id("alice") == 1
+
+def test_migrate_applies_remaining_steps(db_path, monkeypatch):
+    db.migrate(db.connections.get(), target=3)
+    assert user_version() == 3
+    tables = {name for kind, name, _ in schema() if kind == "table"}
+    assert "trades" not in tables
+    db.create_user("alice", b"")
+
+    migrations = db.MIGRATIONS
+    applied = record_migrations(monkeypatch)
+    assert db.initialise_db()
+    assert applied == migrations[3:]
+    assert user_version() == len(migrations)
+    # The data of the earlier version is kept
+    assert db.get_user_id("alice") == 1
+    assert len(portfolio_rows()) == len(db.INITIAL_BALANCES)
+
+def test_portfolio_keyed_without_rowid(db_path):
+    assert db.initialise_db()
+    connection = db.connections.get()
+    [(sql, )] = connection.execute("SELECT sql FROM sqlite_schema WHERE name = 'portfolio'").fetchall()
+    assert sql.rstrip().endswith("WITHOUT ROWID")
+    # Columns with their position in the primary key
+    assert [(row[1], row[5]) for row in connection.execute("PRAGMA table_info(portfolio)")] == [
+        ("user_id", 1), ("currency", 2), ("quantity", 0)]
+    with pytest.raises(sqlite3.OperationalError, match="rowid"):
+        connection.execute("SELECT rowid FROM portfolio")
+    db.create_user("alice", b"")
+    with pytest.raises(sqlite3.IntegrityError):
+        connection.execute("INSERT INTO portfolio (user_id, currency, quantity) VALUES (1, 'USD', 0)")
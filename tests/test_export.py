@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+
+import pytest
+
+from utils import db
+from utils.currency import CCY, Currency
+from utils.export import PORTFOLIO_FIELDS, TRADE_FIELDS, export_table
+
+USD, EUR, JPY = CCY.USD, CCY.EUR, CCY.JPY
+
+@pytest.fixture
+def users(database):
+    """alice and bob, each with one trade, and carol without any."""
+    for username in ("alice", "bob", "carol"):
+        db.create_user(username, b"")
+    alice, bob = db.get_user_id("alice"), db.get_user_id("bob")
+    db.execute_trade(alice, Currency.from_string(EUR, "92.50"), Currency.from_string(USD, "100.00"))
+    db.execute_trade(bob, Currency.from_string(JPY, "15000"), Currency.from_string(USD, "100.01"))
+    return alice, bob
+
+def export_csv(table: str, **kwargs) -> list[dict]:
+    output = io.StringIO(newline="")
+    rows = export_table(table, output, "csv", **kwargs)
+    records = list(csv.DictReader(io.StringIO(output.getvalue(), newline="")))
+    assert rows == len(records)
+    return records
+
+def test_export_portfolio_csv(users):
+    alice, _ = users
+    records = export_csv("portfolio")
+    assert len(records) == 3 * len(CCY)
+    assert list(records[0]) == list(PORTFOLIO_FIELDS)
+    balances = {(int(record["user_id"]), record["currency"]): record["quantity"] for record in records}
+    assert balances[(alice, "USD")] == "9900.00"
+    assert balances[(alice, "EUR")] == "92.50"
+    assert balances[(alice, "JPY")] == "0"
+
+def test_export_portfolio_users(users):
+    alice, bob = users
+    records = export_csv("portfolio", user_ids=[bob], chunk_size=2)
+    assert {int(record["user_id"]) for record in records} == {bob}
+    assert {record["currency"]: record["quantity"] for record in records}["JPY"] == "15000"
+
+def test_export_trades_jsonl(users):
+    alice, bob = users
+    output = io.StringIO()
+    assert export_table("trades", output, "jsonl", chunk_size=1) == 2
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [list(record) for record in records] == [list(TRADE_FIELDS)] * 2
+    assert [(record["user_id"], record["bought_currency"], record["bought_quantity"],
+             record["sold_currency"], record["sold_quantity"]) for record in records] == [
+        (alice, "EUR", "92.50", "USD", "100.00"),
+        (bob, "JPY", "15000", "USD", "100.01"),
+    ]
+
+def test_export_trades_users(users):
+    _, bob = users
+    assert [int(record["user_id"]) for record in export_csv("trades", user_ids=[bob])] == [bob]
+    assert export_csv("trades", user_ids=[]) == []
+
+def test_export_matches_portfolio(users):
+    alice, _ = users
+    exported = {record["currency"]: record["quantity"] for record in export_csv("portfolio", user_ids=[alice])}
+    assert exported == {balance.name: balance.quantity_str for balance in db.get_portfolio("alice")}
+
+def test_export_unknown(users):
+    with pytest.raises(ValueError):
+        export_table("users", io.StringIO(), "csv")
+    with pytest.raises(ValueError):
+        export_table("trades", io.StringIO(), "xml")
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_export_arrow_formats(users, tmp_path, fmt):
+    pa = pytest.importorskip("pyarrow")
+    path = tmp_path / f"portfolio.{fmt}"
+    with open(path, "wb") as output:
+        assert export_table("portfolio", output, fmt, chunk_size=5) == 3 * len(CCY)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        exported = pq.read_table(path)
+    else:
+        exported = pa.ipc.open_file(str(path)).read_all()
+    assert exported.column_names == list(PORTFOLIO_FIELDS)
+    assert exported.schema.field("user_id").type == pa.int64()
+    assert exported.num_rows == 3 * len(CCY)
@@ -0,0 +1,27 @@
+import csv
+import io
+import os
+import subprocess
+import sys
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fx_trader", "main.py")
+
+def fx_trader(cwd, *args: str, stdin: str = "") -> subprocess.CompletedProcess:
+    """Runs the command line in cwd with the default rate source but no API key for it."""
+    env = {key: value for key, value in os.environ.items() if key not in ("OER_API_KEY", "FX_RATE_SOURCE")}
+    return subprocess.run([sys.executable, MAIN, *args], cwd=cwd, env=env, input=stdin,
+                          capture_output=True, text=True, timeout=60)
+
+def test_database_commands_need_no_rate_source(tmp_path):
+    provision = fx_trader(tmp_path, "provision", "--format", "csv", "--rounds", "4",
+                          stdin="username,password\nalice,secret\n")
+    assert provision.returncode == 0, provision.stdout + provision.stderr
+    export = fx_trader(tmp_path, "export", "portfolio")
+    assert export.returncode == 0, export.stdout + export.stderr
+    rows = list(csv.DictReader(io.StringIO(export.stdout)))
+    assert rows and {row["user_id"] for row in rows} == {"1"}
+
+def test_trading_commands_need_a_rate_source(tmp_path):
+    batch = fx_trader(tmp_path, "batch")
+    assert batch.returncode == 1
+    assert "No API key" in batch.stdout
@@ -0,0 +1,127 @@
+import logging
+from logging.handlers import QueueHandler
+import threading
+
+import pytest
+
+from utils import logger as app_logger
+from utils.metrics import Histogram, Registry
+
+BUCKETS = (0.001, 0.01, 0.1)
+
+# === Histogram ===
+def test_histogram_observe():
+    histogram = Histogram("h", "help", BUCKETS)
+    for value in (0.0005, 0.001, 0.005, 0.05, 0.5):
+        histogram.observe(value)
+    counts, total, count = histogram.snapshot()
+    # Bucket bounds are inclusive, as Prometheus "le"
+    assert counts == [2, 1, 1, 1]
+    assert total == pytest.approx(0.5565)
+    assert count == 5
+
+def test_histogram_quantile():
+    histogram = Histogram("h", "help", BUCKETS)
+    assert histogram.quantile(0.5) is None
+    for value in [0.0005] * 90 + [0.05] * 9 + [1.0]:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.9) == 0.001
+    assert histogram.quantile(0.99) == 0.1
+    assert histogram.quantile(1.0) == float("inf")
+
+def test_histogram_time():
+    histogram = Histogram("h", "help", BUCKETS)
+    with pytest.raises(RuntimeError):
+        with histogram.time():
+            raise RuntimeError
+    assert histogram.snapshot()[2] == 1
+
+def test_histogram_timed():
+    histogram = Histogram("h", "help", BUCKETS)
+
+    @histogram.timed
+    def add(a, b):
+        return a + b
+
+    assert add(1, b=2) == 3
+    assert add.__name__ == "add"
+    assert histogram.snapshot()[2] == 1
+
+def test_histogram_threads():
+    histogram = Histogram("h", "help", BUCKETS)
+
+    def observe():
+        for _ in range(10_000):
+            histogram.observe(0.005)
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histogram.snapshot()[2] == 40_000
+
+# === Registry ===
+def test_registry_histogram_get_or_create():
+    registry = Registry()
+    assert registry.histogram("h", "help") is registry.histogram("h", "other help")
+
+def test_registry_prometheus():
+    registry = Registry()
+    histogram = registry.histogram("fx_test_seconds", "Test latency.", BUCKETS)
+    histogram.observe(0.005)
+    histogram.observe(0.5)
+    assert registry.to_prometheus().splitlines() == [
+        "# HELP fx_test_seconds Test latency.",
+        "# TYPE fx_test_seconds histogram",
+        'fx_test_seconds_bucket{le="0.001"} 0',
+        'fx_test_seconds_bucket{le="0.01"} 1',
+        'fx_test_seconds_bucket{le="0.1"} 1',
+        'fx_test_seconds_bucket{le="+Inf"} 2',
+        "fx_test_seconds_sum 0.505",
+        "fx_test_seconds_count 2",
+    ]
+
+def test_registry_write_prometheus(tmp_path):
+    registry = Registry()
+    registry.histogram("h", "help", BUCKETS).observe(0.005)
+    path = tmp_path / "metrics.prom"
+    registry.write_prometheus(str(path))
+    assert path.read_text() == registry.to_prometheus()
+    assert list(tmp_path.iterdir()) == [path]
+
+def test_registry_exporter(tmp_path):
+    registry = Registry()
+    registry.histogram("h", "help", BUCKETS).observe(0.005)
+    path = tmp_path / "metrics.prom"
+    registry.start_exporter(str(path), interval=60)
+    registry.stop_exporter()
+    # Written once more on stop
+    assert "h_count 1" in path.read_text()
+
+def test_registry_dump():
+    registry = Registry()
+    registry.histogram("h", "help", BUCKETS).observe(0.005)
+    assert registry.dump() == {"h": {"count": 1, "sum": 0.005, "mean": 0.005,
+                                     "p50": 0.01, "p90": 0.01, "p99": 0.01}}
+
+# === Logging ===
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    app_logger.stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+def test_setup_logging_queue(root_logger, capsys):
+    app_logger.setup_logging("INFO")
+    assert [type(handler) for handler in root_logger.handlers] == [QueueHandler]
+    logging.getLogger("test").debug("dropped")
+    logging.getLogger("test").info("queued")
+    app_logger.stop_logging()
+    err = capsys.readouterr().err
+    assert "INFO | test: queued" in err
+    assert "dropped" not in err
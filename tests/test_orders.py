@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+import time
+
+import pytest
+
+from utils import db, orders
+from utils.currency import CCY, Currency
+from utils.fx import RateCache
+from utils.matcher import OrderMatcher
+from utils.orders import InvalidOrderError, OrderBook, RestingOrder, parse_order
+from utils.rate_snapshot import RateSnapshot
+from utils.rate_sources import RateSource
+
+USD, EUR, GBP = CCY.USD, CCY.EUR, CCY.GBP
+
+def make_order(order_id: int, kind: str, trigger: str, sold: CCY = USD, bought: CCY = EUR,
+               quantity: str = "100") -> RestingOrder:
+    return RestingOrder(order_id, 1, kind, Currency.from_string(sold, quantity), bought,
+                        Decimal(trigger), datetime(2024, 1, 1))
+
+def snapshot(eur: str, gbp: str = "0.8", timestamp: int = 1) -> RateSnapshot:
+    return RateSnapshot(timestamp, {"EUR": eur, "GBP": gbp})
+
+def order_ids(fills) -> list[int]:
+    return [order.order_id for order, _ in fills]
+
+@pytest.fixture
+def users(database):
+    db.create_user("alice", b"")
+    db.create_user("bob", b"")
+
+# === Parsing ===
+def test_parse_order():
+    assert parse_order(" Limit ", "usd", "EUR", "100.50", "0.95") == (
+        "limit", Currency.from_string(USD, "100.50"), EUR, Decimal("0.95"))
+
+@pytest.mark.parametrize("fields, error", [
+    (("market", "USD", "EUR", "100", "0.9"), "invalid kind"),
+    (("stop", "XXX", "EUR", "100", "0.9"), "invalid currency"),
+    (("stop", "EUR", "eur", "100", "0.9"), "same currency"),
+    (("stop", "USD", "EUR", "-1", "0.9"), "invalid quantity"),
+    (("stop", "USD", "EUR", "0", "0.9"), "invalid quantity"),
+    (("stop", "USD", "EUR", "100", "abc"), "invalid trigger"),
+    (("stop", "USD", "EUR", "100", "0"), "invalid trigger"),
+    (("stop", "USD", "EUR", "100", "inf"), "invalid trigger"),
+    (("stop", "USD", "EUR", "100", None), "invalid trigger"),
+])
+def test_parse_order_invalid(fields, error):
+    with pytest.raises(InvalidOrderError, match=error):
+        parse_order(*fields)
+
+def test_order_triggered():
+    assert make_order(1, "limit", "0.9").triggered(Decimal("0.9"))
+    assert not make_order(1, "limit", "0.9").triggered(Decimal("0.89"))
+    assert make_order(1, "stop", "0.9").triggered(Decimal("0.9"))
+    assert not make_order(1, "stop", "0.9").triggered(Decimal("0.91"))
+
+# === Order book ===
+def test_book_matches_only_crossed():
+    book = OrderBook()
+    for order in (make_order(1, "limit", "0.95"), make_order(2, "limit", "0.91"),
+                  make_order(3, "stop", "0.85"), make_order(4, "stop", "0.89")):
+        book.add(order)
+    assert book.match(snapshot("0.90")) == []
+    fills = book.match(snapshot("0.92"))
+    assert order_ids(fills) == [2]
+    assert fills[0][1] == Decimal("0.92")
+    assert order_ids(book.match(snapshot("0.89"))) == [4]
+    assert order_ids(book.match(snapshot("0.80"))) == [3]
+    assert len(book) == 1
+    assert 1 in book
+
+def test_book_matches_matching_order_triggers():
+    book = OrderBook()
+    for i in range(1, 101):
+        book.add(make_order(i, "limit", str(Decimal("0.9") + Decimal(i) / 1000)))
+    fills = book.match(snapshot("0.95"))
+    assert order_ids(fills) == list(range(1, 51))
+    assert all(order.triggered(rate) for order, rate in fills)
+    assert len(book) == 50
+
+def test_book_fills_oldest_first():
+    book = OrderBook()
+    for order in (make_order(3, "limit", "0.90"), make_order(1, "limit", "0.91"), make_order(2, "stop", "0.95")):
+        book.add(order)
+    assert order_ids(book.match(snapshot("0.92"))) == [1, 2, 3]
+
+def test_book_matches_cross_pairs():
+    book = OrderBook()
+    # GBP per EUR is 0.8 / 0.9 = 0.888...
+    book.add(make_order(1, "limit", "0.88", sold=EUR, bought=GBP))
+    book.add(make_order(2, "limit", "0.89", sold=EUR, bought=GBP))
+    fills = book.match(snapshot("0.9", "0.8"))
+    assert order_ids(fills) == [1]
+    assert fills[0][1] == Decimal("0.8888888889")
+
+def test_book_skips_pairs_without_rates():
+    book = OrderBook()
+    book.add(make_order(1, "stop", "10", bought=CCY.JPY))
+    assert book.match(snapshot("0.9")) == []
+    assert len(book) == 1
+
+def test_book_add_twice():
+    book = OrderBook()
+    book.add(make_order(1, "limit", "0.9"))
+    book.add(make_order(1, "limit", "0.9"))
+    assert order_ids(book.match(snapshot("0.9"))) == [1]
+
+def test_book_discard():
+    book = OrderBook()
+    book.add(make_order(1, "limit", "0.9"))
+    book.add(make_order(2, "limit", "0.9"))
+    assert book.discard(1).order_id == 1
+    assert book.discard(1) is None
+    assert order_ids(book.match(snapshot("0.9"))) == [2]
+
+def test_book_compacts(monkeypatch):
+    monkeypatch.setattr(orders, "COMPACT_MIN", 2)
+    book = OrderBook()
+    for i in range(1, 11):
+        book.add(make_order(i, "stop", "0.9"))
+    for i in range(1, 8):
+        book.discard(i)
+    assert sum(len(heap) for heap in book._stops.values()) < 10
+    assert order_ids(book.match(snapshot("0.5"))) == [8, 9, 10]
+
+# === Database ===
+def test_place_and_cancel_orders(users):
+    alice, bob = db.get_user_id("alice"), db.get_user_id("bob")
+    placed = db.place_order(alice, "limit", Currency.from_string(USD, "100"), EUR, Decimal("0.95"))
+    other = db.place_order(bob, "stop", Currency.from_string(USD, "50"), GBP, Decimal("0.7"))
+    [order] = db.get_open_orders(alice)
+    assert (order.order_id, order.uid, order.kind, order.sold, order.bought_ccy, order.trigger) == (
+        placed.order_id, alice, "limit", Currency.from_string(USD, "100"), EUR, Decimal("0.95"))
+    assert [order.order_id for order in db.load_open_orders()] == [placed.order_id, other.order_id]
+    assert [order.order_id for order in db.load_open_orders(placed.order_id)] == [other.order_id]
+
+    assert not db.cancel_order(bob, placed.order_id)
+    assert db.cancel_order(alice, placed.order_id)
+    assert not db.cancel_order(alice, placed.order_id)
+    assert db.get_open_orders(alice) == []
+    assert [order.order_id for order in db.load_open_orders()] == [other.order_id]
+
+def test_fill_orders(users):
+    alice = db.get_user_id("alice")
+    filled = db.place_order(alice, "limit", Currency.from_string(USD, "100"), EUR, Decimal("0.9"))
+    rejected = db.place_order(alice, "limit", Currency.from_string(USD, "20000"), EUR, Decimal("0.9"))
+    cancelled = db.place_order(alice, "limit", Currency.from_string(USD, "100"), EUR, Decimal("0.9"))
+    db.cancel_order(alice, cancelled.order_id)
+
+    quote_time = datetime.now()
+    results = db.fill_orders([(order, Currency.from_string(EUR, "90"), Decimal("0.9"), quote_time)
+                              for order in (filled, rejected, cancelled)])
+    assert results[0] == (Currency.from_string(EUR, "90"), Currency.from_string(USD, "9900"))
+    assert isinstance(results[1], db.InsufficientFundsError)
+    assert results[2] is None
+
+    [trade] = db.get_trade_history(alice)
+    assert (trade.bought, trade.sold, trade.fx_rate) == (
+        Currency.from_string(EUR, "90"), Currency.from_string(USD, "100"), Decimal("0.9"))
+    statuses = dict(db.connections.get().execute("SELECT id, status FROM orders").fetchall())
+    assert statuses == {filled.order_id: "filled", rejected.order_id: "rejected", cancelled.order_id: "cancelled"}
+    (trade_id, ) = db.connections.get().execute("SELECT trade_id FROM orders WHERE id = ?",
+                                                (filled.order_id, )).fetchone()
+    assert trade_id == trade.trade_id
+
+    # Already filled
+    assert db.fill_orders([(filled, Currency.from_string(EUR, "90"), Decimal("0.9"), quote_time)]) == [None]
+
+def test_fill_orders_rejects_zero_quantity(users):
+    alice = db.get_user_id("alice")
+    order = db.place_order(alice, "limit", Currency.from_string(USD, "0.01"), CCY.JPY, Decimal("10"))
+    [result] = db.fill_orders([(order, Currency.from_minor(CCY.JPY, 0), Decimal("10"), datetime.now())])
+    assert isinstance(result, db.DatabaseError)
+    assert db.get_currency_owned(USD, db.User(alice, "alice")) == Currency.from_string(USD, "10000")
+
+# === Matcher ===
+class TickingSource(RateSource):
+    """Returns the next of rates per fetch, with a new timestamp each time."""
+    def __init__(self, *rates: str):
+        self.rates = list(rates)
+        self.timestamp = int(time.time())
+
+    def fetch(self):
+        self.timestamp += 1
+        return self.timestamp, {"EUR": self.rates.pop(0) if len(self.rates) > 1 else self.rates[0]}
+
+def test_matcher_tick(users):
+    alice = db.get_user_id("alice")
+    matcher = OrderMatcher(RateCache(TickingSource("0.9"), timedelta(0)))
+    first = db.place_order(alice, "limit", Currency.from_string(USD, "100"), EUR, Decimal("0.95"))
+    matcher.sync()
+    # Placed after the last sync, picked up by the tick
+    second = db.place_order(alice, "stop", Currency.from_string(USD, "100"), EUR, Decimal("0.85"))
+    assert matcher.tick(snapshot("0.90")) == []
+    assert len(matcher.book) == 2
+
+    [(order, balances)] = matcher.tick(snapshot("0.96"))
+    assert order.order_id == first.order_id
+    assert balances == (Currency.from_string(EUR, "96"), Currency.from_string(USD, "9900"))
+    assert [order.order_id for order in db.get_open_orders(alice)] == [second.order_id]
+
+    # Cancelled elsewhere, so skipped when it triggers
+    db.cancel_order(alice, second.order_id)
+    [(order, result)] = matcher.tick(snapshot("0.80"))
+    assert (order.order_id, result) == (second.order_id, None)
+    assert len(matcher.book) == 0
+
+def test_matcher_fills_on_new_snapshots(users):
+    alice = db.get_user_id("alice")
+    db.place_order(alice, "limit", Currency.from_string(USD, "100"), EUR, Decimal("0.95"))
+    cache = RateCache(TickingSource("0.90", "0.96"), timedelta(0))
+    matcher = OrderMatcher(cache, poll=timedelta(seconds=0.01))
+    matcher.start()
+    try:
+        deadline = time.monotonic() + 5
+        while db.get_open_orders(alice) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        matcher.stop()
+    assert db.get_open_orders(alice) == []
+    assert db.get_currency_owned(EUR, db.User(alice, "alice")) == Currency.from_string(EUR, "96")
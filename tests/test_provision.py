@@ -0,0 +1,60 @@
+import io
+import json
+import sqlite3
+
+import pytest
+
+from utils import db
+from utils.currency import CCY, Currency
+from utils.provision import read_accounts
+
+HASH = b"not-a-real-hash"
+
+def balances(username: str) -> dict[str, int]:
+    return {balance.name: balance.minor for balance in db.get_portfolio(username)}
+
+# === read_accounts ===
+def test_read_accounts_jsonl():
+    lines = [json.dumps({"username": " Alice ", "password": "a"}), "", "not json",
+             json.dumps({"username": "bob"}), json.dumps(["carol", "c"]),
+             json.dumps({"username": "dave", "password": "d"})]
+    assert list(read_accounts(io.StringIO("\n".join(lines)), "jsonl")) == [("alice", "a"), ("dave", "d")]
+
+def test_read_accounts_csv():
+    file = io.StringIO("username,password\nAlice,a\n,b\ncarol,\ndave,d\n")
+    assert list(read_accounts(file, "csv")) == [("alice", "a"), ("dave", "d")]
+
+# === provision_users ===
+def test_provision_users(database):
+    users = [(f"user{i}", HASH) for i in range(25)]
+    assert db.provision_users(users, chunk_size=10) == (25, 0)
+    initial = {ccy.name: Currency.from_string(ccy, ccy.initial).minor for ccy in CCY}
+    for username, _ in users:
+        assert balances(username) == initial
+
+def test_provision_users_existing(database):
+    db.provision_users([("alice", HASH)])
+    db.execute_trade(db.get_user_id("alice"), Currency.from_string(CCY.EUR, "9"),
+                     Currency.from_string(CCY.USD, "10"))
+    before = balances("alice")
+    assert db.provision_users([("alice", b"other"), ("bob", HASH), ("bob", b"other")]) == (1, 2)
+    # Existing users keep their hash and balances
+    assert balances("alice") == before
+    hashes = dict(db.connections.get().execute("SELECT username, hash FROM users"))
+    assert hashes == {"alice": HASH, "bob": HASH}
+
+def test_provision_users_empty(database):
+    assert db.provision_users([]) == (0, 0)
+
+# === create_user ===
+def test_create_user_exists(database):
+    db.create_user("alice", HASH)
+    with pytest.raises(db.UserExistsError):
+        db.create_user("alice", HASH)
+    assert db.get_user_ids(["alice"]) == {"alice": 1}
+
+def test_get_user_ids_beyond_variable_limit(database):
+    db.create_user("alice", HASH)
+    # More names than SQLite allows bound variables, lowered from its default to keep the test small
+    db.connections.get().setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 100)
+    assert db.get_user_ids(["alice", *(f"user{i}" for i in range(200))]) == {"alice": 1}
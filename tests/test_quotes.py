@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+import time
+
+import pytest
+
+from utils import db
+from utils.currency import CCY, Currency
+from utils.transaction import Quote
+from utils.user import User
+
+USD, EUR = CCY.USD, CCY.EUR
+
+@pytest.fixture
+def alice(database):
+    db.create_user("alice", b"")
+    return User(db.get_user_id("alice"), "alice")
+
+def usd(quantity: str) -> Currency:
+    return Currency.from_string(USD, quantity)
+
+def eur(quantity: str) -> Currency:
+    return Currency.from_string(EUR, quantity)
+
+def balance(session: User, ccy: CCY) -> Currency:
+    return db.get_currency_owned(ccy, session)
+
+def test_reserve_holds_funds(alice):
+    quote = Quote(eur("90"), usd("100"), Decimal("0.9"), session=alice)
+    assert quote.reserve() == usd("9900")
+    assert balance(alice, USD) == usd("9900")
+
+def test_reserve_prevents_double_spend(alice):
+    Quote(eur("9000"), usd("10000"), session=alice).reserve()
+    with pytest.raises(db.InsufficientFundsError):
+        Quote(eur("0.90"), usd("1"), session=alice).reserve()
+    assert db.connections.get().execute("SELECT COUNT(*) FROM holds").fetchone() == (1, )
+
+def test_confirm(alice):
+    quote = Quote(eur("90"), usd("100"), Decimal("0.9"), session=alice)
+    quote.reserve()
+    assert quote.confirm() == (eur("90"), usd("9900"))
+    assert (balance(alice, USD), balance(alice, EUR)) == (usd("9900"), eur("90"))
+    [trade] = db.get_trade_history(alice.uid)
+    assert (trade.bought, trade.sold, trade.fx_rate) == (eur("90"), usd("100"), Decimal("0.9"))
+    assert db.connections.get().execute("SELECT COUNT(*) FROM holds").fetchone() == (0, )
+    # The hold is gone, so a second confirm can't trade again
+    with pytest.raises(db.QuoteExpiredError):
+        db.confirm_hold(1, alice.uid, eur("90"), usd("100"))
+
+def test_confirm_expired(alice):
+    quote = Quote(eur("90"), usd("100"), session=alice, quote_time=datetime.now() - timedelta(hours=1))
+    quote.reserve()
+    with pytest.raises(db.QuoteExpiredError):
+        quote.confirm()
+    assert balance(alice, EUR) == eur("0")
+    assert db.get_trade_history(alice.uid) == []
+    assert db.release_expired_holds() == 1
+    assert balance(alice, USD) == usd("10000")
+
+def test_release(alice):
+    quote = Quote(eur("90"), usd("100"), session=alice)
+    quote.reserve()
+    assert quote.release()
+    assert not quote.release()
+    assert balance(alice, USD) == usd("10000")
+    with pytest.raises(db.QuoteExpiredError):
+        db.confirm_hold(1, alice.uid, eur("90"), usd("100"))
+
+def test_release_expired_holds(alice):
+    for quantity in ("100", "200"):
+        Quote(eur("1"), usd(quantity), session=alice, quote_time=datetime.now() - timedelta(hours=1)).reserve()
+    live = Quote(eur("1"), usd("300"), session=alice)
+    live.reserve()
+    assert balance(alice, USD) == usd("9400")
+    assert db.release_expired_holds() == 2
+    assert db.release_expired_holds() == 0
+    assert balance(alice, USD) == usd("9700")
+    assert db.release_expired_holds(live.expires_at) == 1
+    assert balance(alice, USD) == usd("10000")
+
+def test_hold_sweeper(alice):
+    Quote(eur("1"), usd("100"), session=alice, quote_time=datetime.now() - timedelta(hours=1)).reserve()
+    sweeper = db.HoldSweeper(interval=0.01)
+    sweeper.start()
+    try:
+        deadline = time.monotonic() + 5
+        while balance(alice, USD) != usd("10000") and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        sweeper.stop()
+    assert balance(alice, USD) == usd("10000")
@@ -0,0 +1,270 @@
+from datetime import timedelta
+from decimal import Decimal
+import json
+import threading
+import time
+
+import pytest
+
+from utils import db
+from utils.currency import CCY, BASE_CURRENCY, FX_CURRENCY_NAMES, Currency
+from utils.fx import RateCache
+from utils.rate_snapshot import RateSnapshot
+from utils.rate_sources import FileRateSource, OpenExchangeRatesSource, RandomWalkRateSource, RateSource, \
+    rate_source_from_config
+
+class FakeSource(RateSource):
+    """Returns a new snapshot per fetch, or raises while failing is set."""
+    def __init__(self):
+        self.timestamp = int(time.time())
+        self.fetches = 0
+        self.failing = False
+        self.release = threading.Event()
+        self.release.set()
+
+    def fetch(self):
+        self.release.wait()
+        if self.failing:
+            raise ConnectionError("upstream down")
+        self.fetches += 1
+        self.timestamp += 1
+        return self.timestamp, {"EUR": f"0.9{self.fetches}"}
+
+def expire(cache: RateCache, seconds: float):
+    """Moves the cached snapshot's expiry seconds into the past."""
+    snapshot, _ = cache._entry
+    cache._entry = (snapshot, time.monotonic() - seconds)
+
+def wait_for_refresh(cache: RateCache):
+    deadline = time.monotonic() + 5
+    while cache._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+# === Rate history ===
+def test_rates_as_of(database):
+    assert db.get_rates_as_of() is None
+    db.record_rates([(100, {"EUR": "0.90", "GBP": "0.80"}), (200, {"EUR": "0.91", "GBP": "0.81"})])
+    assert db.get_rates_as_of() == (200, {"EUR": "0.91", "GBP": "0.81"})
+    assert db.get_rates_as_of(199) == (100, {"EUR": "0.90", "GBP": "0.80"})
+    assert db.get_rates_as_of(200)[0] == 200
+    assert db.get_rates_as_of(99) is None
+
+def test_rate_as_of(database):
+    db.record_rates([(100, {"EUR": "0.90"}), (200, {"EUR": "0.91", "GBP": "0.81"})])
+    assert db.get_rate_as_of(CCY.EUR, 150) == (100, Decimal("0.90"))
+    assert db.get_rate_as_of(CCY.GBP, 150) is None
+    assert db.get_rate_as_of(CCY.GBP, 250) == (200, Decimal("0.81"))
+
+def test_rate_history(database):
+    db.record_rates((timestamp, {"EUR": str(timestamp)}) for timestamp in range(10))
+    assert db.get_rate_history(CCY.EUR, 3, 5) == [(3, Decimal(3)), (4, Decimal(4)), (5, Decimal(5))]
+    assert db.get_rate_history(CCY.GBP, 0, 9) == []
+
+def test_record_rates_ignores_duplicates(database):
+    assert db.record_rates([(100, {"EUR": "0.90", "GBP": "0.80"})]) == 2
+    assert db.record_rates([(100, {"EUR": "0.99"})]) == 0
+    assert db.get_rates_as_of(100) == (100, {"EUR": "0.90", "GBP": "0.80"})
+
+# === RateCache ===
+def test_cache_records_history(database):
+    source = FakeSource()
+    cache = RateCache(source, timedelta(seconds=60), history=True)
+    snapshot = cache.snapshot()
+    assert db.get_rates_as_of() == (snapshot.timestamp, dict(snapshot.strings))
+
+def test_cache_source_failure_without_stale():
+    source = FakeSource()
+    cache = RateCache(source, timedelta(seconds=60))
+    cache.snapshot()
+    expire(cache, 1)
+    source.failing = True
+    with pytest.raises(ConnectionError):
+        cache.snapshot()
+
+def test_cache_serves_stale_on_failure():
+    source = FakeSource()
+    cache = RateCache(source, timedelta(seconds=60), stale=timedelta(seconds=30))
+    snapshot = cache.snapshot()
+    source.failing = True
+    expire(cache, 1)
+    # The background refresh fails and the stale snapshot is kept
+    assert cache.snapshot() is snapshot
+    wait_for_refresh(cache)
+    assert cache.snapshot() is snapshot
+    wait_for_refresh(cache)
+    expire(cache, 31)
+    with pytest.raises(ConnectionError):
+        cache.snapshot()
+
+def test_cache_stale_refreshes_in_background():
+    source = FakeSource()
+    cache = RateCache(source, timedelta(seconds=60), stale=timedelta(seconds=30))
+    snapshot = cache.snapshot()
+    expire(cache, 1)
+    source.release.clear()
+    # Returns without waiting for the blocked source
+    assert cache.snapshot() is snapshot
+    assert cache.snapshot() is snapshot
+    source.release.set()
+    deadline = time.monotonic() + 5
+    while cache.snapshot() is snapshot and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.snapshot().timestamp == snapshot.timestamp + 1
+    assert source.fetches == 2
+
+def test_cache_background_refreshes_close_connections(database):
+    source = FakeSource()
+    cache = RateCache(source, timedelta(seconds=60), stale=timedelta(seconds=30), history=True)
+    cache.snapshot()
+    for _ in range(50):
+        expire(cache, 1)
+        cache.snapshot()
+        wait_for_refresh(cache)
+    assert source.fetches == 51
+    assert db.get_rates_as_of()[0] == source.timestamp
+    # Only the test thread's connection is left
+    assert len(db.connections._connections) == 1
+
+def test_pool_closes_connections_of_exited_threads(database):
+    db.connections.get()
+    for _ in range(20):
+        thread = threading.Thread(target=lambda: db.connections.get().execute("SELECT 1"))
+        thread.start()
+        thread.join()
+    # Each new connection closes those of the threads before it
+    assert len(db.connections._connections) == 2
+
+def test_pool_release(database):
+    connection = db.connections.get()
+    db.connections.release()
+    assert connection not in db.connections._connections
+    assert db.connections.get() is not connection
+    db.connections.release()
+    db.connections.release()
+    assert db.connections._connections == {}
+
+def test_cache_cold_start_from_history(database):
+    db.record_rates([(int(time.time()) - 10, {"EUR": "0.90"})])
+    source = FakeSource()
+    source.failing = True
+    assert RateCache(source, timedelta(seconds=5), stale=timedelta(seconds=30), history=True).snapshot().strings == {"EUR": "0.90"}
+    with pytest.raises(ConnectionError):
+        RateCache(source, timedelta(seconds=5), stale=timedelta(seconds=1), history=True).snapshot()
+    with pytest.raises(ConnectionError):
+        RateCache(source, timedelta(seconds=5), stale=timedelta(seconds=30)).snapshot()
+
+# === RateSnapshot ===
+def test_snapshot_rates():
+    snapshot = RateSnapshot(100, {"EUR": "0.80", "JPY": "150", "XYZ": "1.5"})
+    assert snapshot.timestamp == 100
+    assert snapshot.currencies == (CCY.EUR, CCY.JPY, BASE_CURRENCY)
+    assert dict(snapshot.rates) == {CCY.EUR: Decimal("0.80"), CCY.JPY: Decimal("150")}
+    assert snapshot.rate(CCY.EUR) == Decimal("0.80")
+    assert snapshot.rate(BASE_CURRENCY) == 1
+    assert snapshot.rate(CCY.GBP) is None
+    assert CCY.JPY in snapshot and CCY.GBP not in snapshot
+    assert snapshot.strings["XYZ"] == "1.5"
+
+def test_snapshot_cross():
+    snapshot = RateSnapshot(100, {"EUR": "0.8", "JPY": "150"})
+    assert snapshot.cross(CCY.EUR, CCY.JPY) == Decimal("187.5")
+    assert snapshot.cross(CCY.JPY, CCY.EUR) == Decimal("0.005333333333")
+    assert snapshot.cross(BASE_CURRENCY, CCY.EUR) == Decimal("0.8")
+    assert snapshot.cross(CCY.EUR, BASE_CURRENCY) == Decimal("1.25")
+    assert snapshot.cross(CCY.EUR, CCY.EUR) == 1
+    with pytest.raises(KeyError):
+        snapshot.cross(CCY.EUR, CCY.GBP)
+
+def test_snapshot_convert():
+    snapshot = RateSnapshot(100, {"EUR": "3", "GBP": "1"})
+    # Through the rates, not the rounded cross rate of 0.3333333333
+    assert snapshot.convert(Currency.from_string(CCY.EUR, "3.00"), CCY.GBP).quantity_str == "1.00"
+    assert snapshot.convert(Currency.from_string(BASE_CURRENCY, "1.00"), CCY.EUR).quantity_str == "3.00"
+
+def test_snapshot_array():
+    snapshot = RateSnapshot(100, {"EUR": "0.8", "JPY": "150"})
+    array = snapshot.array()
+    assert array.shape == (3, 3)
+    assert array[0, 1] == pytest.approx(187.5)
+    assert array[1, 0] == pytest.approx(1 / 187.5)
+    assert not array.flags.writeable
+    assert snapshot.array() is array
+
+def test_snapshot_read_only():
+    snapshot = RateSnapshot(100, {"EUR": "0.8"})
+    with pytest.raises(TypeError):
+        snapshot.rates[CCY.EUR] = Decimal(1)
+
+def test_cache_shares_snapshot():
+    cache = RateCache(FakeSource(), timedelta(seconds=60))
+    snapshot = cache.snapshot()
+    assert cache.snapshot() is snapshot
+    assert (snapshot.timestamp, snapshot.strings) == (cache.source.timestamp, {"EUR": "0.91"})
+
+# === Rate sources ===
+TAPE = [(100, {"EUR": "0.90"}), (110, {"EUR": "0.91"}), (120, {"EUR": "0.92"})]
+
+@pytest.fixture(params=["jsonl", "csv"])
+def tape_path(request, tmp_path):
+    path = tmp_path / f"tape.{request.param}"
+    if request.param == "csv":
+        path.write_text("timestamp,EUR\n" + "".join(f"{timestamp},{rates['EUR']}\n" for timestamp, rates in TAPE))
+    else:
+        path.write_text("".join(json.dumps({"timestamp": timestamp, "rates": rates}) + "\n" for timestamp, rates in TAPE))
+    return str(path)
+
+def test_config_oer(monkeypatch):
+    monkeypatch.setenv("OER_API_KEY", "key")
+    source = rate_source_from_config(" OER ")
+    assert isinstance(source, OpenExchangeRatesSource)
+    assert source.api_key == "key"
+    monkeypatch.delenv("OER_API_KEY")
+    with pytest.raises(ValueError, match="No API key"):
+        rate_source_from_config("oer")
+
+def test_config_file(tape_path):
+    source = rate_source_from_config(f"file:{tape_path}")
+    assert isinstance(source, FileRateSource)
+    assert source.fetch() == TAPE[0]
+    with pytest.raises(ValueError, match="No such rates file"):
+        rate_source_from_config(f"file:{tape_path}.missing")
+
+def test_config_random():
+    assert isinstance(rate_source_from_config("random"), RandomWalkRateSource)
+    seeded = rate_source_from_config("random:7")
+    assert seeded.fetch()[1] == RandomWalkRateSource(seed=7).fetch()[1]
+    with pytest.raises(ValueError, match="Invalid random walk seed"):
+        rate_source_from_config("random:seven")
+
+@pytest.mark.parametrize("spec", ["", "ecb", "file"])
+def test_config_unknown(spec):
+    with pytest.raises(ValueError):
+        rate_source_from_config(spec)
+
+def test_file_source_replays_in_order(tape_path):
+    source = FileRateSource(tape_path, loop=False)
+    assert [source.fetch() for _ in range(3)] == TAPE
+    # The last snapshot is repeated at the end of the file
+    assert [source.fetch() for _ in range(2)] == [TAPE[-1]] * 2
+
+def test_file_source_loops(tape_path):
+    source = FileRateSource(tape_path)
+    assert [source.fetch() for _ in range(7)] == TAPE * 2 + TAPE[:1]
+
+@pytest.mark.parametrize("loop", [True, False])
+def test_file_source_empty(tmp_path, loop):
+    path = tmp_path / "empty.jsonl"
+    path.write_text("\n")
+    with pytest.raises(ConnectionError, match="No snapshots"):
+        FileRateSource(str(path), loop).fetch()
+
+def test_random_walk_seeded():
+    first, second = RandomWalkRateSource(seed=3), RandomWalkRateSource(seed=3)
+    second.timestamp = first.timestamp
+    walk = [first.fetch() for _ in range(50)]
+    assert walk == [second.fetch() for _ in range(50)]
+    assert walk != [RandomWalkRateSource(seed=4).fetch() for _ in range(50)]
+    assert [timestamp for timestamp, _ in walk] == list(range(walk[0][0], walk[0][0] + 50))
+    assert all(sorted(rates) == sorted(FX_CURRENCY_NAMES) for _, rates in walk)
+    # Rates are strings that parse as Decimals
+    assert all(Decimal(rate) > 0 for _, rates in walk for rate in rates.values())
@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from utils import db, security
+from utils.security import PasswordHasher, PasswordHasherBusyError, hash_password, \
+    hash_rounds, needs_rehash, verify_password
+
+# Lowest cost bcrypt accepts, to keep tests fast
+ROUNDS = 4
+
+# === Hashing ===
+def test_hash_and_verify():
+    hashed = hash_password("secret", ROUNDS)
+    assert verify_password("secret", hashed)
+    assert not verify_password("wrong", hashed)
+
+@pytest.mark.parametrize("rounds", [4, 5, 10])
+def test_hash_rounds(rounds):
+    assert hash_rounds(hash_password("secret", rounds)) == rounds
+
+def test_needs_rehash(monkeypatch):
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 5)
+    assert needs_rehash(hash_password("secret", ROUNDS))
+    assert not needs_rehash(hash_password("secret", 5))
+
+# === PasswordHasher ===
+def test_hasher_inline():
+    hasher = PasswordHasher(workers=0)
+    hashed = hasher.hash("secret", ROUNDS)
+    assert hasher.verify("secret", hashed)
+    assert not hasher.verify("wrong", hashed)
+
+def test_hasher_process_pool():
+    hasher = PasswordHasher(workers=1)
+    try:
+        hashed = hasher.hash("secret", ROUNDS)
+        assert hash_rounds(hashed) == ROUNDS
+        assert hasher.verify("secret", hashed)
+        assert not hasher.verify("wrong", hashed)
+    finally:
+        hasher.close()
+
+def test_hasher_cache_hit(monkeypatch):
+    hasher = PasswordHasher(workers=0)
+    hashed = hasher.hash("secret", ROUNDS)
+    assert hasher.verify("secret", hashed)
+    # A cached verification doesn't run bcrypt
+    monkeypatch.setattr(security, "verify_password", None)
+    assert hasher.verify("secret", hashed)
+
+def test_hasher_cache_not_shared_between_hashes():
+    hasher = PasswordHasher(workers=0)
+    assert hasher.verify("secret", hasher.hash("secret", ROUNDS))
+    assert not hasher.verify("secret", hasher.hash("other", ROUNDS))
+
+def test_hasher_cache_expiry():
+    hasher = PasswordHasher(workers=0, cache_seconds=-1)
+    hashed = hasher.hash("secret", ROUNDS)
+    hasher.verify("secret", hashed)
+    assert len(hasher._cache) == 1
+    assert not hasher._cached(hasher._digest("secret", hashed))
+    assert len(hasher._cache) == 0
+
+def test_hasher_cache_size():
+    hasher = PasswordHasher(workers=0, cache_size=2)
+    for password in ("a", "b", "c"):
+        hasher.verify(password, hash_password(password, ROUNDS))
+    assert len(hasher._cache) == 2
+
+def test_hasher_cache_disabled():
+    hasher = PasswordHasher(workers=0, cache_size=0)
+    hasher.verify("secret", hasher.hash("secret", ROUNDS))
+    assert len(hasher._cache) == 0
+
+def test_hasher_busy():
+    hasher = PasswordHasher(workers=0, max_pending=1, timeout=0.01)
+    started, release = threading.Event(), threading.Event()
+
+    def slow(*args):
+        started.set()
+        release.wait()
+
+    thread = threading.Thread(target=hasher._call, args=(slow, ))
+    thread.start()
+    started.wait()
+    try:
+        with pytest.raises(PasswordHasherBusyError):
+            hasher.hash("secret", ROUNDS)
+    finally:
+        release.set()
+        thread.join()
+    # The slot is freed once the call in flight finishes
+    assert hasher.verify("secret", hasher.hash("secret", ROUNDS))
+
+# === Logins ===
+@pytest.fixture
+def outdated_user(database, monkeypatch):
+    """alice, hashed at a lower cost than BCRYPT_ROUNDS. Returns her hash."""
+    monkeypatch.setattr(db, "password_hasher", PasswordHasher(workers=0))
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", ROUNDS + 1)
+    hashed = hash_password("secret", ROUNDS)
+    db.create_user("alice", hashed)
+    return hashed
+
+def stored_hash(username: str) -> bytes:
+    return db.connections.get().execute("SELECT hash FROM users WHERE username = ?", (username, )).fetchone()[0]
+
+def test_login_rehashes_outdated_cost(outdated_user):
+    assert db.check_password("alice", "secret")
+    hashed = stored_hash("alice")
+    assert hashed != outdated_user
+    assert hash_rounds(hashed) == ROUNDS + 1
+    assert verify_password("secret", hashed)
+    # Already at the current cost, so left alone
+    assert db.check_password("alice", "secret")
+    assert stored_hash("alice") == hashed
+
+def test_failed_login_keeps_hash(outdated_user):
+    assert not db.check_password("alice", "wrong")
+    assert stored_hash("alice") == outdated_user
+    assert not db.check_password("bob", "secret")
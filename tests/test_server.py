@@ -0,0 +1,154 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from utils import db, security, server
+from utils.fx import rate_cache
+from utils.loadgen import Client
+from utils.rate_sources import RateSource
+from utils.security import PasswordHasher, hash_password
+from utils.server import TradingServer
+from utils.user import current_user
+
+# Lowest cost bcrypt accepts, to keep tests fast
+ROUNDS = 4
+
+class FixedSource(RateSource):
+    """Serves the same rates every fetch."""
+    def fetch(self):
+        return int(time.time()), {"EUR": "0.9", "GBP": "0.8", "JPY": "150", "CHF": "0.9",
+                                  "AUD": "1.5", "CAD": "1.4"}
+
+@pytest.fixture
+def users(database, monkeypatch):
+    monkeypatch.setattr(rate_cache, "source", FixedSource())
+    rate_cache.clear()
+    # bcrypt on the calling thread, at the cost the users are hashed with so logins don't rehash
+    hasher = PasswordHasher(workers=0)
+    monkeypatch.setattr(db, "password_hasher", hasher)
+    monkeypatch.setattr(server, "password_hasher", hasher)
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", ROUNDS)
+    for username in ("alice", "bob"):
+        db.create_user(username, hash_password("secret", ROUNDS))
+    yield
+    rate_cache.clear()
+
+def run(session):
+    """Runs session(port) against a TradingServer on a free port, then shuts the server down."""
+    async def main():
+        trading_server = TradingServer(workers=4)
+        listener = await trading_server.start_tcp("127.0.0.1", 0)
+        try:
+            return await session(listener.sockets[0].getsockname()[1])
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            trading_server.close()
+    return asyncio.run(main())
+
+async def login(port: int, username: str) -> Client:
+    client = await Client.connect("127.0.0.1", port)
+    assert await client.request("login", username=username, password="secret") == {"ok": True, "username": username}
+    return client
+
+def test_login_trade_portfolio(users):
+    async def session(port):
+        client = await Client.connect("127.0.0.1", port)
+        try:
+            assert await client.request("portfolio") == {"ok": False, "error": "not logged in"}
+            assert await client.request("login", username="alice", password="wrong") == {
+                "ok": False, "error": "user or password incorrect"}
+            assert await client.request("login", username=" Alice ", password="secret") == {
+                "ok": True, "username": "alice"}
+
+            quote = await client.request("quote", side="buy", ccy="EUR", quantity="100", id=7)
+            assert quote["ok"] and quote["id"] == 7
+            assert (quote["sold"], quote["bought"], quote["fx_rate"]) == (
+                {"ccy": "USD", "quantity": "100.00"}, {"ccy": "EUR", "quantity": "90.00"}, "0.9")
+            assert await client.request("trade", quote_id=quote["quote_id"]) == {
+                "ok": True, "balances": {"EUR": "90.00", "USD": "9900.00"}}
+            # A quote trades once
+            assert await client.request("trade", quote_id=quote["quote_id"]) == {"ok": False, "error": "unknown quote"}
+
+            portfolio = await client.request("portfolio")
+            assert portfolio["ok"]
+            assert (portfolio["balances"]["EUR"], portfolio["balances"]["USD"]) == ("90.00", "9900.00")
+
+            quote = await client.request("quote", side="sell", ccy="EUR", quantity="91")
+            assert await client.request("trade", quote_id=quote["quote_id"]) == {
+                "ok": False, "error": "insufficient funds"}
+            assert await client.request("logout") == {"ok": True}
+            assert await client.request("portfolio") == {"ok": False, "error": "not logged in"}
+        finally:
+            await client.close()
+
+    run(session)
+    [entry] = db.get_trade_history(db.get_user_id("alice"))
+    assert (entry.bought.quantity_str, entry.sold.quantity_str) == ("90.00", "100.00")
+
+def test_malformed_requests(users):
+    async def session(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        responses = []
+        for line in (b"{not json", b"[1, 2]", b"", b'{"op": "fly", "id": "a"}', b'{"id": 3}',
+                     b'{"op": "login", "username": "alice"}', b'{"op": "cancel", "order_id": "1"}'):
+            writer.write(line + b"\n")
+            await writer.drain()
+            if line:
+                responses.append(json.loads(await reader.readline()))
+        writer.close()
+        await writer.wait_closed()
+        return responses
+
+    assert run(session) == [
+        {"ok": False, "error": "invalid JSON"},
+        {"ok": False, "error": "invalid JSON"},
+        {"ok": False, "error": "unknown op", "id": "a"},
+        {"ok": False, "error": "unknown op", "id": 3},
+        {"ok": False, "error": "username and password required"},
+        {"ok": False, "error": "not logged in"},
+    ]
+
+def test_sessions_isolated(users, monkeypatch):
+    # Records the current user of each portfolio request, as the executor thread sees it
+    seen = []
+    get_portfolio = server.get_portfolio
+
+    def recording_get_portfolio(username):
+        seen.append((username, current_user().username))
+        return get_portfolio(username)
+
+    monkeypatch.setattr(server, "get_portfolio", recording_get_portfolio)
+
+    async def trader(port: int, username: str, ccy: str) -> list[dict]:
+        client = await login(port, username)
+        try:
+            portfolios = []
+            for _ in range(10):
+                quote = await client.request("quote", side="buy", ccy=ccy, quantity="1")
+                assert (await client.request("trade", quote_id=quote["quote_id"]))["ok"]
+                portfolios.append((await client.request("portfolio"))["balances"])
+                await asyncio.sleep(0)
+            return portfolios
+        finally:
+            await client.close()
+
+    async def session(port):
+        anonymous = await Client.connect("127.0.0.1", port)
+        try:
+            alice, bob = await asyncio.gather(trader(port, "alice", "EUR"), trader(port, "bob", "GBP"))
+            # Neither login leaked into a session that didn't log in
+            assert await anonymous.request("portfolio") == {"ok": False, "error": "not logged in"}
+            return alice, bob
+        finally:
+            await anonymous.close()
+
+    alice, bob = run(session)
+    assert (alice[-1]["USD"], alice[-1]["EUR"], alice[-1]["GBP"]) == ("9990.00", "9.00", "0.00")
+    assert (bob[-1]["USD"], bob[-1]["EUR"], bob[-1]["GBP"]) == ("9990.00", "0.00", "8.00")
+    assert len(seen) == 20
+    assert all(username == current for username, current in seen)
+    # Nor into the test's own context
+    assert current_user().username is None
@@ -0,0 +1,213 @@
+from datetime import datetime
+from decimal import Decimal
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from utils import db
+from utils.currency import CCY, Currency
+
+USD, EUR, JPY = CCY.USD, CCY.EUR, CCY.JPY
+
+@pytest.fixture
+def users(database):
+    """alice and bob, each with the initial balances."""
+    db.create_user("alice", b"")
+    db.create_user("bob", b"")
+    return db.get_user_id("alice"), db.get_user_id("bob")
+
+@pytest.fixture
+def committer():
+    committer = db.GroupCommitter()
+    yield committer
+    committer.close()
+
+def usd(quantity: str) -> Currency:
+    return Currency.from_string(USD, quantity)
+
+def eur(quantity: str) -> Currency:
+    return Currency.from_string(EUR, quantity)
+
+def balance(uid: int, ccy: CCY) -> Currency:
+    return db.get_currency_owned(ccy, db.User(uid, ""))
+
+def trade_count() -> int:
+    return db.connections.get().execute("SELECT COUNT(*) FROM trades").fetchone()[0]
+
+# === execute_trade ===
+def test_execute_trade(users):
+    alice, _ = users
+    assert db.execute_trade(alice, eur("90"), usd("100"), Decimal("0.9"), datetime.now()) == (eur("90"), usd("9900"))
+    assert (balance(alice, EUR), balance(alice, USD)) == (eur("90"), usd("9900"))
+    assert trade_count() == 1
+
+def test_execute_trade_overdraw(users):
+    alice, _ = users
+    with pytest.raises(db.InsufficientFundsError):
+        db.execute_trade(alice, eur("9000.01"), usd("10000.01"))
+    assert (balance(alice, EUR), balance(alice, USD)) == (eur("0"), usd("10000"))
+    assert trade_count() == 0
+
+def test_execute_trade_concurrent_overdraw(users):
+    alice, _ = users
+    # Two trades of 6000 from a balance of 10000, only one of which fits
+    barrier = threading.Barrier(2)
+    results = []
+
+    def trade():
+        barrier.wait()
+        try:
+            results.append(db.execute_trade(alice, eur("5400"), usd("6000")))
+        except db.InsufficientFundsError as e:
+            results.append(e)
+        finally:
+            db.connections.release()
+
+    for _ in range(20):
+        threads = [threading.Thread(target=trade) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Refills alice for the next round
+        if balance(alice, USD) < usd("6000"):
+            db.execute_trade(alice, usd("6000"), eur("5400"))
+
+    filled = [result for result in results if not isinstance(result, Exception)]
+    assert len(results) == 40
+    assert len(filled) == 20
+    assert all(sold == usd("4000") for _, sold in filled)
+    assert (balance(alice, EUR), balance(alice, USD)) == (eur("0"), usd("10000"))
+
+# === execute_trades ===
+def test_execute_trades_rolls_back_only_rejected(users):
+    alice, bob = users
+    quote_time = datetime.now()
+    results = db.execute_trades([
+        (alice, eur("90"), usd("100"), Decimal("0.9"), quote_time),
+        (bob, eur("9000"), usd("10000.01"), Decimal("0.9"), quote_time),
+        (bob, eur("45"), usd("50"), Decimal("0.9"), quote_time),
+    ])
+    assert results[0] == (eur("90"), usd("9900"))
+    assert isinstance(results[1], db.InsufficientFundsError)
+    assert results[2] == (eur("45"), usd("9950"))
+
+    assert (balance(alice, EUR), balance(alice, USD)) == (eur("90"), usd("9900"))
+    assert (balance(bob, EUR), balance(bob, USD)) == (eur("45"), usd("9950"))
+    assert [(entry.bought, entry.sold) for entry in db.get_trade_history(bob)] == [(eur("45"), usd("50"))]
+    assert trade_count() == 2
+
+def test_execute_trades_later_trades_see_earlier(users):
+    alice, _ = users
+    results = db.execute_trades([(alice, eur("4500"), usd("5000"), None, None)] * 3)
+    assert results[:2] == [(eur("4500"), usd("5000")), (eur("9000"), usd("0"))]
+    assert isinstance(results[2], db.InsufficientFundsError)
+    assert balance(alice, USD) == usd("0")
+
+# === Ledger ===
+def test_trade_history_pages(users):
+    alice, bob = users
+    for i in range(1, 6):
+        db.execute_trade(alice, eur(str(i)), usd(str(i)), Decimal("1"), datetime.now())
+    db.execute_trade(bob, eur("1"), usd("1"))
+
+    first = db.get_trade_history(alice, limit=2)
+    assert [entry.bought for entry in first] == [eur("5"), eur("4")]
+    second = db.get_trade_history(alice, limit=2, before_id=first[-1].trade_id)
+    assert [entry.bought for entry in second] == [eur("3"), eur("2")]
+    last = db.get_trade_history(alice, limit=2, before_id=second[-1].trade_id)
+    assert [entry.bought for entry in last] == [eur("1")]
+    assert db.get_trade_history(alice, limit=2, before_id=last[-1].trade_id) == []
+
+    entry = first[0]
+    assert (entry.sold, entry.fx_rate) == (usd("5"), Decimal("1"))
+    assert entry.quote_time is not None and entry.executed_at is not None
+    # Without a rate or quote time
+    [bob_entry] = db.get_trade_history(bob)
+    assert (bob_entry.fx_rate, bob_entry.quote_time) == (None, None)
+
+@pytest.mark.parametrize("statement", [
+    "UPDATE trades SET bought_quantity = 0",
+    "DELETE FROM trades",
+])
+def test_trades_append_only(users, statement):
+    alice, _ = users
+    db.execute_trade(alice, eur("90"), usd("100"))
+    with pytest.raises(sqlite3.DatabaseError, match="append-only"):
+        db.connections.get().execute(statement)
+    [entry] = db.get_trade_history(alice)
+    assert (entry.bought, entry.sold) == (eur("90"), usd("100"))
+
+# === GroupCommitter ===
+def test_group_commit_batches(users, committer, monkeypatch):
+    alice, bob = users
+    groups = []
+    release = threading.Event()
+    execute_trades = db.execute_trades
+
+    def blocking_execute_trades(trades):
+        trades = list(trades)
+        groups.append(len(trades))
+        # Holds the first group so the rest queue up behind it
+        release.wait(5)
+        return execute_trades(trades)
+
+    monkeypatch.setattr(db, "execute_trades", blocking_execute_trades)
+    results = {}
+
+    def trade(i: int):
+        results[i] = committer.execute(alice if i % 2 else bob, eur("1"), usd("1"))
+
+    threads = [threading.Thread(target=trade, args=(0, ))]
+    threads[0].start()
+    deadline = time.monotonic() + 5
+    while not groups and time.monotonic() < deadline:
+        time.sleep(0.01)
+    threads += [threading.Thread(target=trade, args=(i, )) for i in range(1, 11)]
+    for thread in threads[1:]:
+        thread.start()
+    while committer._queue.qsize() < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert groups == [1, 10]
+    assert len(results) == 11
+    assert balance(alice, EUR) == eur("5")
+    assert balance(bob, EUR) == eur("6")
+    assert trade_count() == 11
+
+def test_group_commit_raises_trade_errors(users, committer):
+    alice, _ = users
+    with pytest.raises(db.InsufficientFundsError):
+        committer.execute(alice, eur("9000"), usd("10000.01"))
+    assert committer.execute(alice, eur("90"), usd("100")) == (eur("90"), usd("9900"))
+
+def test_group_commit_survives_unexpected_errors(users, committer, monkeypatch):
+    alice, _ = users
+    execute_trades = db.execute_trades
+
+    def failing_execute_trades(trades):
+        raise ValueError("unexpected")
+
+    monkeypatch.setattr(db, "execute_trades", failing_execute_trades)
+    with pytest.raises(ValueError, match="unexpected"):
+        committer.execute(alice, eur("90"), usd("100"))
+    monkeypatch.setattr(db, "execute_trades", execute_trades)
+    # The committer thread is still running
+    assert committer.execute(alice, eur("90"), usd("100")) == (eur("90"), usd("9900"))
+
+def test_group_commit_close(users, committer):
+    alice, _ = users
+    committer.execute(alice, eur("1"), usd("1"))
+    thread = committer._thread
+    committer.close()
+    assert not thread.is_alive()
+    assert committer._thread is None
+    committer.close()
+    # Starts again
+    assert committer.execute(alice, eur("1"), usd("1")) == (eur("2"), usd("9998"))
+    assert committer._thread.is_alive()
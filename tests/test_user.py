@@ -0,0 +1,61 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from utils.user import User, as_user, current_user, user
+
+# === Current user ===
+def test_current_user_defaults_to_singleton():
+    assert current_user() is user
+
+def test_as_user_sets_and_restores():
+    alice = User(1, "alice")
+    with as_user(alice) as session:
+        assert session is alice
+        assert current_user() is alice
+    assert current_user() is user
+
+def test_as_user_nested():
+    alice, bob = User(1, "alice"), User(2, "bob")
+    with as_user(alice):
+        with as_user(bob):
+            assert current_user() is bob
+        assert current_user() is alice
+
+def test_as_user_restores_on_error():
+    try:
+        with as_user(User(1, "alice")):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert current_user() is user
+
+# === Current user: Isolation ===
+def test_threads_isolated():
+    barrier = threading.Barrier(4)
+
+    def work(uid):
+        with as_user(User(uid, f"user{uid}")):
+            # Every thread has set its user before any checks
+            barrier.wait()
+            return current_user().uid
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert list(pool.map(work, range(4))) == list(range(4))
+    assert current_user() is user
+
+def test_tasks_isolated():
+    async def work(uid, event):
+        with as_user(User(uid, f"user{uid}")):
+            await event.wait()
+            return current_user().uid
+
+    async def run():
+        event = asyncio.Event()
+        tasks = [asyncio.create_task(work(uid, event)) for uid in range(4)]
+        await asyncio.sleep(0)
+        event.set()
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == list(range(4))
+    assert current_user() is user
@@ -0,0 +1,61 @@
+from decimal import Decimal
+import random
+
+import pytest
+
+from utils import db
+from utils.currency import BASE_CURRENCY, CCY, Currency
+from utils.valuation import value_portfolios
+
+USERS = 60
+
+def random_minor(rng: random.Random) -> int:
+    """A balance in minor units, from empty up to the largest SQLite can store."""
+    return rng.choice([
+        0,
+        rng.randint(1, 10 ** 6),
+        rng.randint(10 ** 6, 10 ** 15),
+        rng.randint(10 ** 15, 2 ** 63 - 1),
+    ])
+
+def random_rate(rng: random.Random, ccy: CCY) -> Decimal:
+    """A rate with up to 6 decimal places, around 150 for JPY and around 1 otherwise."""
+    scale = 150 if ccy == CCY.JPY else 1
+    return Decimal(rng.randint(1, 2 * scale * 10 ** 6)).scaleb(-6)
+
+@pytest.fixture
+def portfolios(database):
+    rng = random.Random(0)
+    for i in range(USERS):
+        db.create_user(f"user{i}", b"")
+    db.connections.get().executemany(
+        "UPDATE portfolio SET quantity = ? WHERE user_id = ? AND currency = ?",
+        [(random_minor(rng), uid, ccy.name) for uid in range(1, USERS + 1) for ccy in CCY])
+    return rng
+
+@pytest.mark.parametrize("chunk_size", [7, 100_000])
+def test_value_portfolios_matches_scalar(portfolios, chunk_size):
+    rng = portfolios
+    for _ in range(5):
+        rates = {ccy: random_rate(rng, ccy) for ccy in CCY if ccy != BASE_CURRENCY}
+        valuation = value_portfolios(rates, chunk_size=chunk_size)
+        assert len(valuation) == USERS
+        expected = {uid: db.get_portfolio(f"user{uid - 1}").value(rates) for uid in range(1, USERS + 1)}
+        assert dict(valuation.items()) == expected
+        assert valuation.total() == Currency.from_minor(BASE_CURRENCY, sum(value.minor for value in expected.values()))
+
+def test_value_portfolios_large_jpy(database):
+    db.create_user("alice", b"")
+    db.connections.get().execute("UPDATE portfolio SET quantity = ? WHERE currency = 'JPY'", (2 ** 63 - 1, ))
+    rates = {ccy: Decimal("0.000001") if ccy == CCY.JPY else Decimal("1") for ccy in CCY if ccy != BASE_CURRENCY}
+    # Beyond int64 once converted
+    expected = db.get_portfolio("alice").value(rates)
+    assert expected.minor > 2 ** 63
+    assert value_portfolios(rates).get(1) == expected
+
+def test_value_portfolios_selected_users(portfolios):
+    rates = {ccy: random_rate(portfolios, ccy) for ccy in CCY if ccy != BASE_CURRENCY}
+    valuation = value_portfolios(rates, [3, 1, USERS + 1])
+    assert [uid for uid, _ in valuation.items()] == [1, 3]
+    assert valuation.get(3) == db.get_portfolio("user2").value(rates)
+    assert valuation.get(2) is None